@@ -35,27 +35,59 @@ __status__ = "Development"
 
 import sys
 import argparse
+import copy
 from src.breadcrumbs.src.AbundanceTable import AbundanceTable
 from src.breadcrumbs.src.ConstantsBreadCrumbs import ConstantsBreadCrumbs
+from src.breadcrumbs.src.DistanceCache import DistanceCache
 from src.breadcrumbs.src.Metric import Metric
+from src.breadcrumbs.src.KMedoids import Clara
 from src.breadcrumbs.src.KMedoids import Kmedoids
-from src.breadcrumbs.src.MLPYDistanceAdaptor import MLPYDistanceAdaptor
 from src.breadcrumbs.src.SVM import SVM
 from src.breadcrumbs.src.UtilityMath import UtilityMath
 
 from src.ConstantsMicropita import ConstantsMicropita
 import csv
+import json
 import logging
 import math
 import mlpy
+import multiprocessing
 import numpy as np
 import operator
 import os
 import random
 import scipy.cluster.hierarchy as hcluster
 import scipy.spatial.distance
+import threading
+from multiprocessing.pool import ThreadPool
 from types import *
 
+#fastcluster builds the same linkages as scipy faster, it is used for extreme selection when installed
+try:
+	import fastcluster
+except ImportError:
+	fastcluster = None
+
+#MicroPITA object, strata and settings shared with the worker processes running strata
+#Set before the worker pool is created so it is inherited by the workers
+_dictSharedStratumRun = dict()
+
+def _funcRunSharedStratum(tpleStratum):
+	"""
+	Worker process entry point running the selection methods on one stratum (see MicroPITA._funcRunStratum).
+
+	:param	tpleStratum:	(Index of the stratum, seed of the stratum's random generator)
+	:type:	Tuple of integers
+	:return	Tuple:	(Selected samples, supervised input lines, supervised distances, feature count) of the stratum.
+	"""
+
+	iStratum, iSeed = tpleStratum
+	stratAbundanceTable = _dictSharedStratumRun["tables"][iStratum]
+	dictSelectedSamples, dictSVMLines, dictPredictDistances = dict(), dict(), dict()
+	_dictSharedStratumRun["microPITA"]._funcRunStratum(stratAbundanceTable=stratAbundanceTable, dictSelectedSamples=dictSelectedSamples,
+		dictSVMLines=dictSVMLines, dictPredictDistances=dictPredictDistances, rndRandom=random.Random(iSeed), **_dictSharedStratumRun["args"])
+	return (dictSelectedSamples, dictSVMLines, dictPredictDistances, stratAbundanceTable.funcGetFeatureCount())
+
 class MicroPITA:
 	"""
 	Selects samples from a first tier of a multi-tiered study to be used in a second tier.
@@ -95,6 +127,208 @@ class MicroPITA:
 	#Linkage used in the Hierarchical clustering
 	c_strHierarchicalClusterMethod = 'average'
 
+	#Centroids of the labels in supervised (distinct and discriminant) selection
+	c_strSupervisedCentroidMean = "mean"
+	c_strSupervisedCentroidMedian = "median"
+	c_strSupervisedCentroidMedoid = "medoid"
+	c_lsSupervisedCentroids = [c_strSupervisedCentroidMean,c_strSupervisedCentroidMedian,c_strSupervisedCentroidMedoid]
+
+	#Extreme selection algorithms
+	#hclust takes samples in the order they join the average linkage clustering, pairs takes samples from the most distant pairs
+	c_strExtremeHClust = "hclust"
+	c_strExtremePairs = "pairs"
+	c_lsExtremeMethods = [c_strExtremeHClust,c_strExtremePairs]
+
+	#K-medoids algorithms for representative selection
+	#PAM uses the full distance matrix, CLARA runs PAM on subsamples and measures distances on demand
+	c_strRepresentativePAM = "pam"
+	c_strRepresentativeCLARA = "clara"
+	c_lsRepresentativeMethods = [c_strRepresentativePAM,c_strRepresentativeCLARA]
+
+	#Initial medoid selection of k-medoids (see KMedoids.Kmedoids)
+	c_strKMedoidsInitRandom = "random"
+	c_lsKMedoidsInits = [c_strKMedoidsInitRandom,"build","kmedoids++"]
+
+	#Separates the representative method name from the sample count of each selection of a sweep
+	c_strRepresentativeSweepSeparator = "_k"
+
+	#Relative growth of a cluster's cost (since it was last refined) which triggers refining its medoid in incremental representative selection
+	c_dRepresentativeRefineThreshold = 0.1
+
+	def __init__(self, strDistanceCacheDirectory=None, strRepresentativeMethod=c_strRepresentativePAM, iClaraSamples=5, iClaraSampleSize=None,
+				strKMedoidsInit=c_strKMedoidsInitRandom, iKMedoidsRestarts=1, liRepresentativeSweep=None,
+				strRepresentativeStateFile=None, dRepresentativeRefineThreshold=c_dRepresentativeRefineThreshold, strExtremeMethod=c_strExtremeHClust,
+				strSupervisedMetric=c_strBrayCurtisDissimilarity, strSupervisedCentroid=c_strSupervisedCentroidMean, iThreads=1):
+		"""
+		Constructor.
+
+		:param	strDistanceCacheDirectory:	Directory to keep measured distance matrices in so later runs on the same data reuse them.
+		:type:	String	Directory path (None keeps the distance cache in memory only).
+		:param	strRepresentativeMethod:	K-medoids algorithm used for representative selection (MicroPITA.c_lsRepresentativeMethods).
+		:type:	String
+		:param	iClaraSamples:	Number of subsamples clustered by CLARA.
+		:type:	Integer
+		:param	iClaraSampleSize:	Samples in each CLARA subsample (None uses 40 + 2 * the number of samples selected).
+		:type:	Integer
+		:param	strKMedoidsInit:	Initial medoid selection of PAM (MicroPITA.c_lsKMedoidsInits).
+		:type:	String
+		:param	iKMedoidsRestarts:	Number of PAM restarts (run in parallel), the lowest cost clustering is kept.
+		:type:	Integer
+		:param	liRepresentativeSweep:	Sample counts to select representative samples for in one run (None selects the given count only).
+		:type:	List of integers
+		:param	strRepresentativeStateFile:	File keeping the medoids and cluster assignments of representative selection between runs,
+						later runs only assign new samples (see funcUpdateCentralSamplesByKMedoids). None clusters all samples each run.
+		:type:	String	File path
+		:param	dRepresentativeRefineThreshold:	Relative growth of a cluster's cost which triggers refining its medoid in incremental representative selection.
+		:type:	Double
+		:param	strExtremeMethod:	Algorithm used for extreme selection (MicroPITA.c_lsExtremeMethods).
+		:type:	String
+		:param	strSupervisedMetric:	Beta metric measuring distances from label centroids in supervised selection (brays-curtis or one of Metric.setBetaDiversities).
+		:type:	String
+		:param	strSupervisedCentroid:	Centroid of each label in supervised selection (MicroPITA.c_lsSupervisedCentroids).
+		:type:	String
+		:param	iThreads:	Number of threads running the diversity, representative and extreme methods (and the distances they share) at the same time.
+		:type:	Integer
+		"""
+
+		#Representative selection settings
+		self.strRepresentativeMethod = strRepresentativeMethod
+		self.iClaraSamples = iClaraSamples
+		self.iClaraSampleSize = iClaraSampleSize
+		self.strKMedoidsInit = strKMedoidsInit
+		self.iKMedoidsRestarts = iKMedoidsRestarts
+		self.liRepresentativeSweep = sorted(set(liRepresentativeSweep)) if liRepresentativeSweep else None
+		self.strRepresentativeStateFile = strRepresentativeStateFile
+		self.dRepresentativeRefineThreshold = dRepresentativeRefineThreshold
+
+		#Extreme selection settings
+		self.strExtremeMethod = strExtremeMethod
+
+		#Supervised selection settings
+		self.strSupervisedMetric = strSupervisedMetric
+		self.strSupervisedCentroid = strSupervisedCentroid
+
+		#Threads running selection methods
+		self.iThreads = iThreads
+
+		#Distance matrices shared by the methods (and strata) of this object
+		self.dcDistanceCache = DistanceCache(strCacheDirectory=strDistanceCacheDirectory)
+
+		#Distance matrices of all samples which do not depend on the abundance table (see funcLoadCohortDistances)
+		#{"Metric":(Condensed distance matrix, {"Sample name":index})}
+		self._dictCohortDistances = dict()
+
+		#Lock around reading and rewriting the representative state file while methods run in threads
+		#or strata in worker processes (see funcRun)
+		self._lckRepresentativeState = threading.Lock()
+
+	def _funcGetBetaMetric(self, npadAbundancies=None, sMetric=None, istrmTree=None, istrmEnvr=None, lsSampleOrder=None, fAdditiveInverse=False, fSummed=None, fNormalized=None, lsFeatureNames=None):
+		"""
+		Gets a beta metric matrix (as Metric.funcGetBetaMetric) reusing matrices already measured on the same abundance data.
+
+		:param	npadAbundancies:	Numpy array where row=samples and columns=features.
+		:type:	Numpy Array
+		:param	sMetric:	String name of beta metric.
+		:type:	String
+		:param	fAdditiveInverse:	Return 1 - the beta metric.
+		:type:	Boolean
+		:param	fSummed:	Indicator of the abundance data being summed (part of the cache key).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (part of the cache key).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (matched to the tree tips by unifrac when no environment file is given).
+		:type:	List of strings
+		:return	Numpy array or Boolean:	Condensed distance matrix (tuple with sample names for unifrac) or False on error.
+		"""
+
+		if DistanceCache.funcIsCacheable(sMetric):
+			return self.dcDistanceCache.funcGetDistance(npaAbundance=npadAbundancies, sMetric=sMetric, fSummed=fSummed,
+				fNormalized=fNormalized, fAdditiveInverse=fAdditiveInverse)
+		return Metric.funcGetBetaMetric(npadAbundancies=npadAbundancies, sMetric=sMetric, istrmTree=istrmTree, istrmEnvr=istrmEnvr,
+			lsSampleOrder=lsSampleOrder, fAdditiveInverse=fAdditiveInverse, lsFeatureNames=lsFeatureNames)
+
+	def funcLoadCohortDistances(self, lsBetaMetrics=None, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None):
+		"""
+		Reads (or measures) once the distance matrices of all samples which do not depend on the abundance table,
+		a precalculated beta matrix or unifrac with an environment file. Representative and extreme selection then take the
+		samples they need (for instance of each stratum) from these matrices instead of reading or measuring them again.
+		Matrices loaded by an earlier call are dropped.
+
+		:param	lsBetaMetrics:	Beta metrics which will be used.
+		:type:	List of strings
+		:param	istmBetaMatrix:	File that has a precalculated beta matrix
+		:type:	File path string
+		:param	istrmTree:	File containing tree for phylogentic beta-diversity analysis
+		:type:	File path string or stream
+		:param	istrmEnvr:	File containing environment for phylogentic beta-diversity analysis
+		:type:	File path string or stream
+		:return	Boolean:	False on error.
+		"""
+
+		self._dictCohortDistances = dict()
+
+		lxDistances = []
+		if istmBetaMatrix:
+			lxDistances.append((ConstantsMicropita.c_custom,Metric.funcReadMatrixFile(istmMatrixFile=istmBetaMatrix,fCondensed=True)))
+		elif istrmTree and istrmEnvr:
+			for sMetric in set(lsBetaMetrics or []) & set([Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]):
+				lxDistances.append((sMetric,Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,fWeighted=(sMetric == Metric.c_strUnifracWeighted))))
+
+		for sMetric, xDistances in lxDistances:
+			if (type(xDistances) is BooleanType) or (type(xDistances[0]) is BooleanType):
+				logging.error("MicroPITA.funcLoadCohortDistances:: Could not read in the distance matrix for "+str(sMetric)+".")
+				self._dictCohortDistances = dict()
+				return False
+			#An all zero matrix is read as empty, a condensed matrix holds a distance for each pair of samples
+			iSampleCount = len(xDistances[1])
+			if not len(xDistances[0]) == (iSampleCount*(iSampleCount-1))//2:
+				logging.error("MicroPITA.funcLoadCohortDistances:: The distance matrix for "+str(sMetric)+" has "+str(len(xDistances[0]))+
+					" distances, expected "+str((iSampleCount*(iSampleCount-1))//2)+" for "+str(iSampleCount)+" samples.")
+				self._dictCohortDistances = dict()
+				return False
+			self._dictCohortDistances[sMetric] = (xDistances[0],dict([[sSample,iIndex] for iIndex, sSample in enumerate(xDistances[1])]))
+		return True
+
+	def _funcGetDistanceMatrix(self, npaMatrix, sMetric, lsSampleNames, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fAdditiveInverse=False, fSummed=None, fNormalized=None, lsFeatureNames=None):
+		"""
+		Gets the condensed distance matrix of the samples. Distances loaded by funcLoadCohortDistances are used when available,
+		otherwise the precalculated beta matrix is read or the beta metric is measured.
+
+		:param	npaMatrix:	Numpy array where row=samples and columns=features.
+		:type:	Numpy array
+		:param	sMetric:	String name of beta metric (ignored if istmBetaMatrix is given).
+		:type:	String
+		:param	lsSampleNames:	The names of the samples (rows of npaMatrix).
+		:type:	List of strings
+		:param	istmBetaMatrix:	File with beta-diversity matrix
+		:type:	File path string
+		:param	fAdditiveInverse:	Return 1 - the distance.
+		:type:	Boolean
+		:return	Numpy array or Boolean:	Condensed distance matrix or False on error.
+		"""
+
+		#Take the samples from the cohort matrix
+		sCohortMetric = ConstantsMicropita.c_custom if istmBetaMatrix else sMetric
+		if sCohortMetric in self._dictCohortDistances:
+			npaDistance, dictSampleIndex = self._dictCohortDistances[sCohortMetric]
+			lsMissingSamples = [sSample for sSample in lsSampleNames if not sSample in dictSampleIndex]
+			if lsMissingSamples:
+				logging.error("MicroPITA._funcGetDistanceMatrix:: Samples were not in the distance matrix: "+", ".join(lsMissingSamples))
+				return False
+			npaDistance = Metric.funcGetCondensedSubMatrix(npaDistance,[dictSampleIndex[sSample] for sSample in lsSampleNames])
+		elif istmBetaMatrix:
+			npaDistance = (Metric.funcReadMatrixFile(istmMatrixFile=istmBetaMatrix,lsSampleOrder=lsSampleNames,fCondensed=True) or [False])[0]
+		else:
+			npaDistance = self._funcGetBetaMetric(npadAbundancies=npaMatrix, sMetric=sMetric, istrmTree=istrmTree, istrmEnvr=istrmEnvr, lsSampleOrder=lsSampleNames,
+				fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
+			#Unifrac returns the sample names with the matrix
+			if (sMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]) and not type(npaDistance) is BooleanType:
+				npaDistance = npaDistance[0]
+
+		if type(npaDistance) is BooleanType:
+			return False
+		return 1.0 - npaDistance if fAdditiveInverse else npaDistance
+
 ####Group 1## Diversity
 	#Testing: Happy path Testing (8)
 	def funcGetTopRankedSamples(self, lldMatrix = None, lsSampleNames = None, iTopAmount = None):
@@ -111,22 +345,19 @@ class MicroPITA:
 		:type:	integer	Integer amount of sample names/ indices to return.
 		:return	List:	List of samples to be selected.
 		"""
-		topRankListRet = []
-		for rowMetrics in lldMatrix:
-			#Create 2 d array to hold value and index and sort
-			liIndexX = [rowMetrics,range(len(rowMetrics))]
-			liIndexX[1].sort(key = liIndexX[0].__getitem__,reverse = True)
 
-			if lsSampleNames:
-				topRankListRet.append([lsSampleNames[iIndex] for iIndex in liIndexX[1][:iTopAmount]])
-			else:
-				topRankListRet.append(liIndexX[1][:iTopAmount])
+		#Indices of the highest measurements of each list, ties in sample order
+		topRankListRet = UtilityMath.funcGetTopIndices(npadMatrix=lldMatrix, iTopAmount=iTopAmount) if len(lldMatrix) else []
+
+		if lsSampleNames:
+			npaSampleNames = np.array(lsSampleNames, dtype=object)
+			topRankListRet = [list(npaSampleNames[liTopIndices]) for liTopIndices in topRankListRet]
 
 		return topRankListRet
 	
 	####Group 2## Representative Dissimilarity
 	#Testing: Happy path tested 1
-	def funcGetCentralSamplesByKMedoids(self, npaMatrix=None, sMetric=None, lsSampleNames=None, iNumberSamplesReturned=0, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None):
+	def funcGetCentralSamplesByKMedoids(self, npaMatrix=None, sMetric=None, lsSampleNames=None, iNumberSamplesReturned=0, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fSummed=None, fNormalized=None, lsFeatureNames=None):
 		"""
 		Gets centroid samples by k-medoids clustering of a given matrix.
 		
@@ -141,6 +372,12 @@ class MicroPITA:
 		:return	List:	List of selected samples.
 		:param	istmBetaMatrix: File with beta-diversity matrix
 		:type:	File stream or file path string
+		:param	fSummed:	Indicator of the abundance data being summed (used to reuse cached distances).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (used to reuse cached distances).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (used by unifrac without an environment file).
+		:type:	List of strings
 		"""
 
 		#Count of how many rows
@@ -153,31 +390,35 @@ class MicroPITA:
 		if sampleCount == iNumberSamplesReturned:
 			return list(lsSampleNames)
 
+		#CLARA measures distances on demand from the abundance matrix
+		if self.strRepresentativeMethod == self.c_strRepresentativeCLARA:
+			if istmBetaMatrix or not ((sMetric in [Metric.c_strBrayCurtisDissimilarity,Metric.c_strInvBrayCurtisDissimilarity]) or (sMetric in Metric.setBetaDiversities)):
+				logging.warning("MicroPITA.funcGetCentralSamplesByKMedoids:: CLARA requires a beta metric measured from the abundance table, using PAM for metric="+str(sMetric))
+			else:
+				medoidsMaker = Clara(k=iNumberSamplesReturned, cdist=lambda npaSamplesA, npaSamplesB: Metric.funcGetCrossDistance(npaSamplesA, npaSamplesB, sMetric),
+					samples=self.iClaraSamples, sample_size=self.iClaraSampleSize)
+				medoidsData = medoidsMaker.compute(np.asarray(npaMatrix, dtype=float))
+				logging.debug("MicroPITA.funcGetCentralSamplesByKMedoids:: Results from the CLARA method in representative selection:")
+				logging.debug(str(medoidsData))
+				return [lsSampleNames[iIndex] for iIndex in medoidsData[0]]
+
 		#Get distance matrix
-		distanceMatrix=scipy.spatial.distance.squareform(Metric.funcReadMatrixFile(istmMatrixFile=istmBetaMatrix,lsSampleOrder=lsSampleNames)[0]) if istmBetaMatrix else Metric.funcGetBetaMetric(npadAbundancies=npaMatrix, sMetric=sMetric, istrmTree=istrmTree, istrmEnvr=istrmEnvr, lsSampleOrder=lsSampleNames)
+		distanceMatrix = self._funcGetDistanceMatrix(npaMatrix=npaMatrix, sMetric=sMetric, lsSampleNames=lsSampleNames, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr,
+			fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
 		if type(distanceMatrix) is BooleanType:
 			logging.error("MicroPITA.funcGetCentralSamplesByKMedoids:: Could not read in the supplied distance matrix, returning false.")
 			return False
-
-		# Handle unifrac output
-		if sMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]:
-			distanceMatrix = distanceMatrix[0]
 	
 		#Log distance matrix
 		logging.debug("MicroPITA.funcGetCentralSamplesByKMedoids:: Distance matrix for representative selection using metric="+str(sMetric))
 	
-		distance = MLPYDistanceAdaptor(npaDistanceMatrix=distanceMatrix, fIsCondensedMatrix=True)
-	
-		#Create object to determine clusters/medoids
-		medoidsMaker = Kmedoids(k=iNumberSamplesReturned, dist=distance)
+		#Create object to determine clusters/medoids from the distance matrix
+		medoidsMaker = Kmedoids(k=iNumberSamplesReturned, dist="precomputed", init=self.strKMedoidsInit, n_init=self.iKMedoidsRestarts)
 		#medoidsData includes(1d numpy array, medoids indexes; 
 		#			  1d numpy array, non-medoids indexes;
 		#			  1d numpy array, cluster membership for non-medoids;
 		#			  double, cost of configuration)
-		#npaMatrix is samples x rows
-		#Build a matrix of lists of indicies to pass to the distance matrix
-		lliIndicesMatrix = [[iIndexPosition] for iIndexPosition in xrange(0,len(npaMatrix))]
-		medoidsData = medoidsMaker.compute(np.array(lliIndicesMatrix))
+		medoidsData = medoidsMaker.compute(scipy.spatial.distance.squareform(distanceMatrix, checks=False))
 		logging.debug("MicroPITA.funcGetCentralSamplesByKMedoids:: Results from the kmedoid method in representative selection:")
 		logging.debug(str(medoidsData))
 	
@@ -185,10 +426,257 @@ class MicroPITA:
 		#Return centroids
 		selectedIndexes = medoidsData[0]
 		return [lsSampleNames[selectedIndexes[index]] for index in xrange(0,iNumberSamplesReturned)]
+
+	def funcGetCentralSamplesByKMedoidsSweep(self, npaMatrix=None, sMetric=None, lsSampleNames=None, liNumberSamplesReturned=None, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fSummed=None, fNormalized=None, lsFeatureNames=None):
+		"""
+		Gets centroid samples by k-medoids clustering for several sample counts.
+		The distance matrix is read once and each count starts from the medoids of the previous (smaller) count.
+		Counts larger than the number of samples are skipped.
+		
+		:param	npaMatrix:	Numpy array where row=features and columns=samples
+		:type:	Numpy array	Abundance Data.
+		:param	sMetric:	String name of beta metric used as the distance metric.
+		:type:	String	String name of beta metric.
+		:param	lsSampleNames:	The names of the sample
+		:type:	List	List of strings
+		:param	liNumberSamplesReturned:	Numbers of samples to return.
+		:type:	List of integers
+		:param	istmBetaMatrix: File with beta-diversity matrix
+		:type:	File stream or file path string
+		:param	fSummed:	Indicator of the abundance data being summed (used to reuse cached distances).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (used to reuse cached distances).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (used by unifrac without an environment file).
+		:type:	List of strings
+		:return	List:	List of (sample count, list of selected samples) in increasing sample count or False on error.
+		"""
+
+		#Count of how many rows
+		sampleCount = npaMatrix.shape[0]
+		liCounts = sorted(set(liNumberSamplesReturned))
+		if liCounts[-1] > sampleCount:
+			logging.error("MicroPITA.funcGetCentralSamplesByKMedoidsSweep:: There are not enough samples to return the amount of samples specified. Return sample counts = "+str([iCount for iCount in liCounts if iCount > sampleCount])+". Sample number = "+str(sampleCount)+".")
+			liCounts = [iCount for iCount in liCounts if iCount <= sampleCount]
+		if not liCounts:
+			return False
+
+		#Returning all samples does not need clustering
+		ltplSelection = [(iCount,list(lsSampleNames)) for iCount in liCounts if iCount == sampleCount]
+		liCounts = [iCount for iCount in liCounts if iCount < sampleCount]
+		if not liCounts:
+			return ltplSelection
+
+		if self.strRepresentativeMethod == self.c_strRepresentativeCLARA:
+			logging.warning("MicroPITA.funcGetCentralSamplesByKMedoidsSweep:: Sample count sweeps use the distance matrix, using PAM.")
+
+		#Get distance matrix
+		distanceMatrix = self._funcGetDistanceMatrix(npaMatrix=npaMatrix, sMetric=sMetric, lsSampleNames=lsSampleNames, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr,
+			fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
+		if type(distanceMatrix) is BooleanType:
+			logging.error("MicroPITA.funcGetCentralSamplesByKMedoidsSweep:: Could not read in the supplied distance matrix, returning false.")
+			return False
+
+		#Medoids of each sample count, warm started from the previous count
+		medoidsMaker = Kmedoids(k=liCounts[0], dist="precomputed", init=self.strKMedoidsInit, n_init=self.iKMedoidsRestarts)
+		ltplMedoidsData = medoidsMaker.compute_path(scipy.spatial.distance.squareform(distanceMatrix, checks=False), liCounts)
+		logging.debug("MicroPITA.funcGetCentralSamplesByKMedoidsSweep:: Results from the kmedoid method in representative selection:")
+		logging.debug(str(ltplMedoidsData))
+
+		return [(iCount,[lsSampleNames[iIndex] for iIndex in medoidsData[0]]) for iCount, medoidsData in ltplMedoidsData]+ltplSelection
+
+	def funcUpdateCentralSamplesByKMedoids(self, npaMatrix, sMetric, lsSampleNames, iNumberSamplesReturned, strStateFile, strStateKey=None,
+											dRefineThreshold=c_dRepresentativeRefineThreshold, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None,
+											fSummed=None, fNormalized=None, lsFeatureNames=None):
+		"""
+		Gets centroid samples by k-medoids clustering, updating the clustering kept in a state file instead of clustering all samples again.
+		Without a usable state (no file, a different metric or sample count, or a medoid no longer in the data) all samples are clustered as in
+		funcGetCentralSamplesByKMedoids. Otherwise samples removed from the data leave their cluster, new samples are assigned to the closest medoid
+		(measuring only new sample to medoid distances) and the medoid of each cluster whose cost grew by more than the threshold since it was last
+		refined is moved to the cluster member with the lowest sum of distances to the other members. The state file is then rewritten.
+		Only metrics measured from the abundance table can be updated.
+
+		:param	npaMatrix:	Numpy array where row=samples and columns=features
+		:type:	Numpy array	Abundance Data.
+		:param	sMetric:	String name of beta metric used as the distance metric.
+		:type:	String	String name of beta metric.
+		:param	lsSampleNames:	The names of the sample
+		:type:	List	List of strings
+		:param	iNumberSamplesReturned:	Number of samples to return, each will be a centroid of a sample.
+		:type:	Integer	Number of samples to return
+		:param	strStateFile:	JSON file holding the clustering state, created if it does not exist.
+		:type:	String	File path
+		:param	strStateKey:	Key of this clustering in the state file (so methods and strata keep separate states), defaults to the metric.
+		:type:	String
+		:param	dRefineThreshold:	Relative growth of a cluster's cost which triggers refining its medoid.
+		:type:	Double
+		:param	istmBetaMatrix: File with beta-diversity matrix (clusters all samples).
+		:type:	File stream or file path string
+		:param	fSummed:	Indicator of the abundance data being summed (used to reuse cached distances).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (used to reuse cached distances).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (used by unifrac without an environment file).
+		:type:	List of strings
+		:return	List:	List of selected samples or False on error.
+		"""
+
+		strStateKey = strStateKey if strStateKey else sMetric
+		sampleCount = npaMatrix.shape[0]
+		if (iNumberSamplesReturned >= sampleCount) or istmBetaMatrix or not ((sMetric in [Metric.c_strBrayCurtisDissimilarity,Metric.c_strInvBrayCurtisDissimilarity]) or (sMetric in Metric.setBetaDiversities)):
+			if iNumberSamplesReturned < sampleCount:
+				logging.warning("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Incremental selection requires a beta metric measured from the abundance table, clustering all samples for metric="+str(sMetric))
+			return self.funcGetCentralSamplesByKMedoids(npaMatrix=npaMatrix, sMetric=sMetric, lsSampleNames=lsSampleNames, iNumberSamplesReturned=iNumberSamplesReturned,
+				istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr, fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
+
+		npaMatrix = np.asarray(npaMatrix, dtype=float)
+		dictSampleIndex = dict([(strSample,iIndex) for iIndex, strSample in enumerate(lsSampleNames)])
+
+		#Read the states of all clusterings kept in the file
+		if self._lckRepresentativeState:
+			self._lckRepresentativeState.acquire()
+		try:
+			dictState = self._funcReadRepresentativeStates(strStateFile).get(strStateKey)
+		finally:
+			if self._lckRepresentativeState:
+				self._lckRepresentativeState.release()
+
+		if dictState and not ((dictState["metric"] == sMetric) and (len(dictState["medoids"]) == iNumberSamplesReturned)
+									and all([strMedoid in dictSampleIndex for strMedoid in dictState["medoids"]])):
+			logging.info("MicroPITA.funcUpdateCentralSamplesByKMedoids:: The state of "+strStateKey+" does not match the data, clustering all samples.")
+			dictState = None
+
+		if not dictState:
+			#Cluster all samples
+			distanceMatrix = self._funcGetDistanceMatrix(npaMatrix=npaMatrix, sMetric=sMetric, lsSampleNames=lsSampleNames, fSummed=fSummed, fNormalized=fNormalized)
+			if type(distanceMatrix) is BooleanType:
+				logging.error("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Could not measure the distance matrix, returning false.")
+				return False
+			npaDistances = scipy.spatial.distance.squareform(distanceMatrix, checks=False)
+			medoidsMaker = Kmedoids(k=iNumberSamplesReturned, dist="precomputed", init=self.strKMedoidsInit, n_init=self.iKMedoidsRestarts)
+			liMedoids, liOthers, liClusters, dCost = medoidsMaker.compute(npaDistances)
+
+			#{"Sample name":[cluster, distance to the medoid]}
+			dictAssignments = dict([(lsSampleNames[iOther],[int(iCluster),float(npaDistances[iOther,liMedoids[iCluster]])]) for iOther, iCluster in zip(liOthers,liClusters)])
+			ldCosts = [0.0]*iNumberSamplesReturned
+			for iCluster, dDistance in dictAssignments.values():
+				ldCosts[iCluster] += dDistance
+			dictState = {"metric":sMetric, "medoids":[lsSampleNames[iMedoid] for iMedoid in liMedoids], "assignments":dictAssignments,
+						"costs":ldCosts, "refinedcosts":list(ldCosts)}
+		else:
+			lsMedoids = dictState["medoids"]
+			dictAssignments = dictState["assignments"]
+			ldCosts = dictState["costs"]
+			setMedoids = set(lsMedoids)
+
+			#Samples no longer in the data leave their cluster
+			for strSample in [strSample for strSample in dictAssignments if not strSample in dictSampleIndex]:
+				iCluster, dDistance = dictAssignments.pop(strSample)
+				ldCosts[iCluster] -= dDistance
+
+			#New samples join the closest medoid
+			lsNewSamples = [strSample for strSample in lsSampleNames if not ((strSample in dictAssignments) or (strSample in setMedoids))]
+			if lsNewSamples:
+				npaDistances = Metric.funcGetCrossDistance(npaMatrix[[dictSampleIndex[strSample] for strSample in lsNewSamples]],
+								npaMatrix[[dictSampleIndex[strMedoid] for strMedoid in lsMedoids]], sMetric)
+				if type(npaDistances) is BooleanType:
+					logging.error("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Could not measure distances to the medoids, returning false.")
+					return False
+				for strSample, iCluster, dDistance in zip(lsNewSamples, npaDistances.argmin(axis=1), npaDistances.min(axis=1)):
+					dictAssignments[strSample] = [int(iCluster),float(dDistance)]
+					ldCosts[iCluster] += float(dDistance)
+			logging.info("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Assigned "+str(len(lsNewSamples))+" new samples to the medoids of "+strStateKey)
+
+			#Refine the medoids of clusters which grew
+			for iCluster in xrange(len(lsMedoids)):
+				if not ldCosts[iCluster] > (1.0+dRefineThreshold)*dictState["refinedcosts"][iCluster]:
+					continue
+				#The current medoid is first so it is kept on ties
+				lsMembers = [lsMedoids[iCluster]]+sorted([strSample for strSample, liAssignment in dictAssignments.items() if liAssignment[0] == iCluster])
+				npaMembers = npaMatrix[[dictSampleIndex[strSample] for strSample in lsMembers]]
+				npaDistances = Metric.funcGetCrossDistance(npaMembers, npaMembers, sMetric)
+				if type(npaDistances) is BooleanType:
+					logging.error("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Could not measure distances in cluster "+str(iCluster)+", returning false.")
+					return False
+				iMedoid = int(npaDistances.sum(axis=1).argmin())
+				lsMedoids[iCluster] = lsMembers[iMedoid]
+				dictAssignments.pop(lsMembers[iMedoid],None)
+				for iMember, strSample in enumerate(lsMembers):
+					if not iMember == iMedoid:
+						dictAssignments[strSample] = [iCluster,float(npaDistances[iMedoid,iMember])]
+				ldCosts[iCluster] = float(npaDistances[iMedoid].sum())
+				dictState["refinedcosts"][iCluster] = ldCosts[iCluster]
+				logging.info("MicroPITA.funcUpdateCentralSamplesByKMedoids:: Refined cluster "+str(iCluster)+" of "+strStateKey+", medoid="+lsMedoids[iCluster])
+
+		#Keep the state for the next run
+		#The file is read again so states written meanwhile by other strata are kept
+		if self._lckRepresentativeState:
+			self._lckRepresentativeState.acquire()
+		try:
+			dictStates = self._funcReadRepresentativeStates(strStateFile)
+			dictStates[strStateKey] = dictState
+			with open(strStateFile,"w") as ostrmState:
+				json.dump(dictStates, ostrmState, sort_keys=True)
+		finally:
+			if self._lckRepresentativeState:
+				self._lckRepresentativeState.release()
+
+		return list(dictState["medoids"])
+
+	def _funcReadRepresentativeStates(self, strStateFile):
+		"""
+		Reads the states of all clusterings kept in a representative state file (see funcUpdateCentralSamplesByKMedoids).
+
+		:param	strStateFile:	JSON file holding the clustering states.
+		:type:	String	File path
+		:return	Dictionary:	{"State key":state}, empty if the file does not exist or can not be read.
+		"""
+
+		dictStates = dict()
+		if os.path.exists(strStateFile):
+			try:
+				with open(strStateFile) as istrmState:
+					dictStates = json.load(istrmState)
+			except ValueError as error:
+				logging.warning("MicroPITA._funcReadRepresentativeStates:: Could not read the state file "+str(strStateFile)+", clustering all samples. Error="+str(error))
+		return dictStates
+
+	def _funcAddCentralSamples(self, dictSelectedSamples, strMethod, strStratum=None, **dictKMedoidsArgs):
+		"""
+		Runs representative selection and adds the selected samples to the selection dictionary.
+		With a sample count sweep each count is added as its own method (method name, MicroPITA.c_strRepresentativeSweepSeparator, count).
+		With a state file the clustering of the method (and stratum) is updated (see funcUpdateCentralSamplesByKMedoids).
+
+		:param	dictSelectedSamples:	Will be added to as samples are selected {"Method:["strSelectedSampleID","strSelectedSampleID"...]}.
+		:type:	Dictionary
+		:param	strMethod:	Name of the selection method.
+		:type:	String
+		:param	strStratum:	Value of the stratification metadata of the samples (None if not stratified).
+		:type:	String
+		:param	dictKMedoidsArgs:	Arguments of funcGetCentralSamplesByKMedoids.
+		:type:	Dictionary
+		"""
+
+		if self.liRepresentativeSweep:
+			if self.strRepresentativeStateFile:
+				logging.warning("MicroPITA._funcAddCentralSamples:: The state file is not used with a sample count sweep.")
+			dictKMedoidsArgs.pop("iNumberSamplesReturned",None)
+			ltplSelection = self.funcGetCentralSamplesByKMedoidsSweep(liNumberSamplesReturned=self.liRepresentativeSweep, **dictKMedoidsArgs)
+			if ltplSelection:
+				for iCount, medoidSamples in ltplSelection:
+					dictSelectedSamples.setdefault(strMethod+self.c_strRepresentativeSweepSeparator+str(iCount),[]).extend(medoidSamples)
+		else:
+			if self.strRepresentativeStateFile:
+				medoidSamples = self.funcUpdateCentralSamplesByKMedoids(strStateFile=self.strRepresentativeStateFile,
+						strStateKey=strMethod if strStratum is None else strMethod+"|"+strStratum, dRefineThreshold=self.dRepresentativeRefineThreshold, **dictKMedoidsArgs)
+			else:
+				medoidSamples = self.funcGetCentralSamplesByKMedoids(**dictKMedoidsArgs)
+			if medoidSamples:
+				dictSelectedSamples.setdefault(strMethod,[]).extend(medoidSamples)
 	
 	####Group 3## Highest Dissimilarity
 	#Testing: Happy path tested
-	def funcSelectExtremeSamplesFromHClust(self, strBetaMetric, npaAbundanceMatrix, lsSampleNames, iSelectSampleCount, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None):
+	def funcSelectExtremeSamplesFromHClust(self, strBetaMetric, npaAbundanceMatrix, lsSampleNames, iSelectSampleCount, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fSummed=None, fNormalized=None, lsFeatureNames=None):
 		"""
 		Select extreme samples from HClustering.
 		
@@ -203,6 +691,12 @@ class MicroPITA:
 		:return	Samples:	List of samples.
 		:param	istmBetaMatrix: File with beta-diversity matrix
 		:type:	File stream or file path string
+		:param	fSummed:	Indicator of the abundance data being summed (used to reuse cached distances).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (used to reuse cached distances).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (used by unifrac without an environment file).
+		:type:	List of strings
 		"""
 	
 		#If they want all the sample count, return all sample names
@@ -215,21 +709,16 @@ class MicroPITA:
 	
 		#Generate beta matrix
 		#Returns condensed matrix
-		tempDistanceMatrix = scipy.spatial.distance.squareform(Metric.funcReadMatrixFile(istmMatrixFile=istmBetaMatrix,lsSampleOrder=lsSampleNames)[0]) if istmBetaMatrix else Metric.funcGetBetaMetric(npadAbundancies=npaAbundanceMatrix, sMetric=strBetaMetric, istrmTree=istrmTree, istrmEnvr=istrmEnvr, lsSampleOrder=lsSampleNames, fAdditiveInverse = True)
-
-		if strBetaMetric in [Metric.c_strUnifracUnweighted,Metric.c_strUnifracWeighted]:
-			tempDistanceMatrix = tempDistanceMatrix[0]
+		tempDistanceMatrix = self._funcGetDistanceMatrix(npaMatrix=npaAbundanceMatrix, sMetric=strBetaMetric, lsSampleNames=lsSampleNames, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr,
+			fAdditiveInverse=True, fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
 
 		if type(tempDistanceMatrix) is BooleanType:
 			logging.error("MicroPITA.funcSelectExtremeSamplesFromHClust:: Could not read in the supplied distance matrix, returning false.")
 			return False
 
-		if istmBetaMatrix:
-			tempDistanceMatrix = 1-tempDistanceMatrix
-
 		#Feed beta matrix to linkage to cluster
 		#Send condensed matrix
-		linkageMatrix = hcluster.linkage(tempDistanceMatrix, method=self.c_strHierarchicalClusterMethod)
+		linkageMatrix = (fastcluster.linkage if fastcluster else hcluster.linkage)(tempDistanceMatrix, method=self.c_strHierarchicalClusterMethod)
 	
 		#Extract cluster information from dendrogram
 		#The linakge matrix is of the form
@@ -265,6 +754,74 @@ class MicroPITA:
 	
 		#Return selected samples
 		return lsReturnSamplesRet
+
+	def funcSelectExtremeSamplesFromPairs(self, strBetaMetric, npaAbundanceMatrix, lsSampleNames, iSelectSampleCount, istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fSummed=None, fNormalized=None, lsFeatureNames=None):
+		"""
+		Select extreme samples from the most distant pairs of samples.
+		Samples are taken from pairs of unselected samples in order of increasing inverted metric (1 - metric), so the pairs are the ones
+		joined by the hierarchical clustering of funcSelectExtremeSamplesFromHClust and both give the same selection while its merges are between samples.
+		Only the most distant pairs are searched (with a partial sort), metrics measured from the abundance table are measured in blocks of samples
+		so the distance matrix is not held.
+
+		:param	strBetaMetric:	The beta metric to use for distance matrix generation.
+		:type:	String	The name of the beta metric to use.
+		:param	npaAbundanceMatrix:	Numpy array where row=samples and columns=features.
+		:type:	Numpy Array	Abundance data.
+		:param	lsSampleNames:	The names of the sample.
+		:type:	List	List of strings.
+		:param	iSelectSampleCount:	Number of samples to select (return).
+		:type:	Integer	Integer number of samples returned.
+		:param	istmBetaMatrix: File with beta-diversity matrix
+		:type:	File stream or file path string
+		:param	fSummed:	Indicator of the abundance data being summed (used to reuse cached distances).
+		:type:	Boolean
+		:param	fNormalized:	Indicator of the abundance data being normalized (used to reuse cached distances).
+		:type:	Boolean
+		:param	lsFeatureNames:	Feature names of the abundance columns (used by unifrac without an environment file).
+		:type:	List of strings
+		:return	Samples:	List of samples.
+		"""
+
+		#If they want all the sample count, return all sample names
+		iSampleCount=len(npaAbundanceMatrix[:,0])
+		if iSelectSampleCount==iSampleCount:
+		  return lsSampleNames
+
+		#Metrics measured from the abundance table are measured by blocks, others are read or measured as a condensed matrix
+		dictPairArgs = {}
+		if (not istmBetaMatrix) and ((strBetaMetric in [Metric.c_strBrayCurtisDissimilarity,Metric.c_strInvBrayCurtisDissimilarity]) or (strBetaMetric in Metric.setBetaDiversities)):
+			dictPairArgs = {"npadAbundancies":npaAbundanceMatrix, "sMetric":strBetaMetric, "fAdditiveInverse":True}
+		else:
+			tempDistanceMatrix = self._funcGetDistanceMatrix(npaMatrix=npaAbundanceMatrix, sMetric=strBetaMetric, lsSampleNames=lsSampleNames, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr,
+				fAdditiveInverse=True, fSummed=fSummed, fNormalized=fNormalized, lsFeatureNames=lsFeatureNames)
+			if type(tempDistanceMatrix) is BooleanType:
+				logging.error("MicroPITA.funcSelectExtremeSamplesFromPairs:: Could not read in the supplied distance matrix, returning false.")
+				return False
+			dictPairArgs = {"npaCondensedMatrix":tempDistanceMatrix}
+
+		#Search more pairs until they hold enough different samples
+		iPairCount = iSelectSampleCount
+		while True:
+			tplPairs = Metric.funcGetLowestPairs(iPairCount, **dictPairArgs)
+			if type(tplPairs) is BooleanType:
+				logging.error("MicroPITA.funcSelectExtremeSamplesFromPairs:: Could not measure the sample pairs, returning false.")
+				return False
+
+			#Add each of the pair one at a time breaking when enough samples are selected.
+			#Pairs with an already selected sample are skipped, as the clustering merges that sample's cluster instead of the sample.
+			lsReturnSamplesRet = []
+			setSelected = set()
+			for iNode1, iNode2 in zip(tplPairs[0],tplPairs[1]):
+				if (iNode1 in setSelected) or (iNode2 in setSelected):
+					continue
+				for iNode in (iNode1, iNode2):
+					setSelected.add(iNode)
+					lsReturnSamplesRet.append(lsSampleNames[iNode])
+					if len(lsReturnSamplesRet) == iSelectSampleCount:
+						return lsReturnSamplesRet
+			if len(tplPairs[0]) >= (iSampleCount*(iSampleCount-1))//2:
+				return lsReturnSamplesRet
+			iPairCount = iPairCount*4
 	
 	####Group 4## Rank Average of user Defined Taxa
 		#Testing: Happy Path Tested
@@ -307,12 +864,14 @@ class MicroPITA:
 			dictRanks = dict(llRetRank)
 			llRetAbundance = [[a[0],dictRanks[a[0]],a[2]] for a in llRetAbundance]
 			
-		#Sort first for ties and then for the main feature
- 		if not fRank or ConstantsMicropita.c_fBreakRankTiesByDiversity:
-			llRetAbundance = sorted(llRetAbundance, key = lambda sampleData: sampleData[2], reverse = not fRank)
+		#Sort by the main feature, then for ties (if breaking ties), then by the original order (lexsort is stable)
+		#Not ranked sorts by decreasing average abundance, ranked by increasing average rank
 		if fRank:
-			llRetAbundance = sorted(llRetAbundance, key = lambda sampleData: sampleData[1], reverse = not fRank)
-		return llRetAbundance
+			ltplKeys = ([a[2] for a in llRetAbundance],) if ConstantsMicropita.c_fBreakRankTiesByDiversity else ()
+			ltplKeys = ltplKeys + ([a[1] for a in llRetAbundance],)
+		else:
+			ltplKeys = (-np.asarray([a[2] for a in llRetAbundance], dtype=float),)
+		return [llRetAbundance[iIndex] for iIndex in np.lexsort(ltplKeys)]
 	
 	#Testing: Happy Path Tested
 	def funcSelectTargetedTaxaSamples(self, abndMatrix, lsTargetedTaxa, iSampleSelectionCount, sMethod = ConstantsMicropita.lsTargetedFeatureMethodValues[0]):
@@ -349,7 +908,7 @@ class MicroPITA:
 	
 	####Group 5## Random
 	#Testing: Happy path Tested
-	def funcGetRandomSamples(self, lsSamples=None, iNumberOfSamplesToReturn=0):
+	def funcGetRandomSamples(self, lsSamples=None, iNumberOfSamplesToReturn=0, rndRandom=random):
 		"""
 		Returns random sample names of the number given. No replacement.
 		
@@ -357,6 +916,8 @@ class MicroPITA:
 		:type:	list	list of strings
 		:param	iNumberOfSamplesToReturn:	Number of samples to select
 		:type:	integer	integer.
+		:param	rndRandom:	Random number generator (random.Random) drawing the samples, by default the global generator.
+		:type:	random.Random or the random module
 		:return	List:	List of selected samples (strings).
 		"""
 
@@ -368,10 +929,43 @@ class MicroPITA:
 			return lsSamples
 	
 		#Get the random indices for the sample (without replacement)
-		liRandomIndices = random.sample(range(sampleCount), iNumberOfSamplesToReturn)
+		liRandomIndices = rndRandom.sample(xrange(sampleCount), iNumberOfSamplesToReturn)
 	
 		#Create a boolean array of if indexes are to be included in the reduced array
-                return [sSample for iIndex, sSample in enumerate(lsSamples) if iIndex in liRandomIndices]
+		lfSelected = np.zeros(sampleCount, dtype=bool)
+		lfSelected[liRandomIndices] = True
+		return [sSample for sSample, fSelected in zip(lsSamples, lfSelected) if fSelected]
+
+	def funcGetRandomSampleDraws(self, lsSamples, iNumberOfSamplesToReturn, iDraws, rndRandom=random):
+		"""
+		Returns several independent random selections of the number of samples given (each without replacement), drawn at once.
+		
+		:param	lsSamples:	List of sample names 
+		:type:	list	list of strings
+		:param	iNumberOfSamplesToReturn:	Number of samples to select in each draw
+		:type:	integer	integer.
+		:param	iDraws:	Number of selections
+		:type:	integer	integer.
+		:param	rndRandom:	Random number generator (random.Random) seeding the draws, by default the global generator.
+		:type:	random.Random or the random module
+		:return	List:	List of selections, each a list of selected samples (strings) in their original order.
+		"""
+
+		#Input matrix sample count
+		sampleCount = len(lsSamples)
+		if(iNumberOfSamplesToReturn >= sampleCount):
+			return [list(lsSamples) for iDraw in xrange(iDraws)]
+		if(iNumberOfSamplesToReturn < 1):
+			return [[] for iDraw in xrange(iDraws)]
+
+		#Each draw selects the samples with the lowest random keys
+		npRandom = np.random.RandomState(rndRandom.randint(0,2**32-1))
+		npaiSelected = np.argpartition(npRandom.rand(iDraws,sampleCount), iNumberOfSamplesToReturn-1, axis=1)[:,:iNumberOfSamplesToReturn]
+		lfSelected = np.zeros((iDraws,sampleCount), dtype=bool)
+		lfSelected[np.arange(iDraws)[:,np.newaxis],npaiSelected] = True
+
+		npaSamples = np.array(lsSamples, dtype=object)
+		return [list(npaSamples[lfDraw]) for lfDraw in lfSelected]
 
 	#Happy path tested (case 3)
 	def funcGetAveragePopulation(self, abndTable, lfCompress):
@@ -449,8 +1043,54 @@ class MicroPITA:
 
 		return zip([lsAllSamples[iindex] for iindex, fGroup in enumerate(lfGroupOfInterest) if fGroup],ldSelectedDistances)
 
+	def funcGetDistancesFromLabelCentroids(self, abndTable, sLabel, sMetric=Metric.c_strBrayCurtisDissimilarity, sCentroid=None):
+		"""
+		Get the distance of each sample from the centroid of each label.
+		The centroids of all labels are made at once (mean and median) or from one distance matrix per label (medoid)
+		and all sample to centroid distances are measured as one matrix.
+
+		:param abndTable: Table of data to work out of.
+		:type: Abundace Table
+		:param sLabel: ID of the metadata which is the supervised label
+		:type: String
+		:param sMetric: Beta metric of the distances (brays-curtis or one of Metric.setBetaDiversities).
+		:type: String
+		:param sCentroid: Centroid of each label (MicroPITA.c_lsSupervisedCentroids), the average sample by default.
+		:type: String
+		:return Tuple: (List of the label values, Numpy array of distances with rows=samples and columns=labels) or False on error.
+		"""
+
+		lsMetadata = abndTable.funcGetMetadata(sLabel)
+		lsLabels, liLabelIndices = np.unique(np.array(lsMetadata, dtype=object), return_inverse=True)
+
+		#Samples x features
+		npadSamples = abndTable.funcGetSampleAbundanceMatrix(dtype=float)
+
+		if sCentroid == self.c_strSupervisedCentroidMedian:
+			npadCentroids = np.array([np.median(npadSamples[liLabelIndices == iLabel], axis=0) for iLabel in xrange(len(lsLabels))])
+		elif sCentroid == self.c_strSupervisedCentroidMedoid:
+			#The sample of the label with the lowest sum of distances to the other samples of the label
+			lnpadCentroids = []
+			for iLabel in xrange(len(lsLabels)):
+				npadLabelSamples = npadSamples[liLabelIndices == iLabel]
+				npadLabelDistances = Metric.funcGetCrossDistance(npadLabelSamples, npadLabelSamples, sMetric)
+				if type(npadLabelDistances) is BooleanType:
+					return False
+				lnpadCentroids.append(npadLabelSamples[npadLabelDistances.sum(axis=1).argmin()])
+			npadCentroids = np.array(lnpadCentroids)
+		else:
+			#Averages summed per label in sample order
+			npadCentroids = np.zeros((len(lsLabels),npadSamples.shape[1]))
+			np.add.at(npadCentroids, liLabelIndices, npadSamples)
+			npadCentroids = npadCentroids/np.bincount(liLabelIndices).astype(float)[:,np.newaxis]
+
+		npadDistances = Metric.funcGetCrossDistance(npadSamples, npadCentroids, sMetric)
+		if type(npadDistances) is BooleanType:
+			return False
+		return (list(lsLabels), npadDistances)
+
 	#Happy path tested (1 test case)
-	def funcPerformDistanceSelection(self, abndTable, iSelectionCount, sLabel, sValueOfInterest):
+	def funcPerformDistanceSelection(self, abndTable, iSelectionCount, sLabel, sValueOfInterest, tplLabelDistances=None):
 		"""
 		Given metadata, metadata of one value (sValueOfInterest) is measured from the average (centroid) value of another label group.
 		An iSelectionCount of samples is selected from the group of interest closest to and furthest from the centroid of the other group.
@@ -463,6 +1103,8 @@ class MicroPITA:
 		:type: String
 		:params sValueOfInterest: Metadata value in the sLabel metadta row of the abundance table which defines the group of interest.
 		:type: String found in the abundance table metadata row indicated by sLabel.
+		:params tplLabelDistances: Distances of the samples from the label centroids (see funcGetDistancesFromLabelCentroids), measured if not given.
+		:type: Tuple
 		:return list list of tuples (samplename, distance) [[iSelectionCount of tuples closest to the other centroid], [iSelectionCount of tuples farthest from the other centroid], [all tuples of samples not selected]]
 		"""
 
@@ -470,20 +1112,27 @@ class MicroPITA:
 		#Other metadata values
 		lsUniqueOtherValues = list(set(lsMetadata)-set(sValueOfInterest))
 
-		#Get boolean indicator of values of interest
-		lfLabelsInterested = [sValueOfInterest == sValue for sValue in lsMetadata]
-
-                #Get the distances of the items of interest from the other metadata values
-		dictDistanceAverages = {}
-                for sOtherLabel in lsUniqueOtherValues:
-			#Get boolean indicator of labels not of interest 
-			lfLabelsOther = [sOtherLabel == sValue for sValue in lsMetadata]
+		#Distances of all samples from the centroid of each label
+		if not tplLabelDistances:
+			tplLabelDistances = self.funcGetDistancesFromLabelCentroids(abndTable=abndTable, sLabel=sLabel, sMetric=self.strSupervisedMetric, sCentroid=self.strSupervisedCentroid)
+			if not tplLabelDistances:
+				logging.error("MicroPITA.funcPerformDistanceSelection:: Could not measure distances from the label centroids.")
+				return [[],[],[]]
+		lsLabels, npadLabelDistances = tplLabelDistances
+		dictLabelColumns = dict([(sLabelValue,iColumn) for iColumn, sLabelValue in enumerate(lsLabels)])
 
-			#Get the distances of data from two different groups to the average of the other
-			ldValueDistances = dict(self.funcMeasureDistanceFromLabelToAverageOtherLabel(abndTable, lfLabelsInterested, lfLabelsOther))
+		#Get indices of values of interest
+		liLabelsInterested = [iIndex for iIndex, sValue in enumerate(lsMetadata) if sValueOfInterest == sValue]
 
-			for sKey in ldValueDistances:
-				dictDistanceAverages[sKey] = ldValueDistances[sKey] + dictDistanceAverages[sKey] if sKey in dictDistanceAverages else ldValueDistances[sKey]
+                #Get the distances of the items of interest from the other metadata values (summed in the order of the other values)
+		dictDistanceAverages = {}
+		if lsUniqueOtherValues:
+			npadDistanceSums = npadLabelDistances[liLabelsInterested,dictLabelColumns[lsUniqueOtherValues[0]]]
+			for sOtherLabel in lsUniqueOtherValues[1:]:
+				npadDistanceSums = npadLabelDistances[liLabelsInterested,dictLabelColumns[sOtherLabel]] + npadDistanceSums
+			lsSampleNames = abndTable.funcGetSampleNames()
+			for iIndex, dDistance in zip(liLabelsInterested,npadDistanceSums):
+				dictDistanceAverages[lsSampleNames[iIndex]] = dDistance
 
 		#Finish average by dividing by length of lsUniqueOtherValues
 		ltpleAverageDistances = [(sKey, dictDistanceAverages[sKey]/float(len(lsUniqueOtherValues))) for sKey in dictDistanceAverages]
@@ -506,7 +1155,8 @@ class MicroPITA:
 	#Happy path tested (3 test cases)
 	def funcRunSupervisedDistancesFromCentroids(self, abundanceTable, fRunDistinct, fRunDiscriminant,
 						xOutputSupFile, xPredictSupFile, strSupervisedMetadata,
-						iSampleSupSelectionCount, lsOriginalSampleNames, lsOriginalLabels, fAppendFiles = False):
+						iSampleSupSelectionCount, lsOriginalSampleNames, lsOriginalLabels, fAppendFiles = False,
+						dictSVMLines = None, dictPredictDistances = None):
 		"""
 		Runs supervised methods based on measuring distances of one label from the centroid of another. NAs are evaluated as theirown group.
 
@@ -528,17 +1178,26 @@ class MicroPITA:
 		:type:	List of samples	
 		:param	fAppendFiles:	Indicates that output files already exist and appending is occuring.
 		:type:	Boolean
+		:param	dictSVMLines:	If given, the lines of the supervised input file are added here {"sample":"1:value ..."} instead of being written
+						(see MicroPITA.funcWriteSupervisedFiles).
+		:type:	Dictionary
+		:param	dictPredictDistances:	If given, the distances of the predict file are added here {"labelgroup":{"SampleName":dDistance}} instead of being written.
+		:type:	Dictionary
 		:return	Selected Samples:	A dictionary of selected samples by selection ID
 		Dictionary	{"Selection Method":["SampleID","SampleID"...]}
 		"""
 		#Get labels and run one label against many
 		lstrMetadata = abundanceTable.funcGetMetadata(strSupervisedMetadata)
 		dictlltpleDistanceMeasurements = {}
+
+		#Distances of all samples from all label centroids, measured once for all labels
+		tplLabelDistances = self.funcGetDistancesFromLabelCentroids(abndTable=abundanceTable, sLabel=strSupervisedMetadata,
+			sMetric=self.strSupervisedMetric, sCentroid=self.strSupervisedCentroid)
 		for sMetadataValue in set(lstrMetadata):
 
 			#For now perform the selection here for the label of interest against the other labels
 			dictlltpleDistanceMeasurements.setdefault(sMetadataValue,[]).extend(self.funcPerformDistanceSelection(abndTable=abundanceTable,
-				iSelectionCount=iSampleSupSelectionCount, sLabel=strSupervisedMetadata, sValueOfInterest=sMetadataValue))
+				iSelectionCount=iSampleSupSelectionCount, sLabel=strSupervisedMetadata, sValueOfInterest=sMetadataValue, tplLabelDistances=tplLabelDistances))
 
 		#Make expected output files for supervised methods
 		#1. Output file which is similar to an input file for SVMs
@@ -546,7 +1205,9 @@ class MicroPITA:
 		#Manly for making output of supervised methods (Distance from Centroid) similar
 		#MicropitaVis needs some of these files
 		if xOutputSupFile:
-			if fAppendFiles:
+			if not dictSVMLines is None:
+				dictSVMLines.update(SVM.funcGetSVMFeatureLines(abundanceTable))
+			elif fAppendFiles:
 				SVM.funcUpdateSVMFileWithAbundanceTable(abndAbundanceTable=abundanceTable, xOutputSVMFile=xOutputSupFile,
 					lsOriginalLabels=lsOriginalLabels, lsSampleOrdering=lsOriginalSampleNames)
 			else:
@@ -567,7 +1228,10 @@ class MicroPITA:
 			[dictFlattenedDistances.setdefault(sKey, []).append(tple)
 				for sKey, lltple in dictlltpleDistanceMeasurements.items()
 				for ltple in lltple for tple in ltple]
-			if fAppendFiles:
+			if not dictPredictDistances is None:
+				for sKey, ltpleDistances in dictFlattenedDistances.items():
+					dictPredictDistances.setdefault(sKey,dict()).update(dict(ltpleDistances))
+			elif fAppendFiles:
 				self._updatePredictFile(xPredictSupFile=xPredictSupFile, xInputLabelsFile=xOutputSupFile,
 					dictltpleDistanceMeasurements=dictFlattenedDistances, abundanceTable=abundanceTable, lsOriginalSampleNames=lsOriginalSampleNames)
 			else:
@@ -575,6 +1239,38 @@ class MicroPITA:
 					dictltpleDistanceMeasurements=dictFlattenedDistances, abundanceTable=abundanceTable, lsOriginalSampleNames=lsOriginalSampleNames)
 		return dictSelectedSamplesRet
 
+	def funcWriteSupervisedFiles(self, xOutputSupFile, xPredictSupFile, dictSVMLines, dictPredictDistances, abundanceTable,
+						lsOriginalSampleNames, lsOriginalLabels, iFeatureCount):
+		"""
+		Writes the supervised input and predict files once from the lines and distances gathered over all strata
+		by MicroPITA.funcRunSupervisedDistancesFromCentroids.
+
+		:param	xOutputSupFile:	File output from supervised methods detailing data going into the method.
+		:type:	String or FileStream
+		:param	xPredictSupFile:	File output from supervised methods distance results from supervised methods.
+		:type:	String or FileStream
+		:param	dictSVMLines:	Lines of the supervised input file {"sample":"1:value ..."}.
+		:type:	Dictionary
+		:param	dictPredictDistances:	Distances of the predict file {"labelgroup":{"SampleName":dDistance}}.
+		:type:	Dictionary
+		:param	abundanceTable:	The abundance table all strata came from.
+		:type:	AbundanceTable
+		:param lsOriginalSampleNames:	List of the sample names, order is important and should be preserved from the abundanceTable.
+		:type:	List of samples
+		:param	lsOriginalLabels:	Labels of the samples in lsOriginalSampleNames.
+		:type:	List of strings
+		:param	iFeatureCount:	Number of features written for each sample.
+		:type:	Integer
+		"""
+
+		if xOutputSupFile:
+			SVM.funcWriteSVMFileFromLines(dictLines=dictSVMLines, xOutputSVMFile=xOutputSupFile, lsOriginalLabels=lsOriginalLabels,
+				lsSampleOrdering=lsOriginalSampleNames, iFeatureCount=iFeatureCount)
+		if xPredictSupFile:
+			self._writeToPredictFile(xPredictSupFile=xPredictSupFile, xInputLabelsFile=xOutputSupFile,
+				dictltpleDistanceMeasurements=dict([(sKey,dictDistances.items()) for sKey, dictDistances in dictPredictDistances.items()]),
+				abundanceTable=abundanceTable, lsOriginalSampleNames=lsOriginalSampleNames, fFromUpdate=True)
+
 	#Two happy path test cases
 	def _updatePredictFile(self, xPredictSupFile, xInputLabelsFile, dictltpleDistanceMeasurements, abundanceTable, lsOriginalSampleNames):
 		"""
@@ -666,9 +1362,150 @@ class MicroPITA:
 				[str(dictltpleDistanceMeasurements[sKey].get(sSample,ConstantsMicropita.c_sEmptyPredictFileValue))
 				for sKey in lsMeasurementKeys])
 
+	def _funcAddDiverseSamples(self, dictSelectedSamples, abndData, lsSampleNames, iSampleSelectionCount, lsAlphaMetrics, strAlphaMetadata=None, fInvertDiversity=False):
+		"""
+		Runs highest diversity selection and adds the selected samples to the selection dictionary.
+
+		:param	dictSelectedSamples:	Will be added to as samples are selected {"Method:["strSelectedSampleID","strSelectedSampleID"...]}.
+		:type:	Dictionary
+		:param	abndData:	Abundance table object holding the samples to be measured.
+		:type:	AbundanceTable
+		:param	lsSampleNames:	Names of the samples in abndData.
+		:type:	List of strings
+		:param	iSampleSelectionCount	The number of samples to select per metric.
+		:type:	Integer
+		:param	lsAlphaMetrics:	List of alpha metrics to measure.
+		:type:	List of strings
+		:param	strAlphaMetadata:	Metadata holding a diversity measurement to use instead of the alpha metrics.
+		:type:	String
+		:param	fInvertDiversity:	When true will invert diversity measurements before using.
+		:type:	Boolean
+		"""
+
+		#Get Alpha metrics matrix
+		internalAlphaMatrix = None
+		#Name of technique
+		strMethod = [strAlphaMetadata] if strAlphaMetadata else lsAlphaMetrics
+
+		#If given an alpha-diversity metadata
+		if strAlphaMetadata:
+			internalAlphaMatrix = [[float(strNum) for strNum in abndData.funcGetMetadata(strAlphaMetadata)]]
+		else:
+			#Expects Observations (Taxa (row) x sample (column))
+			#Returns [[metric1-sample1, metric1-sample2, metric1-sample3],[metric1-sample1, metric1-sample2, metric1-sample3]]
+			internalAlphaMatrix = Metric.funcBuildAlphaMetricsMatrix(npaSampleAbundance = abndData.funcGetAbundanceCopy()
+						if not abndData.funcIsSummed()
+						else abndData.funcGetFeatureAbundanceTable(abndData.funcGetTerminalNodes()).funcGetAbundanceCopy(),
+						lsSampleNames = lsSampleNames, lsDiversityMetricAlpha = lsAlphaMetrics)
+
+		if internalAlphaMatrix:
+			#Invert measurments
+			if fInvertDiversity:
+				lldNewDiversity = []
+				for lsLine in internalAlphaMatrix:
+					lldNewDiversity.append([1/max(dValue,ConstantsMicropita.c_smallNumber) for dValue in lsLine])
+				internalAlphaMatrix = lldNewDiversity
+			#Get top ranked alpha diversity by most diverse
+			#Expects [[sample1,sample2,sample3...],[sample1,sample2,sample3..],...]
+			#Returns [[sampleName1, sampleName2, sampleNameN],[sampleName1, sampleName2, sampleNameN]]
+			mostDiverseAlphaSamplesIndexes = self.funcGetTopRankedSamples(lldMatrix=internalAlphaMatrix, lsSampleNames=lsSampleNames, iTopAmount=iSampleSelectionCount)
+
+			#Add to results
+			for index in xrange(0,len(strMethod)):
+				strSelectionMethod = self.dictConvertAMetricDiversity.get(strMethod[index],ConstantsMicropita.c_strDiversity+"="+strMethod[index])
+				dictSelectedSamples.setdefault(strSelectionMethod,[]).extend(mostDiverseAlphaSamplesIndexes[index])
+
+	def _funcAddExtremeSamples(self, dictSelectedSamples, strMethod, funcSelectExtremeSamples, **dictExtremeArgs):
+		"""
+		Runs extreme selection and adds the selected samples to the selection dictionary.
+
+		:param	dictSelectedSamples:	Will be added to as samples are selected {"Method:["strSelectedSampleID","strSelectedSampleID"...]}.
+		:type:	Dictionary
+		:param	strMethod:	Name of the selection method.
+		:type:	String
+		:param	funcSelectExtremeSamples:	Extreme selection algorithm (funcSelectExtremeSamplesFromHClust or funcSelectExtremeSamplesFromPairs).
+		:type:	Function
+		:param	dictExtremeArgs:	Arguments of funcSelectExtremeSamples.
+		:type:	Dictionary
+		"""
+
+		extremeSamples = funcSelectExtremeSamples(**dictExtremeArgs)
+
+		#Add selected samples
+		if extremeSamples:
+			dictSelectedSamples.setdefault(strMethod,[]).extend(extremeSamples)
+
+	def _funcPlanDistances(self, ltpleTasks, iSampleCount):
+		"""
+		Finds the distance matrices which selection tasks measure in full, each once even if several tasks (for instance
+		representative and extreme selection with the same metric) use it. Matrices read from a file or the cohort distances,
+		clustering which measures distances on demand (CLARA, the representative state file) and extreme pairs are left out.
+
+		:param	ltpleTasks:	Selection tasks (see _funcRunSelectionTasks).
+		:type:	List of tuples
+		:param	iSampleCount:	Number of samples, nothing is measured when all samples are selected.
+		:type:	Integer
+		:return	List:	Arguments of _funcGetDistanceMatrix of each distance matrix.
+		"""
+
+		ldictDistanceArgs = []
+		setMetrics = set()
+		for funcTask, dictArgs in ltpleTasks:
+			if funcTask == self._funcAddCentralSamples:
+				sMetric, iSelectCount = dictArgs["sMetric"], dictArgs["iNumberSamplesReturned"]
+				fFullMatrix = (self.strRepresentativeMethod == self.c_strRepresentativePAM) and (self.liRepresentativeSweep or not self.strRepresentativeStateFile)
+			elif funcTask == self._funcAddExtremeSamples:
+				sMetric, iSelectCount = dictArgs["strBetaMetric"], dictArgs["iSelectSampleCount"]
+				fFullMatrix = dictArgs["funcSelectExtremeSamples"] == self.funcSelectExtremeSamplesFromHClust
+			else:
+				continue
+
+			#The cache keeps additive inverses with their base metric
+			sMetric = DistanceCache.dictInverseToBaseMetric.get(sMetric,sMetric)
+			if (not fFullMatrix) or dictArgs["istmBetaMatrix"] or (iSelectCount >= iSampleCount) or (sMetric in setMetrics) or (sMetric in self._dictCohortDistances) or not DistanceCache.funcIsCacheable(sMetric):
+				continue
+			setMetrics.add(sMetric)
+			ldictDistanceArgs.append({"npaMatrix":dictArgs.get("npaMatrix",dictArgs.get("npaAbundanceMatrix")), "sMetric":sMetric, "lsSampleNames":dictArgs["lsSampleNames"],
+				"fSummed":dictArgs["fSummed"], "fNormalized":dictArgs["fNormalized"]})
+		return ldictDistanceArgs
+
+	def _funcRunSelectionTasks(self, ltpleTasks, dictSelectedSamples, ldictDistanceArgs=None):
+		"""
+		Runs selection tasks, on MicroPITA.iThreads threads if more than one. Distance matrices shared by tasks are measured first
+		(in parallel for different metrics) so tasks reuse them from the distance cache. Samples are added in task order
+		so the selection does not depend on which task finishes first.
+
+		:param	ltpleTasks:	Selection tasks as (function adding samples to the dictionary given first, keyword arguments).
+		:type:	List of tuples
+		:param	dictSelectedSamples:	Will be added to as samples are selected {"Method:["strSelectedSampleID","strSelectedSampleID"...]}.
+		:type:	Dictionary
+		:param	ldictDistanceArgs:	Arguments of _funcGetDistanceMatrix of the shared distance matrices (see _funcPlanDistances).
+		:type:	List of dictionaries
+		"""
+
+		iThreads = min(self.iThreads, max(len(ltpleTasks),len(ldictDistanceArgs or [])))
+		if iThreads < 2:
+			for funcTask, dictArgs in ltpleTasks:
+				funcTask(dictSelectedSamples, **dictArgs)
+			return
+
+		ldictTaskSamples = [dict() for tpleTask in ltpleTasks]
+		tpPool = ThreadPool(processes=iThreads)
+		try:
+			if ldictDistanceArgs:
+				tpPool.map(lambda dictArgs: self._funcGetDistanceMatrix(**dictArgs), ldictDistanceArgs)
+			tpPool.map(lambda iTask: ltpleTasks[iTask][0](ldictTaskSamples[iTask], **ltpleTasks[iTask][1]), xrange(len(ltpleTasks)))
+		finally:
+			tpPool.close()
+			tpPool.join()
+
+		for dictTaskSamples in ldictTaskSamples:
+			for sKey, lsSamples in dictTaskSamples.items():
+				dictSelectedSamples.setdefault(sKey,[]).extend(lsSamples)
+
 	def _funcRunNormalizeSensitiveMethods(self, abndData, iSampleSelectionCount, dictSelectedSamples, lsAlphaMetrics, lsBetaMetrics, lsInverseBetaMetrics,
 												fRunDiversity, fRunRepresentative, fRunExtreme, strAlphaMetadata=None,
-												istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fInvertDiversity=False):
+												istmBetaMatrix=None, istrmTree=None, istrmEnvr=None, fInvertDiversity=False, strStratum=None):
 		"""
 		Manages running methods that are sensitive to normalization. This is called twice, once for the set of methods which should not be normalized and the other
 		for the set that should be normalized.
@@ -693,108 +1530,66 @@ class MicroPITA:
 		:type:	Boolean	
 		:param	istmBetaMatrix:	File that has a precalculated beta matrix
 		:type:	File stream or File path string
+		:param	strStratum:	Value of the stratification metadata of the samples (None if not stratified).
+		:type:	String
 		:return	Selected Samples:	Samples selected by methods.
 				Dictionary	{"Selection Method":["SampleID","SampleID","SampleID",...]}
 		"""
 
 		#Sample ids/names
 		lsSampleNames = abndData.funcGetSampleNames()
-	
+
+		#Selection methods to run, in the order their samples are added, as (function adding samples, keyword arguments)
+		ltpleTasks = []
+
 		#Generate alpha metrics and get most diverse
 		if fRunDiversity:
+			ltpleTasks.append((self._funcAddDiverseSamples, {"abndData":abndData, "lsSampleNames":lsSampleNames, "iSampleSelectionCount":iSampleSelectionCount,
+				"lsAlphaMetrics":lsAlphaMetrics, "strAlphaMetadata":strAlphaMetadata, "fInvertDiversity":fInvertDiversity}))
 
-			#Get Alpha metrics matrix
-			internalAlphaMatrix = None
-			#Name of technique
-			strMethod = [strAlphaMetadata] if strAlphaMetadata else lsAlphaMetrics
-
-			#If given an alpha-diversity metadata
-			if strAlphaMetadata:
-				internalAlphaMatrix = [[float(strNum) for strNum in abndData.funcGetMetadata(strAlphaMetadata)]]
-			else:
-				#Expects Observations (Taxa (row) x sample (column))
-				#Returns [[metric1-sample1, metric1-sample2, metric1-sample3],[metric1-sample1, metric1-sample2, metric1-sample3]]
-				internalAlphaMatrix = Metric.funcBuildAlphaMetricsMatrix(npaSampleAbundance = abndData.funcGetAbundanceCopy()
-							if not abndData.funcIsSummed()
-							else abndData.funcGetFeatureAbundanceTable(abndData.funcGetTerminalNodes()).funcGetAbundanceCopy(),
-							lsSampleNames = lsSampleNames, lsDiversityMetricAlpha = lsAlphaMetrics)
-	
-			if internalAlphaMatrix:
-				#Invert measurments
-				if fInvertDiversity:
-					lldNewDiversity = []
-					for lsLine in internalAlphaMatrix:
-						lldNewDiversity.append([1/max(dValue,ConstantsMicropita.c_smallNumber) for dValue in lsLine])
-					internalAlphaMatrix = lldNewDiversity
-				#Get top ranked alpha diversity by most diverse
-				#Expects [[sample1,sample2,sample3...],[sample1,sample2,sample3..],...]
-				#Returns [[sampleName1, sampleName2, sampleNameN],[sampleName1, sampleName2, sampleNameN]]
-				mostDiverseAlphaSamplesIndexes = self.funcGetTopRankedSamples(lldMatrix=internalAlphaMatrix, lsSampleNames=lsSampleNames, iTopAmount=iSampleSelectionCount)
-
-				#Add to results
-				for index in xrange(0,len(strMethod)):
-					strSelectionMethod = self.dictConvertAMetricDiversity.get(strMethod[index],ConstantsMicropita.c_strDiversity+"="+strMethod[index])
-					dictSelectedSamples.setdefault(strSelectionMethod,[]).extend(mostDiverseAlphaSamplesIndexes[index])
-
-		logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Selected Samples 1b")
-		logging.info(dictSelectedSamples)
-	
 		#Generate beta metrics and 
 		if fRunRepresentative or fRunExtreme:
 
-			#Abundance matrix transposed
-			npaTransposedAbundance = UtilityMath.funcTransposeDataMatrix(abndData.funcGetAbundanceCopy(), fRemoveAdornments=True)
-	
+			#Algorithm for extreme selection
+			funcSelectExtremeSamples = self.funcSelectExtremeSamplesFromPairs if self.strExtremeMethod == self.c_strExtremePairs else self.funcSelectExtremeSamplesFromHClust
+
+			#Abundance matrix transposed, shared by all methods
+			npaTransposedAbundance = abndData.funcGetSampleAbundanceMatrix()
+			dictBetaArgs = {"lsSampleNames":lsSampleNames, "istmBetaMatrix":istmBetaMatrix, "istrmTree":istrmTree, "istrmEnvr":istrmEnvr,
+				"fSummed":abndData.funcIsSummed(), "fNormalized":abndData.funcIsNormalized(), "lsFeatureNames":list(abndData.funcGetFeatureNames())}
+
 			#Get center selection using clusters/tiling
 			#This will be for beta metrics in normalized space
 			if fRunRepresentative:
+				logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Performing representative selection on normalized data.")
+				for bMetric in [ConstantsMicropita.c_custom] if istmBetaMatrix else lsBetaMetrics:
 
-				if istmBetaMatrix:
 					#Get representative dissimilarity samples
-					medoidSamples=self.funcGetCentralSamplesByKMedoids(npaMatrix=npaTransposedAbundance, sMetric=ConstantsMicropita.c_custom, lsSampleNames=lsSampleNames, iNumberSamplesReturned=iSampleSelectionCount, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr)
-
-					if medoidSamples:
-						dictSelectedSamples.setdefault(ConstantsMicropita.c_strRepresentative+"="+ConstantsMicropita.c_custom,[]).extend(medoidSamples)
-				else:
-					logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Performing representative selection on normalized data.")
-					for bMetric in lsBetaMetrics:
-
-						#Get representative dissimilarity samples
-						medoidSamples=self.funcGetCentralSamplesByKMedoids(npaMatrix=npaTransposedAbundance, sMetric=bMetric, lsSampleNames=lsSampleNames, iNumberSamplesReturned=iSampleSelectionCount, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr)
-
-						if medoidSamples:
-							dictSelectedSamples.setdefault(self.dictConvertBMetricToMethod.get(bMetric,ConstantsMicropita.c_strRepresentative+"="+bMetric),[]).extend(medoidSamples)
+					dictArgs = dict(dictBetaArgs)
+					dictArgs.update({"strMethod":self.dictConvertBMetricToMethod.get(bMetric,ConstantsMicropita.c_strRepresentative+"="+bMetric), "strStratum":strStratum,
+						"npaMatrix":npaTransposedAbundance, "sMetric":bMetric, "iNumberSamplesReturned":iSampleSelectionCount})
+					ltpleTasks.append((self._funcAddCentralSamples, dictArgs))
 
 			#Get extreme selection using clusters, tiling
 			if fRunExtreme:
 				logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Performing extreme selection on normalized data.")
-				if istmBetaMatrix:
+				#Run with the inverse custom distance metric in normalized space
+				for bMetric in [ConstantsMicropita.c_custom] if istmBetaMatrix else lsInverseBetaMetrics:
 
 					#Samples for representative dissimilarity
 					#This involves inverting the distance metric,
 					#Taking the dendrogram level of where the number cluster == the number of samples to select
 					#Returning a repersentative sample from each cluster
-					extremeSamples = self.funcSelectExtremeSamplesFromHClust(strBetaMetric=ConstantsMicropita.c_custom, npaAbundanceMatrix=npaTransposedAbundance, lsSampleNames=lsSampleNames, iSelectSampleCount=iSampleSelectionCount, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr)
-	
-					#Add selected samples
-					if extremeSamples:
-						dictSelectedSamples.setdefault(ConstantsMicropita.c_strExtreme+"="+ConstantsMicropita.c_custom,[]).extend(extremeSamples)
-
-				else:
-					#Run KMedoids with inverse custom distance metric in normalized space
-					for bMetric in lsInverseBetaMetrics:
-
-						#Samples for representative dissimilarity
-						#This involves inverting the distance metric,
-						#Taking the dendrogram level of where the number cluster == the number of samples to select
-						#Returning a repersentative sample from each cluster
-						extremeSamples = self.funcSelectExtremeSamplesFromHClust(strBetaMetric=bMetric, npaAbundanceMatrix=npaTransposedAbundance, lsSampleNames=lsSampleNames, iSelectSampleCount=iSampleSelectionCount, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr)
-	
-						#Add selected samples
-						if extremeSamples:
-							dictSelectedSamples.setdefault(self.dictConvertInvBMetricToMethod.get(bMetric,ConstantsMicropita.c_strExtreme+"="+bMetric),[]).extend(extremeSamples)
+					dictArgs = dict(dictBetaArgs)
+					dictArgs.update({"strMethod":self.dictConvertInvBMetricToMethod.get(bMetric,ConstantsMicropita.c_strExtreme+"="+bMetric),
+						"funcSelectExtremeSamples":funcSelectExtremeSamples, "strBetaMetric":bMetric, "npaAbundanceMatrix":npaTransposedAbundance,
+						"iSelectSampleCount":iSampleSelectionCount})
+					ltpleTasks.append((self._funcAddExtremeSamples, dictArgs))
+
+		self._funcRunSelectionTasks(ltpleTasks=ltpleTasks, dictSelectedSamples=dictSelectedSamples,
+			ldictDistanceArgs=self._funcPlanDistances(ltpleTasks=ltpleTasks, iSampleCount=len(lsSampleNames)) if self.iThreads > 1 else [])
 
-		logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Selected Samples 2,3b")
+		logging.info("MicroPITA.funcRunNormalizeSensitiveMethods:: Selected Samples 1b,2,3b")
 		logging.info(dictSelectedSamples)
 		return dictSelectedSamples
 
@@ -803,7 +1598,8 @@ class MicroPITA:
 					  cDelimiter, cFeatureNameDelimiter, strFeatureSelection,
 					  istmFeatures, iCount, lstrMethods, strLastRowMetadata = None, strLabel = None, strStratify = None,
 					  strCustomAlpha = None, strCustomBeta = None, strAlphaMetadata = None, istmBetaMatrix = None, istrmTree = None, istrmEnvr = None, 
-					  iMinSeqs = ConstantsMicropita.c_liOccurenceFilter[0], iMinSamples = ConstantsMicropita.c_liOccurenceFilter[1], fInvertDiversity = False):
+					  iMinSeqs = ConstantsMicropita.c_liOccurenceFilter[0], iMinSamples = ConstantsMicropita.c_liOccurenceFilter[1], fInvertDiversity = False,
+					  iRandomSeed = None, iRandomDraws = 1, iProcesses = 1, abndTable = None):
 		"""
 		Manages the selection of samples given different metrics.
 
@@ -853,6 +1649,16 @@ class MicroPITA:
 		:type:	Integer
 		:param	fInvertDiversity: When true will invert diversity measurements before using.
 		:type:	boolean
+		:param	iRandomSeed: Seed of random selection (None uses the global random state).
+		:type:	Integer
+		:param	iRandomDraws: Number of random selections, more than 1 are written as the random method followed by _ and the draw number.
+		:type:	Integer
+		:param	iProcesses: Number of worker processes running strata. Each stratum draws random samples from its own generator,
+				seeded in stratum order from iRandomSeed, so the selection does not depend on the number of processes.
+		:type:	Integer
+		:param	abndTable: Abundance table already read from istmInput (for instance to run several selections on one table).
+				A copy is used so the table is left unchanged, istmInput and the reading parameters are then ignored.
+		:type:	AbundanceTable
 		:return	Selected Samples:	Samples selected by methods.
 				Dictionary	{"Selection Method":["SampleID","SampleID","SampleID",...]}
 		"""
@@ -893,13 +1699,14 @@ class MicroPITA:
 			#Read in taxa list, break down to lines and filter out empty strings
 			userDefinedTaxa = filter(None,(s.strip( ) for s in istmFeatures.readlines()))
 		c_RUN_RANDOM_5 = ConstantsMicropita.c_strRandom in lstrMethods
+		rndRandom = random.Random(iRandomSeed) if not iRandomSeed is None else random
 		c_RUN_DISTINCT = ConstantsMicropita.c_strDistinct in lstrMethods
 		c_RUN_DISCRIMINANT = ConstantsMicropita.c_strDiscriminant in lstrMethods
 
 		#Read in abundance data
 		#Abundance is a structured array. Samples (column) by Taxa (rows) with the taxa id row included as the column index=0
 		#Abundance table object to read in and manage data
-		totalAbundanceTable = AbundanceTable.funcMakeFromFile(xInputFile=istmInput, lOccurenceFilter = [iMinSeqs, iMinSamples],
+		totalAbundanceTable = copy.deepcopy(abndTable) if abndTable else AbundanceTable.funcMakeFromFile(xInputFile=istmInput, lOccurenceFilter = [iMinSeqs, iMinSamples],
 								cDelimiter=cDelimiter, sMetadataID=strIDName, sLastMetadataRow=strLastRowMetadata,
 								sLastMetadata=strLastMetadataName, cFeatureNameDelimiter=cFeatureNameDelimiter, xOutputFile=ostmCheckedFile)
 		if not totalAbundanceTable:
@@ -918,84 +1725,170 @@ class MicroPITA:
 			logging.error("The label " + strLabel + " did not have 2 or more values. Labels found=" + str(dictTotalMetadata.get(strLabel,[])))
 			return False
 
+		#Distances which do not depend on the abundance table are read or measured once for all strata
+		if c_RUN_REPRESENTIVE_DISSIMILARITY_2 or c_RUN_MAX_DISSIMILARITY_3:
+			if not self.funcLoadCohortDistances(lsBetaMetrics=diversityMetricsBeta, istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr):
+				logging.error("MicroPITA.funcRun:: Could not load the distance matrices of the cohort.")
+				return False
+
 		#Run unsupervised methods###
 		#Stratify the data if need be and drop the old data
 		lStratifiedAbundanceTables = totalAbundanceTable.funcStratifyByMetadata(strStratify) if strStratify else [totalAbundanceTable]
 
 		#For each stratified abundance block or for the unstratfified abundance
 		#Run the unsupervised blocks
-		fAppendSupFiles = False
-		for stratAbundanceTable in lStratifiedAbundanceTables:
-			logging.info("MicroPITA.funcRun:: Running abundance block:"+stratAbundanceTable.funcGetName())
-
- 			###NOT SUMMED, NOT NORMALIZED			
-			#Only perform if the data is not yet normalized
-			if not stratAbundanceTable.funcIsNormalized( ):
-				#Need to first work with unnormalized data
-				if c_RUN_MAX_DIVERSITY_1 or c_RUN_REPRESENTIVE_DISSIMILARITY_2 or c_RUN_MAX_DISSIMILARITY_3:
-
-					self._funcRunNormalizeSensitiveMethods(abndData=stratAbundanceTable, iSampleSelectionCount=iCount,
-													 dictSelectedSamples=selectedSamples, lsAlphaMetrics=diversityMetricsAlphaNoNormalize,
-													 lsBetaMetrics=diversityMetricsBetaNoNormalize,
-													 lsInverseBetaMetrics=diversityMetricsBetaNoNormalize,
-													 fRunDiversity=c_RUN_MAX_DIVERSITY_1,fRunRepresentative=c_RUN_REPRESENTIVE_DISSIMILARITY_2,
-													 fRunExtreme=c_RUN_MAX_DISSIMILARITY_3, strAlphaMetadata=strAlphaMetadata, 
-                                                                                                         istrmTree=istrmTree, istrmEnvr=istrmEnvr, fInvertDiversity=fInvertDiversity)
+		#Supervised output is gathered over all strata and written once after the last
+		dictSVMLines = dict()
+		dictPredictDistances = dict()
+		#Settings shared by all strata
+		dictStratumArgs = dict(iCount=iCount, fRunDiversity=c_RUN_MAX_DIVERSITY_1, fRunRepresentative=c_RUN_REPRESENTIVE_DISSIMILARITY_2,
+			fRunExtreme=c_RUN_MAX_DISSIMILARITY_3, fRunFeatures=c_RUN_RANK_AVERAGE_USER_4, fRunRandom=c_RUN_RANDOM_5,
+			fRunDistinct=c_RUN_DISTINCT, fRunDiscriminant=c_RUN_DISCRIMINANT, diversityMetricsAlpha=diversityMetricsAlpha,
+			diversityMetricsBeta=diversityMetricsBeta, diversityMetricsAlphaNoNormalize=diversityMetricsAlphaNoNormalize,
+			diversityMetricsBetaNoNormalize=diversityMetricsBetaNoNormalize, userDefinedTaxa=userDefinedTaxa,
+			strFeatureSelection=strFeatureSelection, strAlphaMetadata=strAlphaMetadata, istmBetaMatrix=istmBetaMatrix,
+			istrmTree=istrmTree, istrmEnvr=istrmEnvr, fInvertDiversity=fInvertDiversity, strStratify=strStratify,
+			iRandomDraws=iRandomDraws, strLabel=strLabel, ostmInputPredictFile=ostmInputPredictFile, ostmPredictFile=ostmPredictFile,
+			lsOriginalSampleNames=totalAbundanceTable.funcGetSampleNames(), lsOriginalLabels=lsOriginalLabels)
+
+		iProcesses = min(iProcesses, len(lStratifiedAbundanceTables))
+		iFeatureCount = 0
+		#Each stratum draws from its own generator, seeded in stratum order so seeded runs are repeatable
+		#and do not depend on the number of processes
+		liSeeds = [rndRandom.randint(0,2**32-1) for stratAbundanceTable in lStratifiedAbundanceTables]
+		if iProcesses > 1:
+			_dictSharedStratumRun.update({"microPITA":self, "tables":lStratifiedAbundanceTables, "args":dictStratumArgs})
+			lckRepresentativeState = self._lckRepresentativeState
+			self._lckRepresentativeState = multiprocessing.Lock()
+			try:
+				mpPool = multiprocessing.Pool(processes=iProcesses)
+				ltpleStrata = mpPool.map(_funcRunSharedStratum, list(enumerate(liSeeds)))
+				mpPool.close()
+				mpPool.join()
+			finally:
+				_dictSharedStratumRun.clear()
+				self._lckRepresentativeState = lckRepresentativeState
+
+			#Merge in stratum order as if the strata had run one after the other
+			#Targeted feature and random selections are replaced by each stratum, other selections are extended
+			setReplacedMethods = set([ConstantsMicropita.c_strFeature,ConstantsMicropita.c_strRandom]+
+				[ConstantsMicropita.c_strRandom+"_"+str(iDraw+1) for iDraw in xrange(iRandomDraws)])
+			for dictStratumSamples, dictStratumLines, dictStratumDistances, iFeatureCount in ltpleStrata:
+				for sKey, lsSamples in dictStratumSamples.items():
+					if sKey in setReplacedMethods:
+						selectedSamples[sKey] = lsSamples
+					else:
+						selectedSamples.setdefault(sKey,[]).extend(lsSamples)
+				dictSVMLines.update(dictStratumLines)
+				for sKey, dictDistances in dictStratumDistances.items():
+					dictPredictDistances.setdefault(sKey,dict()).update(dictDistances)
+		else:
+			for stratAbundanceTable, iSeed in zip(lStratifiedAbundanceTables,liSeeds):
+				self._funcRunStratum(stratAbundanceTable=stratAbundanceTable, dictSelectedSamples=selectedSamples,
+					dictSVMLines=dictSVMLines, dictPredictDistances=dictPredictDistances, rndRandom=random.Random(iSeed), **dictStratumArgs)
+				iFeatureCount = stratAbundanceTable.funcGetFeatureCount()
+
+		if (c_RUN_DISTINCT or c_RUN_DISCRIMINANT) and strLabel:
+			self.funcWriteSupervisedFiles(xOutputSupFile=ostmInputPredictFile, xPredictSupFile=ostmPredictFile,
+				dictSVMLines=dictSVMLines, dictPredictDistances=dictPredictDistances, abundanceTable=totalAbundanceTable,
+				lsOriginalSampleNames=totalAbundanceTable.funcGetSampleNames(), lsOriginalLabels=lsOriginalLabels,
+				iFeatureCount=iFeatureCount)
+		return selectedSamples
+	
+	def _funcRunStratum(self, stratAbundanceTable, dictSelectedSamples, dictSVMLines, dictPredictDistances, rndRandom, iCount,
+					fRunDiversity, fRunRepresentative, fRunExtreme, fRunFeatures, fRunRandom, fRunDistinct, fRunDiscriminant,
+					diversityMetricsAlpha, diversityMetricsBeta, diversityMetricsAlphaNoNormalize, diversityMetricsBetaNoNormalize,
+					userDefinedTaxa, strFeatureSelection, strAlphaMetadata, istmBetaMatrix, istrmTree, istrmEnvr, fInvertDiversity,
+					strStratify, iRandomDraws, strLabel, ostmInputPredictFile, ostmPredictFile, lsOriginalSampleNames, lsOriginalLabels):
+		"""
+		Runs the selection methods on one stratum (or the unstratified abundance table), summing and normalizing the table on the way.
+		Parameters not described here are the settings funcRun derives from its own parameters.
 
+		:param	stratAbundanceTable:	Abundance table of the stratum.
+		:type:	AbundanceTable
+		:param	dictSelectedSamples:	Selected samples are added here {"Selection Method":["SampleID","SampleID",...]}.
+		:type:	Dictionary
+		:param	dictSVMLines:	Lines of the supervised input file are added here (see funcRunSupervisedDistancesFromCentroids).
+		:type:	Dictionary
+		:param	dictPredictDistances:	Distances of the supervised predict file are added here (see funcRunSupervisedDistancesFromCentroids).
+		:type:	Dictionary
+		:param	rndRandom:	Random generator of random selection.
+		:type:	Random
+		"""
 
-			#Generate selection by the rank average of user defined taxa
-			#Expects (Taxa (row) by Samples (column))
-			#Expects a column 0 of taxa id that is skipped
-			#Returns [(sample name,average,rank)]
-			#SUMMED AND NORMALIZED
-			stratAbundanceTable.funcSumClades()
-			#Normalize data at this point
-			stratAbundanceTable.funcNormalize()
-			if c_RUN_RANK_AVERAGE_USER_4:
-				selectedSamples[ConstantsMicropita.c_strFeature] = self.funcSelectTargetedTaxaSamples(abndMatrix=stratAbundanceTable,
-						lsTargetedTaxa=userDefinedTaxa, iSampleSelectionCount=iCount, sMethod=strFeatureSelection)
-				logging.info("MicroPITA.funcRun:: Selected Samples Rank")
-				logging.info(selectedSamples)
-
- 			###SUMMED AND NORMALIZED analysis block
-			#Diversity based metric will move reduce to terminal taxa as needed
-			if c_RUN_MAX_DIVERSITY_1 or c_RUN_REPRESENTIVE_DISSIMILARITY_2 or c_RUN_MAX_DISSIMILARITY_3:
+		logging.info("MicroPITA._funcRunStratum:: Running abundance block:"+stratAbundanceTable.funcGetName())
+
+ 		###NOT SUMMED, NOT NORMALIZED			
+		#Only perform if the data is not yet normalized
+		if not stratAbundanceTable.funcIsNormalized( ):
+			#Need to first work with unnormalized data
+			if fRunDiversity or fRunRepresentative or fRunExtreme:
 
 				self._funcRunNormalizeSensitiveMethods(abndData=stratAbundanceTable, iSampleSelectionCount=iCount,
-												 dictSelectedSamples=selectedSamples, lsAlphaMetrics=diversityMetricsAlpha,
-												 lsBetaMetrics=diversityMetricsBeta,
-												 lsInverseBetaMetrics=diversityMetricsBeta,
-												 fRunDiversity=c_RUN_MAX_DIVERSITY_1,fRunRepresentative=c_RUN_REPRESENTIVE_DISSIMILARITY_2,
-												 fRunExtreme=c_RUN_MAX_DISSIMILARITY_3,
-                                                                                                 istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr, fInvertDiversity=fInvertDiversity)
-
-			#5::Select randomly
-			#Expects sampleNames = List of sample names [name, name, name...]
-			if(c_RUN_RANDOM_5):
-				#Select randomly from sample names
-				selectedSamples[ConstantsMicropita.c_strRandom] = self.funcGetRandomSamples(lsSamples=stratAbundanceTable.funcGetSampleNames(), iNumberOfSamplesToReturn=iCount)
-				logging.info("MicroPITA.funcRun:: Selected Samples Random")
-				logging.info(selectedSamples)
-
-			#Perform supervised selection
-			if c_RUN_DISTINCT or c_RUN_DISCRIMINANT:
- 				if strLabel:
-					dictSelectionRet = self.funcRunSupervisedDistancesFromCentroids(abundanceTable=stratAbundanceTable,
-								fRunDistinct=c_RUN_DISTINCT, fRunDiscriminant=c_RUN_DISCRIMINANT,
-								xOutputSupFile=ostmInputPredictFile,xPredictSupFile=ostmPredictFile,
-								strSupervisedMetadata=strLabel, iSampleSupSelectionCount=iCount,
-								lsOriginalSampleNames = totalAbundanceTable.funcGetSampleNames(),
-								lsOriginalLabels = lsOriginalLabels,
-								fAppendFiles=fAppendSupFiles)
-
-					[selectedSamples.setdefault(sKey,[]).extend(lValue) for sKey,lValue in dictSelectionRet.items()]
-
-					if not fAppendSupFiles:
-						fAppendSupFiles = True
-					logging.info("MicroPITA.funcRun:: Selected Samples Unsupervised")
-					logging.info(selectedSamples)
-		return selectedSamples
-	
+												 dictSelectedSamples=dictSelectedSamples, lsAlphaMetrics=diversityMetricsAlphaNoNormalize,
+												 lsBetaMetrics=diversityMetricsBetaNoNormalize,
+												 lsInverseBetaMetrics=diversityMetricsBetaNoNormalize,
+												 fRunDiversity=fRunDiversity,fRunRepresentative=fRunRepresentative,
+												 fRunExtreme=fRunExtreme, strAlphaMetadata=strAlphaMetadata, 
+                                                                                                         istrmTree=istrmTree, istrmEnvr=istrmEnvr, fInvertDiversity=fInvertDiversity)
+
+
+		#Generate selection by the rank average of user defined taxa
+		#Expects (Taxa (row) by Samples (column))
+		#Expects a column 0 of taxa id that is skipped
+		#Returns [(sample name,average,rank)]
+		#SUMMED AND NORMALIZED
+		stratAbundanceTable.funcSumClades()
+		#Normalize data at this point
+		stratAbundanceTable.funcNormalize()
+		if fRunFeatures:
+			dictSelectedSamples[ConstantsMicropita.c_strFeature] = self.funcSelectTargetedTaxaSamples(abndMatrix=stratAbundanceTable,
+					lsTargetedTaxa=userDefinedTaxa, iSampleSelectionCount=iCount, sMethod=strFeatureSelection)
+			logging.info("MicroPITA._funcRunStratum:: Selected Samples Rank")
+			logging.info(dictSelectedSamples)
+
+ 		###SUMMED AND NORMALIZED analysis block
+		#Diversity based metric will move reduce to terminal taxa as needed
+		if fRunDiversity or fRunRepresentative or fRunExtreme:
+
+			self._funcRunNormalizeSensitiveMethods(abndData=stratAbundanceTable, iSampleSelectionCount=iCount,
+											 dictSelectedSamples=dictSelectedSamples, lsAlphaMetrics=diversityMetricsAlpha,
+											 lsBetaMetrics=diversityMetricsBeta,
+											 lsInverseBetaMetrics=diversityMetricsBeta,
+											 fRunDiversity=fRunDiversity,fRunRepresentative=fRunRepresentative,
+											 fRunExtreme=fRunExtreme,
+                                                                                                 istmBetaMatrix=istmBetaMatrix, istrmTree=istrmTree, istrmEnvr=istrmEnvr, fInvertDiversity=fInvertDiversity,
+											 strStratum=stratAbundanceTable.funcGetMetadata(strStratify)[0] if strStratify else None)
+
+		#5::Select randomly
+		#Expects sampleNames = List of sample names [name, name, name...]
+		if(fRunRandom):
+			#Select randomly from sample names
+			if iRandomDraws > 1:
+				llsRandomSamples = self.funcGetRandomSampleDraws(lsSamples=stratAbundanceTable.funcGetSampleNames(), iNumberOfSamplesToReturn=iCount, iDraws=iRandomDraws, rndRandom=rndRandom)
+				for iDraw, lsRandomSamples in enumerate(llsRandomSamples):
+					dictSelectedSamples[ConstantsMicropita.c_strRandom+"_"+str(iDraw+1)] = lsRandomSamples
+			else:
+				dictSelectedSamples[ConstantsMicropita.c_strRandom] = self.funcGetRandomSamples(lsSamples=stratAbundanceTable.funcGetSampleNames(), iNumberOfSamplesToReturn=iCount, rndRandom=rndRandom)
+			logging.info("MicroPITA._funcRunStratum:: Selected Samples Random")
+			logging.info(dictSelectedSamples)
+
+		#Perform supervised selection
+		if fRunDistinct or fRunDiscriminant:
+ 			if strLabel:
+				dictSelectionRet = self.funcRunSupervisedDistancesFromCentroids(abundanceTable=stratAbundanceTable,
+							fRunDistinct=fRunDistinct, fRunDiscriminant=fRunDiscriminant,
+							xOutputSupFile=ostmInputPredictFile,xPredictSupFile=ostmPredictFile,
+							strSupervisedMetadata=strLabel, iSampleSupSelectionCount=iCount,
+							lsOriginalSampleNames = lsOriginalSampleNames,
+							lsOriginalLabels = lsOriginalLabels,
+							dictSVMLines=dictSVMLines, dictPredictDistances=dictPredictDistances)
+
+				[dictSelectedSamples.setdefault(sKey,[]).extend(lValue) for sKey,lValue in dictSelectionRet.items()]
+
+				logging.info("MicroPITA._funcRunStratum:: Selected Samples Unsupervised")
+				logging.info(dictSelectedSamples)
+
 	#Testing: Happy path tested
 	@staticmethod
 	def funcWriteSelectionToFile(dictSelection,xOutputFilePath):
@@ -1055,6 +1948,36 @@ args.add_argument("-x","--betamatrix", dest = "istmBetaMatrix", metavar = "BetaD
 args.add_argument("-o","--tree", dest = "istrmTree", metavar = "PhylogeneticTree", default = None, help = ConstantsMicropita.c_strCustomPhylogeneticTreeHelp)
 args.add_argument("-i","--envr", dest = "istrmEnvr", metavar = "EnvironmentFile", default = None, help = ConstantsMicropita.c_strCustomEnvironmentFileHelp)
 args.add_argument("-f","--invertDiversity", dest = "fInvertDiversity", action="store_true", default = False, help = ConstantsMicropita.c_strInvertDiversityHelp)
+args.add_argument("--seed", dest = "iRandomSeed", metavar = "RandomSeed", default = None, type = int, help = "Seed of random selection, so reruns select the same samples.")
+args.add_argument("--randomdraws", dest = "iRandomDraws", metavar = "RandomDraws", default = 1, type = int,
+	help = "Number of independent random selections (for instance as null baselines), written as random_1, random_2, ...")
+args.add_argument("--distancecache", dest = "strDistanceCache", metavar = "DistanceCacheDirectory", default = None,
+	help = "Directory to store measured beta-diversity matrices in. Later runs on the same data (for instance with a different sample count) reuse them instead of measuring them again.")
+args.add_argument("--representativemethod", dest = "strRepresentativeMethod", metavar = "KMedoidsMethod", default = MicroPITA.c_strRepresentativePAM, choices = MicroPITA.c_lsRepresentativeMethods,
+	help = "K-medoids algorithm for representative selection. pam clusters with the full distance matrix; clara clusters random subsamples and measures distances on demand, for very large cohorts.")
+args.add_argument("--clarasamples", dest = "iClaraSamples", metavar = "ClaraSamples", default = 5, type = int, help = "Number of subsamples clustered with the clara representative method.")
+args.add_argument("--clarasamplesize", dest = "iClaraSampleSize", metavar = "ClaraSampleSize", default = None, type = int,
+	help = "Samples in each subsample of the clara representative method (default 40 + 2 times the number of samples selected).")
+args.add_argument("--kmedoidsinit", dest = "strKMedoidsInit", metavar = "KMedoidsInit", default = MicroPITA.c_strKMedoidsInitRandom, choices = MicroPITA.c_lsKMedoidsInits,
+	help = "Initial medoids of the pam representative method: random samples, PAM BUILD or k-medoids++.")
+args.add_argument("--kmedoidsrestarts", dest = "iKMedoidsRestarts", metavar = "KMedoidsRestarts", default = 1, type = int,
+	help = "Number of pam restarts from different initial medoids, run in parallel. The clustering with the lowest cost is kept.")
+args.add_argument("--representativesweep", dest = "liRepresentativeSweep", metavar = "samples", default = None, type = int, action = "append",
+	help = "Select representative samples for this sample count instead of -n, repeat for several counts. The counts are clustered in one run, each starting from the medoids of the previous count, and written as one selection per count (for instance representative_k20).")
+args.add_argument("--extrememethod", dest = "strExtremeMethod", metavar = "ExtremeMethod", default = MicroPITA.c_strExtremeHClust, choices = MicroPITA.c_lsExtremeMethods,
+	help = "Algorithm for extreme selection. hclust takes samples as they join an average linkage clustering; pairs takes samples from the most distant pairs without clustering, for large cohorts.")
+args.add_argument("--supervisedmetric", dest = "strSupervisedMetric", metavar = "SupervisedMetric", default = Metric.c_strBrayCurtisDissimilarity,
+	choices = [Metric.c_strBrayCurtisDissimilarity]+sorted(Metric.setBetaDiversities), help = "Beta metric measuring the distance of samples from the label centroids in the distinct and discriminant methods.")
+args.add_argument("--supervisedcentroid", dest = "strSupervisedCentroid", metavar = "SupervisedCentroid", default = MicroPITA.c_strSupervisedCentroidMean, choices = MicroPITA.c_lsSupervisedCentroids,
+	help = "Centroid of each label in the distinct and discriminant methods: the average sample, the median of each feature or the label's medoid sample.")
+args.add_argument("--representativestate", dest = "strRepresentativeStateFile", metavar = "StateFile", default = None,
+	help = "File keeping the medoids and cluster assignments of representative selection between runs. Later runs on a grown cohort only assign the new samples to the closest medoids, instead of clustering all samples again.")
+args.add_argument("--representativerefine", dest = "dRepresentativeRefineThreshold", metavar = "RefineThreshold", default = MicroPITA.c_dRepresentativeRefineThreshold, type = float,
+	help = "Relative growth of a cluster's cost (with --representativestate) which triggers moving its medoid to the member closest to the other members.")
+args.add_argument("--processes", dest = "iProcesses", metavar = "Processes", default = 1, type = int,
+	help = "Number of worker processes running strata (with --stratify) at the same time.")
+args.add_argument("--threads", dest = "iThreads", metavar = "Threads", default = 1, type = int,
+	help = "Number of threads running the diversity, representative and extreme methods of a stratum at the same time.")
 
 args = argp.add_argument_group( "Miscellaneous", "Row/column identifiers and feature targeting options" )
 args.add_argument("-d",ConstantsMicropita.c_strIDNameArgument, dest="strIDName", metavar="sample_id", help= ConstantsMicropita.c_strIDNameHelp)
@@ -1098,7 +2021,11 @@ def _main( ):
 
 	#Run micropita
 	logging.info("MicroPITA:: Start microPITA")
-	microPITA = MicroPITA()
+	microPITA = MicroPITA(strDistanceCacheDirectory = args.strDistanceCache, strRepresentativeMethod = args.strRepresentativeMethod,
+		iClaraSamples = args.iClaraSamples, iClaraSampleSize = args.iClaraSampleSize, strKMedoidsInit = args.strKMedoidsInit, iKMedoidsRestarts = args.iKMedoidsRestarts,
+		liRepresentativeSweep = args.liRepresentativeSweep, strRepresentativeStateFile = args.strRepresentativeStateFile,
+		dRepresentativeRefineThreshold = args.dRepresentativeRefineThreshold, strExtremeMethod = args.strExtremeMethod,
+		strSupervisedMetric = args.strSupervisedMetric, strSupervisedCentroid = args.strSupervisedCentroid, iThreads = args.iThreads)
 
 	#Argparse will append to the default but will not remove the default so I do this here
 	if not len(args.lstrMethods):
@@ -1127,7 +2054,10 @@ def _main( ):
 		istrmTree		= args.istrmTree,
 		istrmEnvr		= args.istrmEnvr,
 		lstrMethods		= args.lstrMethods,
-		fInvertDiversity	= args.fInvertDiversity
+		fInvertDiversity	= args.fInvertDiversity,
+		iRandomSeed		= args.iRandomSeed,
+		iRandomDraws		= args.iRandomDraws,
+		iProcesses		= args.iProcesses
 	)
 
 	if not dictSelectedSamples:
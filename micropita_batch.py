@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""
+Author: Timothy Tickle
+Description: Runs many microPITA selections on one abundance table, read and prepared once
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+import sys
+import argparse
+from MicroPITA import MicroPITA
+from src.breadcrumbs.src.AbundanceTable import AbundanceTable
+from src.ConstantsMicropita import ConstantsMicropita
+import csv
+import json
+import logging
+import os
+
+#YAML manifests are read when PyYAML is installed
+try:
+	import yaml
+except ImportError:
+	yaml = None
+
+#Separates the job name from the method in the combined selection file
+c_strJobSeparator = ":"
+
+#Manifest columns (or keys) of a job and the funcRun parameter they set
+c_strJobName = "name"
+c_strJobMethod = "method"
+c_strJobCount = "count"
+c_dictJobParameters = {"stratify":"strStratify", "label":"strLabel", "metric":"strCustomBeta", "alpha":"strCustomAlpha",
+	"alphameta":"strAlphaMetadata", "betamatrix":"istmBetaMatrix", "tree":"istrmTree", "envr":"istrmEnvr",
+	"feature_method":"strFeatureSelection", "seed":"iRandomSeed", "randomdraws":"iRandomDraws"}
+#Job parameters which are integers
+c_setIntegerParameters = set([c_strJobCount,"seed","randomdraws"])
+#Job parameters holding several values (comma delimited in TSV manifests)
+c_setListParameters = set([c_strJobMethod])
+
+def funcGetStrings(xValue):
+	"""
+	Converts unicode values (as read from JSON or YAML) to strings, file readers only take str paths.
+
+	:param	xValue:	Parameter value, lists are converted element by element.
+	:type:	Unicode, list or other value
+	:return	Value:	Value with unicode converted to UTF-8 encoded strings.
+	"""
+
+	if isinstance(xValue,unicode):
+		return xValue.encode("utf-8")
+	if isinstance(xValue,list):
+		return [funcGetStrings(xElement) for xElement in xValue]
+	return xValue
+
+def funcCheckJob(dictJob, iJob=0):
+	"""
+	Checks the parameters of a selection job and converts them to the types funcRun takes.
+	Parameter names are case insensitive, methods may be a list or comma delimited.
+
+	:param	dictJob:	Job parameters {"method":..., "count":..., ...}.
+	:type:	Dictionary
+	:param	iJob:	Index of the job in the manifest, a job without a name is named job(iJob+1).
+	:type:	Integer
+	:return	List:	[checked job, None] or [False, error message] on error.
+	"""
+
+	dictJob = dict([(str(sKey).strip().lower(),funcGetStrings(sValue)) for sKey, sValue in dictJob.items()])
+	dictJob.setdefault(c_strJobName,"job"+str(iJob+1))
+	strJob = "Job "+str(dictJob[c_strJobName])
+
+	strError = None
+	lsUnknown = [sKey for sKey in dictJob if not sKey in c_dictJobParameters and not sKey in [c_strJobName,c_strJobMethod,c_strJobCount,"targets"]]
+	if lsUnknown:
+		strError = strJob+" has unknown parameters: "+", ".join(lsUnknown)
+	else:
+		try:
+			for sKey in dictJob:
+				if sKey in c_setListParameters and not isinstance(dictJob[sKey],list):
+					dictJob[sKey] = [sValue.strip() for sValue in str(dictJob[sKey]).split(",") if sValue.strip()]
+				elif sKey in c_setIntegerParameters:
+					dictJob[sKey] = int(dictJob[sKey])
+		except ValueError:
+			strError = strJob+" has a parameter which is not an integer."
+	if not strError:
+		lsMethods = dictJob.get(c_strJobMethod) or []
+		lsUnknown = [str(sMethod) for sMethod in lsMethods if not sMethod in ConstantsMicropita.c_lsAllMethods]
+		if not lsMethods:
+			strError = strJob+" has no method."
+		elif lsUnknown:
+			strError = strJob+" has unknown methods: "+", ".join(lsUnknown)+". Methods are "+", ".join(ConstantsMicropita.c_lsAllMethods)+"."
+		elif (set(lsMethods) & set(ConstantsMicropita.c_lsAllSupervisedMethods)) and not dictJob.get("label"):
+			strError = strJob+" needs a label for the methods "+", ".join(ConstantsMicropita.c_lsAllSupervisedMethods)+"."
+		elif (ConstantsMicropita.c_strFeature in lsMethods) and not dictJob.get("targets"):
+			strError = strJob+" needs targets for the method "+ConstantsMicropita.c_strFeature+"."
+	if strError:
+		logging.error("micropita_batch.funcCheckJob:: "+strError)
+		return [False, strError]
+	return [dictJob, None]
+
+def funcGetRunArgs(strIDName, strLastMetadataName, cDelimiter, cFeatureNameDelimiter, iCount, strLastFeatureMetadata=None, iProcesses=1):
+	"""
+	Makes the funcRun parameters shared by jobs on one abundance table (see funcRunJobs).
+	No files are written by the jobs and targeted features are ranked unless a job says otherwise.
+
+	:param	strIDName:	Sample Id metadata row.
+	:type:	String
+	:param	strLastMetadataName:	The id of the metadata positioned last in the abundance table.
+	:type:	String
+	:param	cDelimiter:	Delimiter of the abundance table.
+	:type:	Character
+	:param	cFeatureNameDelimiter:	Delimiter of the feature names (taxonomy levels).
+	:type:	Character
+	:param	iCount:	Number of samples selected by jobs without a count.
+	:type:	Integer
+	:param	strLastFeatureMetadata:	The id of the last feature metadata.
+	:type:	String
+	:param	iProcesses:	Number of worker processes running strata.
+	:type:	Integer
+	:return	Dictionary:	{"funcRun parameter":value}
+	"""
+
+	return {"strIDName":strIDName, "strLastMetadataName":strLastMetadataName, "istmInput":None,
+		"ostmInputPredictFile":None, "ostmPredictFile":None, "ostmCheckedFile":None, "ostmOutput":None,
+		"cDelimiter":cDelimiter, "cFeatureNameDelimiter":cFeatureNameDelimiter,
+		"strFeatureSelection":ConstantsMicropita.lsTargetedFeatureMethodValues[0], "iCount":iCount,
+		"strLastRowMetadata":strLastFeatureMetadata, "iProcesses":iProcesses}
+
+def funcReadManifest(strManifestFile):
+	"""
+	Reads the selection jobs of a manifest. JSON and YAML manifests hold a list of jobs (or {"jobs":[...]}), each a dictionary
+	of job parameters. Other files are read as TSV with a header row of job parameters and one job per row, empty cells are not set.
+	Methods may be a list (comma delimited in TSV). Jobs without a name are named job1, job2, ... in manifest order.
+
+	:param	strManifestFile:	Path to the manifest (.json, .yaml or .yml are read as JSON or YAML).
+	:type:	String
+	:return	List:	List of job dictionaries or False on error.
+	"""
+
+	strExtension = os.path.splitext(strManifestFile)[1].lower()
+	with open(strManifestFile) as istrmManifest:
+		if strExtension == ".json":
+			xJobs = json.load(istrmManifest)
+		elif strExtension in [".yaml",".yml"]:
+			if not yaml:
+				logging.error("micropita_batch.funcReadManifest:: Reading a YAML manifest requires PyYAML.")
+				return False
+			xJobs = yaml.safe_load(istrmManifest)
+		else:
+			xJobs = [dict([(sKey,sValue) for sKey, sValue in dictRow.items() if sValue])
+				for dictRow in csv.DictReader(istrmManifest, delimiter=ConstantsMicropita.c_outputFileDelim)]
+	if isinstance(xJobs,dict):
+		xJobs = xJobs.get("jobs",[])
+
+	ldictJobs = [funcCheckJob(dictJob=dictJob, iJob=iJob)[0] for iJob, dictJob in enumerate(xJobs)]
+	if False in ldictJobs:
+		return False
+
+	lsNames = [dictJob[c_strJobName] for dictJob in ldictJobs]
+	if not len(set(lsNames)) == len(lsNames):
+		logging.error("micropita_batch.funcReadManifest:: Job names must be unique.")
+		return False
+	return ldictJobs
+
+def funcRunJob(microPITA, abndTable, dictJob, dictRunArgs):
+	"""
+	Runs one selection job on an abundance table. Errors of the selection are raised.
+
+	:param	microPITA:	MicroPITA object running the job.
+	:type:	MicroPITA
+	:param	abndTable:	Abundance table read once for all jobs, the job works on a copy.
+	:type:	AbundanceTable
+	:param	dictJob:	Job checked by funcCheckJob.
+	:type:	Dictionary
+	:param	dictRunArgs:	funcRun parameters shared by all jobs (see funcGetRunArgs).
+	:type:	Dictionary
+	:return	Dictionary:	Selected samples {"Selection Method":["SampleID",...]} or False on error.
+	"""
+
+	logging.info("micropita_batch.funcRunJob:: Running job "+str(dictJob[c_strJobName]))
+	dictArgs = dict(dictRunArgs)
+	dictArgs.update([(c_dictJobParameters[sKey],xValue) for sKey, xValue in dictJob.items() if sKey in c_dictJobParameters])
+	dictArgs["iCount"] = dictJob.get(c_strJobCount,dictRunArgs["iCount"])
+	istmFeatures = open(dictJob["targets"],"rU") if dictJob.get("targets") else None
+	try:
+		return microPITA.funcRun(abndTable=abndTable, lstrMethods=dictJob[c_strJobMethod], istmFeatures=istmFeatures, **dictArgs)
+	finally:
+		if istmFeatures:
+			istmFeatures.close()
+
+def funcRunJobs(microPITA, abndTable, ldictJobs, dictRunArgs):
+	"""
+	Runs selection jobs on one abundance table. Jobs share the microPITA object, so distance matrices measured for one
+	job (on the same samples and normalization) are reused by the others. A failing job is logged and the next job is run.
+
+	:param	microPITA:	MicroPITA object running the jobs.
+	:type:	MicroPITA
+	:param	abndTable:	Abundance table read once for all jobs, jobs work on copies.
+	:type:	AbundanceTable
+	:param	ldictJobs:	Jobs read by funcReadManifest.
+	:type:	List of dictionaries
+	:param	dictRunArgs:	funcRun parameters shared by all jobs.
+	:type:	Dictionary
+	:return	List:	[(job name, selected samples {"Selection Method":["SampleID",...]} or False on error)] in job order.
+	"""
+
+	ltpleResults = []
+	for dictJob in ldictJobs:
+		try:
+			dictSelection = funcRunJob(microPITA=microPITA, abndTable=abndTable, dictJob=dictJob, dictRunArgs=dictRunArgs)
+		except Exception as exc:
+			#One failing job does not stop the batch
+			logging.exception("micropita_batch.funcRunJobs:: Job "+str(dictJob[c_strJobName])+" failed: "+str(exc))
+			dictSelection = False
+		if not dictSelection:
+			logging.error("micropita_batch.funcRunJobs:: Job "+str(dictJob[c_strJobName])+" did not select samples.")
+		ltpleResults.append((dictJob[c_strJobName],dictSelection))
+	return ltpleResults
+
+#Set up arguments reader
+argp = argparse.ArgumentParser( prog = "micropita_batch.py",
+	description = """Runs the selection jobs of a manifest (JSON, YAML or TSV) on one abundance table, read and prepared once.""" )
+argp.add_argument("-n","--num", dest="iCount", metavar = "samples", default = 10, type = int, help = "Number of samples selected by jobs without a count.")
+argp.add_argument("-d",ConstantsMicropita.c_strIDNameArgument, dest="strIDName", metavar="sample_id", help= ConstantsMicropita.c_strIDNameHelp)
+argp.add_argument("-l",ConstantsMicropita.c_strLastMetadataNameArgument, dest="strLastMetadataName", metavar = "metadata_id", default = None,
+	help= ConstantsMicropita.c_strLastMetadataNameHelp)
+argp.add_argument("-w",ConstantsMicropita.c_strFeatureMetadataArgument, dest="strLastFeatureMetadata", metavar="Last_Feature_Metadata", default=None, help=ConstantsMicropita.c_strFeatureMetadataHelp)
+argp.add_argument("-j",ConstantsMicropita.c_strFileDelimiterArgument, dest="cFileDelimiter", metavar="column_delimiter", default="\t", help=ConstantsMicropita.c_strFileDelimiterHelp)
+argp.add_argument("-k",ConstantsMicropita.c_strFeatureNameDelimiterArgument, dest="cFeatureNameDelimiter", metavar="taxonomy_delimiter", default="|", help=ConstantsMicropita.c_strFeatureNameDelimiterHelp)
+argp.add_argument("--distancecache", dest = "strDistanceCache", metavar = "DistanceCacheDirectory", default = None,
+	help = "Directory keeping measured distance matrices, so later batches on the same data reuse them.")
+argp.add_argument("--threads", dest = "iThreads", metavar = "Threads", default = 1, type = int,
+	help = "Number of threads running the diversity, representative and extreme methods of a stratum at the same time.")
+argp.add_argument("--processes", dest = "iProcesses", metavar = "Processes", default = 1, type = int,
+	help = "Number of worker processes running strata (with stratify) at the same time.")
+argp.add_argument("--outputdir", dest = "strOutputDirectory", metavar = "OutputDirectory", default = None,
+	help = "Write the selection of each job to its own file (job name.txt) in this directory instead of one combined file.")
+argp.add_argument("-v",ConstantsMicropita.c_strLoggingArgument, dest="strLogLevel", metavar = "log_level", default="WARNING",
+	choices=ConstantsMicropita.c_lsLoggingChoices, help= ConstantsMicropita.c_strLoggingHelp)
+argp.add_argument("strManifest", metavar = "manifest", help = "Selection jobs, one per row (TSV) or entry (JSON/YAML) with a method and optionally "+
+	"name, count, stratify, label, metric, alpha, alphameta, betamatrix, tree, envr, targets, feature_method, seed and randomdraws.")
+argp.add_argument("istmInput", metavar = "input.pcl/biome", type = argparse.FileType("rU"), help = ConstantsMicropita.c_strAbundanceFileHelp)
+argp.add_argument("strOutput", metavar = "output.txt", nargs = "?", default = None,
+	help = "Combined selection file, each method written as the job name, "+c_strJobSeparator+" and the method (not used with --outputdir).")
+
+def _main( ):
+	args = argp.parse_args( )
+
+	#Set up logger
+	logging.basicConfig(stream = sys.stderr, level=getattr(logging, args.strLogLevel.upper(), None))
+
+	if not (args.strOutput or args.strOutputDirectory):
+		logging.error("micropita_batch:: Give an output file or --outputdir.")
+		return -1
+
+	ldictJobs = funcReadManifest(args.strManifest)
+	if not ldictJobs:
+		logging.error("micropita_batch:: No jobs were read from the manifest.")
+		return -1
+
+	#Read and check the table once for all jobs
+	abndTable = AbundanceTable.funcMakeFromFile(xInputFile=args.istmInput, lOccurenceFilter = ConstantsMicropita.c_liOccurenceFilter,
+		cDelimiter=args.cFileDelimiter, sMetadataID=args.strIDName, sLastMetadataRow=args.strLastFeatureMetadata,
+		sLastMetadata=args.strLastMetadataName, cFeatureNameDelimiter=args.cFeatureNameDelimiter)
+	if not abndTable:
+		logging.error("micropita_batch:: Could not read in the abundance table.")
+		return -1
+
+	microPITA = MicroPITA(strDistanceCacheDirectory = args.strDistanceCache, iThreads = args.iThreads)
+	dictRunArgs = funcGetRunArgs(strIDName=args.strIDName, strLastMetadataName=args.strLastMetadataName, cDelimiter=args.cFileDelimiter,
+		cFeatureNameDelimiter=args.cFeatureNameDelimiter, iCount=args.iCount, strLastFeatureMetadata=args.strLastFeatureMetadata,
+		iProcesses=args.iProcesses)
+	ltpleResults = funcRunJobs(microPITA=microPITA, abndTable=abndTable, ldictJobs=ldictJobs, dictRunArgs=dictRunArgs)
+
+	#Write selections
+	if args.strOutputDirectory:
+		if not os.path.isdir(args.strOutputDirectory):
+			os.makedirs(args.strOutputDirectory)
+		for strJob, dictSelection in ltpleResults:
+			with open(os.path.join(args.strOutputDirectory,strJob+".txt"),"w") as ostrmOutput:
+				MicroPITA.funcWriteSelectionToFile(dictSelection=dictSelection, xOutputFilePath=ostrmOutput)
+	else:
+		with open(args.strOutput,"w") as ostrmOutput:
+			f = csv.writer(ostrmOutput, delimiter=ConstantsMicropita.c_outputFileDelim)
+			for strJob, dictSelection in ltpleResults:
+				for sKey in (dictSelection or {}):
+					f.writerow([strJob+c_strJobSeparator+sKey]+dictSelection[sKey])
+
+	return -1 if [strJob for strJob, dictSelection in ltpleResults if not dictSelection] else 0
+
+if __name__ == "__main__":
+	sys.exit(_main( ))
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Author: Timothy Tickle
+Description: Serves microPITA selections over localhost HTTP or a Unix socket, keeping tables and distances loaded between requests
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+import sys
+import argparse
+import BaseHTTPServer
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+from MicroPITA import MicroPITA
+import micropita_batch
+import os
+import Queue
+import signal
+import SocketServer
+from src.breadcrumbs.src.AbundanceTable import AbundanceTable
+from src.breadcrumbs.src.DistanceCache import DistanceCache
+from src.ConstantsMicropita import ConstantsMicropita
+import stat
+import threading
+
+#Paths served
+c_strSelectPath = "/select"
+c_strStatusPath = "/status"
+
+#Request keys reading the abundance table (the remaining keys are a micropita_batch job)
+c_strRequestInput = "input"
+c_dictReadDefaults = {"id":None, "lastmeta":None, "lastfeaturemetadata":None, "delim":"\t", "featuredelim":"|"}
+
+#Seconds a client is asked to wait before retrying a request turned away while all workers are busy
+c_iRetryAfter = 1
+
+#Block size used when digesting table files
+c_iDigestBlockSize = 1 << 20
+
+class TableCache:
+	"""
+	Holds the most recently used abundance tables, read and checked once, keyed by the digest of the file content
+	and the reading parameters. A changed file gets a new digest and is read again.
+	"""
+
+	def __init__(self, iMaxTables=4):
+		"""
+		Constructor.
+
+		:param	iMaxTables:	Number of tables kept, the least recently used table is dropped first.
+		:type:	Integer
+		"""
+
+		self.iMaxTables = max(1,iMaxTables)
+
+		#{"key":AbundanceTable} in use order, most recent last
+		self._dictTables = OrderedDict()
+		#{"key":lock held while the table is read}
+		self._dictKeyLocks = dict()
+		self._lck = threading.Lock()
+
+	@staticmethod
+	def funcGetDigest(strInputFile):
+		"""
+		Returns the sha1 digest of the file content. The file is digested on each request, as a file rewritten in place
+		can keep its size and modification time.
+
+		:param	strInputFile:	Path to the abundance table.
+		:type:	String
+		:return	String:	Hex digest.
+		"""
+
+		hashFile = hashlib.sha1()
+		with open(strInputFile,"rb") as istrmInput:
+			for strBlock in iter(lambda: istrmInput.read(c_iDigestBlockSize),""):
+				hashFile.update(strBlock)
+		return hashFile.hexdigest()
+
+	def funcGetTable(self, strInputFile, strIDName=None, strLastMetadataName=None, strLastFeatureMetadata=None, cDelimiter="\t", cFeatureNameDelimiter="|"):
+		"""
+		Returns the abundance table of the file, reading it only if it is not already cached.
+		The table is shared, callers must not change it (MicroPITA.funcRun works on a copy).
+
+		:param	strInputFile:	Path to the abundance table.
+		:type:	String
+		:param	strIDName:	Sample Id metadata row.
+		:type:	String
+		:param	strLastMetadataName:	The id of the metadata positioned last in the abundance table.
+		:type:	String
+		:param	strLastFeatureMetadata:	The id of the last feature metadata.
+		:type:	String
+		:param	cDelimiter:	Delimiter of the abundance table.
+		:type:	Character
+		:param	cFeatureNameDelimiter:	Delimiter of the feature names (taxonomy levels).
+		:type:	Character
+		:return	AbundanceTable:	Abundance table or False on error.
+		"""
+
+		strKey = "\n".join([TableCache.funcGetDigest(strInputFile)]+[str(xArg) for xArg in [strIDName,strLastMetadataName,strLastFeatureMetadata,cDelimiter,cFeatureNameDelimiter]])
+		with self._lck:
+			lckKey = self._dictKeyLocks.setdefault(strKey,threading.Lock())
+
+		with lckKey:
+			with self._lck:
+				abndTable = self._dictTables.pop(strKey,None)
+				if abndTable:
+					self._dictTables[strKey] = abndTable
+					return abndTable
+
+			logging.info("micropita_server.TableCache.funcGetTable:: Reading "+strInputFile)
+			with open(strInputFile,"rU") as istrmInput:
+				abndTable = AbundanceTable.funcMakeFromFile(xInputFile=istrmInput, lOccurenceFilter = ConstantsMicropita.c_liOccurenceFilter,
+					cDelimiter=cDelimiter, sMetadataID=strIDName, sLastMetadataRow=strLastFeatureMetadata,
+					sLastMetadata=strLastMetadataName, cFeatureNameDelimiter=cFeatureNameDelimiter)
+			if not abndTable:
+				return False
+
+			with self._lck:
+				self._dictTables[strKey] = abndTable
+				while len(self._dictTables) > self.iMaxTables:
+					strDropped = self._dictTables.popitem(last=False)[0]
+					self._dictKeyLocks.pop(strDropped,None)
+		return abndTable
+
+	def funcGetTableCount(self):
+		"""
+		:return	Integer:	Number of tables held.
+		"""
+
+		return len(self._dictTables)
+
+class SelectionServer:
+	"""
+	Runs selection requests on a bounded pool of MicroPITA objects sharing one distance cache.
+	Requests beyond the workers wait in a bounded queue, requests beyond the queue are turned away.
+	"""
+
+	def __init__(self, iWorkers=2, iQueue=4, iMaxTables=4, iMaxDistances=64, strDistanceCacheDirectory=None, iThreads=1):
+		"""
+		Constructor.
+
+		:param	iWorkers:	Number of selections run at the same time.
+		:type:	Integer
+		:param	iQueue:	Number of selections waiting for a worker before requests are turned away.
+		:type:	Integer
+		:param	iMaxTables:	Number of abundance tables kept loaded.
+		:type:	Integer
+		:param	iMaxDistances:	Number of distance matrices kept in memory, the least recently used is dropped first.
+		:type:	Integer
+		:param	strDistanceCacheDirectory:	Directory keeping measured distance matrices (see DistanceCache).
+		:type:	String	Directory path
+		:param	iThreads:	Threads each selection uses to run its methods.
+		:type:	Integer
+		"""
+
+		self.tcTables = TableCache(iMaxTables=iMaxTables)
+		self.dcDistanceCache = DistanceCache(strCacheDirectory=strDistanceCacheDirectory, iMaxDistances=iMaxDistances)
+
+		#Idle MicroPITA objects, one per worker. Objects are not shared between selections running at the same time
+		#but all of them measure distances into the same cache
+		self._qWorkers = Queue.Queue()
+		for iWorker in xrange(max(1,iWorkers)):
+			microPITA = MicroPITA(iThreads=iThreads)
+			microPITA.dcDistanceCache = self.dcDistanceCache
+			self._qWorkers.put(microPITA)
+
+		#Admits running and waiting selections
+		self._iAdmitted = max(1,iWorkers)+max(0,iQueue)
+		self._smAdmission = threading.BoundedSemaphore(self._iAdmitted)
+		self._iBusy = 0
+		self._lckBusy = threading.Lock()
+
+	def funcSelect(self, dictRequest):
+		"""
+		Runs one selection request.
+
+		:param	dictRequest:	{"input":path to the abundance table} with the reading parameters (id, lastmeta, lastFeatureMetadata,
+					delim, featureDelim) and a micropita_batch job (method, count, stratify, label, metric, ...).
+		:type:	Dictionary
+		:return	List:	[HTTP status, {"Selection Method":["SampleID",...]} (as written by MicroPITA.funcWriteSelectionToFile) or {"error":message}]
+		"""
+
+		if not isinstance(dictRequest,dict) or not dictRequest.get(c_strRequestInput):
+			return [400,{"error":"The request needs the path of the abundance table as "+c_strRequestInput+"."}]
+
+		dictRead = dict(c_dictReadDefaults)
+		dictJob = dict()
+		for sKey, xValue in dictRequest.items():
+			if str(sKey).lower() in dictRead:
+				dictRead[str(sKey).lower()] = micropita_batch.funcGetStrings(xValue)
+			elif not sKey == c_strRequestInput:
+				dictJob[sKey] = xValue
+		dictJob, strError = micropita_batch.funcCheckJob(dictJob=dictJob)
+		if not dictJob:
+			return [400,{"error":strError}]
+		if not os.path.isfile(dictRequest[c_strRequestInput]):
+			return [400,{"error":"The abundance table "+str(dictRequest[c_strRequestInput])+" does not exist."}]
+
+		if not self._smAdmission.acquire(False):
+			return [503,{"error":"All workers are busy."}]
+		try:
+			abndTable = self.tcTables.funcGetTable(strInputFile=dictRequest[c_strRequestInput], strIDName=dictRead["id"],
+				strLastMetadataName=dictRead["lastmeta"], strLastFeatureMetadata=dictRead["lastfeaturemetadata"],
+				cDelimiter=dictRead["delim"], cFeatureNameDelimiter=dictRead["featuredelim"])
+			if not abndTable:
+				return [400,{"error":"Could not read in the abundance table."}]
+
+			microPITA = self._qWorkers.get()
+			with self._lckBusy:
+				self._iBusy += 1
+			try:
+				dictRunArgs = micropita_batch.funcGetRunArgs(strIDName=dictRead["id"], strLastMetadataName=dictRead["lastmeta"],
+					cDelimiter=dictRead["delim"], cFeatureNameDelimiter=dictRead["featuredelim"], iCount=10,
+					strLastFeatureMetadata=dictRead["lastfeaturemetadata"])
+				dictSelection = micropita_batch.funcRunJob(microPITA=microPITA, abndTable=abndTable, dictJob=dictJob, dictRunArgs=dictRunArgs)
+			except Exception as exc:
+				logging.exception("micropita_server.SelectionServer.funcSelect:: Selection failed.")
+				return [500,{"error":"Selection failed: "+str(exc)}]
+			finally:
+				with self._lckBusy:
+					self._iBusy -= 1
+				self._qWorkers.put(microPITA)
+		finally:
+			self._smAdmission.release()
+
+		if not dictSelection:
+			return [500,{"error":"Did not get a result from analysis."}]
+		return [200,dictSelection]
+
+	def funcGetStatus(self):
+		"""
+		:return	Dictionary:	{"tables":tables loaded, "distances":distance matrices held, "busy":selections running, "capacity":selections admitted at once}
+		"""
+
+		return {"tables":self.tcTables.funcGetTableCount(), "distances":self.dcDistanceCache.funcGetDistanceCount(), "busy":self._iBusy, "capacity":self._iAdmitted}
+
+class SelectionRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""
+	Answers POST /select with a JSON selection request and GET /status.
+	"""
+
+	def address_string(self):
+		#Unix socket clients have no address
+		return self.client_address[0] if isinstance(self.client_address,tuple) else "unix"
+
+	def log_message(self, format, *args):
+		logging.info("micropita_server:: "+self.address_string()+" "+(format%args))
+
+	def _funcRespond(self, iStatus, dictResponse):
+		strResponse = json.dumps(dictResponse)
+		self.send_response(iStatus)
+		self.send_header("Content-Type","application/json")
+		self.send_header("Content-Length",str(len(strResponse)))
+		if iStatus == 503:
+			self.send_header("Retry-After",str(c_iRetryAfter))
+		self.end_headers()
+		self.wfile.write(strResponse)
+
+	def do_GET(self):
+		if self.path == c_strStatusPath:
+			self._funcRespond(200,self.server.selectionServer.funcGetStatus())
+		else:
+			self._funcRespond(404,{"error":"Unknown path "+self.path})
+
+	def do_POST(self):
+		if not self.path == c_strSelectPath:
+			self._funcRespond(404,{"error":"Unknown path "+self.path})
+			return
+		try:
+			dictRequest = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length",0))))
+		except ValueError:
+			self._funcRespond(400,{"error":"The request is not JSON."})
+			return
+		try:
+			iStatus, dictResponse = self.server.selectionServer.funcSelect(dictRequest)
+		except Exception as exc:
+			logging.exception("micropita_server:: Selection failed.")
+			iStatus, dictResponse = 500, {"error":str(exc)}
+		self._funcRespond(iStatus,dictResponse)
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+class ThreadedUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+#Set up arguments reader
+argp = argparse.ArgumentParser( prog = "micropita_server.py",
+	description = """Serves microPITA selections. POST a JSON object to """+c_strSelectPath+""" with the abundance table path as """+c_strRequestInput+
+	""", its reading parameters (id, lastmeta, lastFeatureMetadata, delim, featureDelim) and the selection parameters of a micropita_batch job."""+
+	""" The response is the selection {"method":["sample",...]}.""" )
+argp.add_argument("--port", dest = "iPort", metavar = "Port", default = 8642, type = int, help = "Port listened to on localhost.")
+argp.add_argument("--socket", dest = "strSocket", metavar = "SocketPath", default = None, help = "Listen to this Unix socket instead of a localhost port.")
+argp.add_argument("--workers", dest = "iWorkers", metavar = "Workers", default = 2, type = int, help = "Number of selections run at the same time.")
+argp.add_argument("--queue", dest = "iQueue", metavar = "Queue", default = 4, type = int,
+	help = "Number of selections waiting for a worker, further requests are answered 503.")
+argp.add_argument("--tables", dest = "iMaxTables", metavar = "Tables", default = 4, type = int, help = "Number of abundance tables kept loaded.")
+argp.add_argument("--maxdistances", dest = "iMaxDistances", metavar = "Distances", default = 64, type = int,
+	help = "Number of distance matrices kept in memory, the least recently used is dropped first.")
+argp.add_argument("--distancecache", dest = "strDistanceCache", metavar = "DistanceCacheDirectory", default = None,
+	help = "Directory keeping measured distance matrices, so they outlive the server.")
+argp.add_argument("--threads", dest = "iThreads", metavar = "Threads", default = 1, type = int,
+	help = "Number of threads running the diversity, representative and extreme methods of a selection at the same time.")
+argp.add_argument("-v",ConstantsMicropita.c_strLoggingArgument, dest="strLogLevel", metavar = "log_level", default="WARNING",
+	choices=ConstantsMicropita.c_lsLoggingChoices, help= ConstantsMicropita.c_strLoggingHelp)
+
+def _main( ):
+	args = argp.parse_args( )
+
+	#Set up logger
+	logging.basicConfig(stream = sys.stderr, level=getattr(logging, args.strLogLevel.upper(), None))
+
+	selectionServer = SelectionServer(iWorkers=args.iWorkers, iQueue=args.iQueue, iMaxTables=args.iMaxTables,
+		iMaxDistances=args.iMaxDistances, strDistanceCacheDirectory=args.strDistanceCache, iThreads=args.iThreads)
+
+	if args.strSocket:
+		#Replace a socket left by an earlier server
+		if os.path.exists(args.strSocket) and stat.S_ISSOCK(os.stat(args.strSocket).st_mode):
+			os.remove(args.strSocket)
+		httpServer = ThreadedUnixHTTPServer(args.strSocket, SelectionRequestHandler)
+	else:
+		httpServer = ThreadedHTTPServer(("127.0.0.1",args.iPort), SelectionRequestHandler)
+	httpServer.selectionServer = selectionServer
+
+	#Stop (and remove the socket) on kill as on Ctrl-C
+	signal.signal(signal.SIGTERM, lambda iSignal, frmStack: sys.exit(0))
+	logging.info("micropita_server:: Listening on "+(args.strSocket if args.strSocket else "127.0.0.1:"+str(args.iPort)))
+	try:
+		httpServer.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		httpServer.server_close()
+		if args.strSocket and os.path.exists(args.strSocket):
+			os.remove(args.strSocket)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(_main( ))
@@ -44,6 +44,7 @@ import os
 import re
 import scipy.stats
 import string
+from UtilityMath import UtilityMath
 from ValidateData import ValidateData
 from biom.parse import *
 from biom.table import *
@@ -889,6 +890,20 @@ class AbundanceTable:
 
 		return self._npaFeatureAbundance.copy() if ( self._npaFeatureAbundance != None ) else None
 
+	def funcGetSampleAbundanceMatrix(self, dtype=None):
+		"""
+		Returns the measurements as a C-contiguous array of samples (rows) by features (columns), the layout distance metrics use.
+		The sample columns of the table are read in place and transposed in one copy (also converting to dtype if given).
+
+		:param	dtype:	Type of the returned array, the type of the measurements if None.
+		:type:	Numpy dtype
+		:return	Numpy Array:	Samples x features array. Returns none on error.
+		"""
+
+		if self._npaFeatureAbundance is None:
+			return None
+		return np.ascontiguousarray(UtilityMath.funcGetFieldMatrix(self._npaFeatureAbundance, self.funcGetSampleNames()).T, dtype=dtype)
+
 	#Happy path tested
 	def funcGetAverageAbundancePerSample(self, lsTargetedFeatures):
 		"""
@@ -900,36 +915,36 @@ class AbundanceTable:
 			[[sample,average abundance of selected taxa]] or False on error
 		"""
 
-		#Sample rank averages [[sample,average abundance of selected taxa]]
-		sampleAbundanceAverages = []
-		
+		if ( self._npaFeatureAbundance is None ) or ( lsTargetedFeatures is None ):
+			return False
+
 		sampleNames = self.funcGetSampleNames()
-		allTaxaNames = self.funcGetFeatureNames()
-		#Get an abundance table compressed to features of interest
-		abndReducedTable = self.funcGetFeatureAbundanceTable(lsTargetedFeatures)
-		if abndReducedTable == None:
-			return False  
+
+		#Rows of each feature, found once instead of searching the features for each target
+		dictFeatureRows = {}
+		for iRow, sFeature in enumerate(self.funcGetFeatureNames()):
+			dictFeatureRows.setdefault(sFeature,[]).append(iRow)
+
+		#Abundance of the rows of the targeted features (rows=features, columns=samples)
+		liRows = sorted(set([iRow for sFeature in lsTargetedFeatures for iRow in dictFeatureRows.get(sFeature,[])]))
+		npaReducedTable = self._npaFeatureAbundance[liRows]
+		npadAbundance = np.column_stack([npaReducedTable[sName] for sName in sampleNames]).astype(float) if liRows else np.zeros((0,len(sampleNames)))
 
 		#If the taxa to be selected are not in the list, Return nothing and log
-		lsMissing = []
-		for sFeature in lsTargetedFeatures:
-			if not sFeature in allTaxaNames:
-				lsMissing.append(sFeature)
-			else:
-				#Check to make sure the taxa of interest is not average abundance of 0
-				if not abndReducedTable.funcGetFeatureSumAcrossSamples(sFeature):
-					lsMissing.append(sFeature)
+		#Check to make sure the taxa of interest is not average abundance of 0 (in the first row of the feature)
+		dictReducedRow = dict([(iRow,iIndex) for iIndex, iRow in enumerate(liRows)])
+		lsMissing = [sFeature for sFeature in lsTargetedFeatures if (not sFeature in dictFeatureRows)
+				or (not npadAbundance[dictReducedRow[dictFeatureRows[sFeature][0]]].sum())]
 		if len(lsMissing) > 0:
 			sys.stderr.write( "Could not find features for averaging: " + str(lsMissing) )
 			return False
 
-		#For each sample name get average abundance
-		for sName in sampleNames:
-			npaFeaturesSample = abndReducedTable.funcGetSample(sName)
-			sampleAbundanceAverages.append([sName,sum(npaFeaturesSample)/float(len(npaFeaturesSample))])
+		#Average abundance of each sample, summing the features in row order
+		npadAverages = np.add.reduce(npadAbundance, axis=0)/float(len(liRows))
 
-		#Sort based on average
-		return sorted(sampleAbundanceAverages, key = lambda sampleData: sampleData[1], reverse = True)
+		#Sample rank averages [[sample,average abundance of selected taxa]]
+		#Sorted based on average (ties in sample order)
+		return [[sampleNames[iIndex],npadAverages[iIndex]] for iIndex in np.argsort(-npadAverages, kind="mergesort")]
 
 	#Happy path tested 1
 	def funcGetAverageSample(self):
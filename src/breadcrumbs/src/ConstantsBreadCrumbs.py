@@ -60,6 +60,8 @@ class ConstantsBreadCrumbs():
     c_strEmptyAbundanceData = "0"
     c_strEmptyDataMetadata = "NA"
     c_strSVMNoSample = "-"
+    #Line ending of LibSVM files (as written by the csv excel dialect)
+    c_strSVMLineEnd = "\r\n"
 
     lNAs = list(set(["NA","na","Na","nA",c_strEmptyDataMetadata]))
 
@@ -0,0 +1,230 @@
+"""
+Author: Timothy Tickle
+Description: Caches beta-diversity distance matrices between selection methods and runs.
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+#Import libaries
+from collections import OrderedDict
+import hashlib
+from Metric import Metric
+import numpy as np
+import os
+import tempfile
+import threading
+from types import *
+
+class DistanceCache:
+    """
+    Holds condensed distance matrices so a metric is measured once per abundance state.
+
+    Entries are keyed by a digest of the abundance matrix, the metric name and the summed and
+    normalized state of the table the matrix came from. Additive inverses (for instance
+    Metric.c_strInvBrayCurtisDissimilarity) are not stored, they are derived from the cached base metric.
+    If a directory is given, entries are also written to (and read from) disk so that later runs on
+    the same data do not measure distances again.
+    The cache can be shared by threads, a matrix requested by several threads at once is measured by one of them.
+    The number of matrices held in memory can be bounded, the least recently used matrix is dropped first.
+    """
+
+    #Extension of the cache files written to the cache directory
+    c_strCacheFileExtension = ".npy"
+
+    #Permissions of the cache files
+    c_iCacheFileMode = 0644
+
+    #Additive inverse metrics and the base metric they are derived from
+    dictInverseToBaseMetric = {Metric.c_strInvBrayCurtisDissimilarity:Metric.c_strBrayCurtisDissimilarity}
+
+    def __init__(self, strCacheDirectory=None, iMaxDistances=None):
+        """
+        Constructor.
+
+        :param	strCacheDirectory:	Directory to keep cache files in. None keeps the cache in memory only.
+        :type:	String	Directory path
+        :param	iMaxDistances:	Number of distance matrices held in memory. None holds all of them.
+        :type:	Integer
+        """
+
+        #{"key":condensed distance matrix} in use order, most recent last
+        self._dictDistances = OrderedDict()
+        self._iMaxDistances = max(1,iMaxDistances) if iMaxDistances else None
+
+        #{"key":lock held while the entry is looked up or measured}
+        self._dictKeyLocks = dict()
+        #Lock around the dictionaries of entries and key locks
+        self._lckKeyLocks = threading.Lock()
+
+        self._strCacheDirectory = strCacheDirectory
+        if self._strCacheDirectory and not os.path.isdir(self._strCacheDirectory):
+            os.makedirs(self._strCacheDirectory)
+
+    @staticmethod
+    def funcIsCacheable(sMetric):
+        """
+        Indicates if the metric is measured from the abundance matrix alone and so can be cached by its content.
+        Metrics relying on other files (unifrac, precalculated matrices) are not cacheable.
+
+        :param	sMetric:	Name of the beta metric.
+        :type:	String
+        :return	Boolean:	True indicates the metric can be cached.
+        """
+
+        sMetric = DistanceCache.dictInverseToBaseMetric.get(sMetric,sMetric)
+        return (sMetric == Metric.c_strBrayCurtisDissimilarity) or (sMetric in Metric.setBetaDiversities)
+
+    @staticmethod
+    def funcGetKey(npaAbundance, sMetric, fSummed=None, fNormalized=None):
+        """
+        Makes the key a distance matrix is stored under.
+
+        :param	npaAbundance:	Numpy array where row=samples and columns=features.
+        :type:	Numpy Array
+        :param	sMetric:	Name of the beta metric.
+        :type:	String
+        :param	fSummed:	Indicator of the abundance table being summed.
+        :type:	Boolean
+        :param	fNormalized:	Indicator of the abundance table being normalized.
+        :type:	Boolean
+        :return	String:	Key (safe to use as a file name).
+        """
+
+        npaAbundance = np.ascontiguousarray(npaAbundance)
+        hashAbundance = hashlib.sha1()
+        hashAbundance.update(str(npaAbundance.shape)+str(npaAbundance.dtype))
+        hashAbundance.update(npaAbundance.data)
+        return "_".join([hashAbundance.hexdigest(),sMetric,"S"+str(int(bool(fSummed))),"N"+str(int(bool(fNormalized)))])
+
+    def funcGetDistance(self, npaAbundance, sMetric, fSummed=None, fNormalized=None, fAdditiveInverse=False):
+        """
+        Returns the condensed distance matrix of the metric, measuring it only if it is not already cached.
+
+        :param	npaAbundance:	Numpy array where row=samples and columns=features.
+        :type:	Numpy Array
+        :param	sMetric:	Name of the beta metric (see DistanceCache.funcIsCacheable).
+        :type:	String
+        :param	fSummed:	Indicator of the abundance table being summed.
+        :type:	Boolean
+        :param	fNormalized:	Indicator of the abundance table being normalized.
+        :type:	Boolean
+        :param	fAdditiveInverse:	Return 1 - the distance.
+        :type:	Boolean
+        :return	Numpy array or Boolean:	Condensed distance matrix or False on error.
+        """
+
+        #Additive inverse metrics are derived from their base metric
+        sBaseMetric = self.dictInverseToBaseMetric.get(sMetric,sMetric)
+        if not sBaseMetric == sMetric:
+            fAdditiveInverse = not fAdditiveInverse
+
+        strKey = DistanceCache.funcGetKey(npaAbundance=npaAbundance, sMetric=sBaseMetric, fSummed=fSummed, fNormalized=fNormalized)
+        with self._lckKeyLocks:
+            lckKey = self._dictKeyLocks.setdefault(strKey,threading.Lock())
+
+        with lckKey:
+            with self._lckKeyLocks:
+                npaDistance = self._dictDistances.pop(strKey,None)
+                if npaDistance is not None:
+                    self._dictDistances[strKey] = npaDistance
+
+            #Check the disk cache
+            if (npaDistance is None) and self._strCacheDirectory:
+                strCacheFile = os.path.join(self._strCacheDirectory,strKey+self.c_strCacheFileExtension)
+                if os.path.exists(strCacheFile):
+                    #A file which can not be read is measured again
+                    try:
+                        npaDistance = np.load(strCacheFile)
+                        self._funcStore(strKey, npaDistance)
+                    except (IOError, OSError, ValueError, EOFError):
+                        npaDistance = None
+
+            #Measure and store
+            if npaDistance is None:
+                npaDistance = Metric.funcGetBetaMetric(npadAbundancies=npaAbundance, sMetric=sBaseMetric)
+                if type(npaDistance) is BooleanType:
+                    return False
+                self._funcStore(strKey, npaDistance)
+                if self._strCacheDirectory:
+                    self._funcWriteCacheFile(strKey, npaDistance)
+
+        return 1.0 - npaDistance if fAdditiveInverse else npaDistance
+
+    def _funcWriteCacheFile(self, strKey, npaDistance):
+        """
+        Writes a distance matrix to the cache directory. The matrix is written to a temporary file which is then renamed,
+        so other runs reading the directory never see a partly written file.
+
+        :param	strKey:	Key of the matrix (see DistanceCache.funcGetKey).
+        :type:	String
+        :param	npaDistance:	Condensed distance matrix.
+        :type:	Numpy array
+        """
+
+        iFile, strTempFile = tempfile.mkstemp(prefix=strKey, suffix=".tmp", dir=self._strCacheDirectory)
+        try:
+            with os.fdopen(iFile,"wb") as ostrmCache:
+                np.save(ostrmCache,npaDistance)
+            #Temporary files are only readable by their owner, cache files are read by other runs
+            os.chmod(strTempFile,self.c_iCacheFileMode)
+            os.rename(strTempFile,os.path.join(self._strCacheDirectory,strKey+self.c_strCacheFileExtension))
+        finally:
+            if os.path.exists(strTempFile):
+                os.remove(strTempFile)
+
+    def _funcStore(self, strKey, npaDistance):
+        """
+        Holds a distance matrix in memory, dropping the least recently used matrices beyond the maximum.
+
+        :param	strKey:	Key of the matrix (see DistanceCache.funcGetKey).
+        :type:	String
+        :param	npaDistance:	Condensed distance matrix.
+        :type:	Numpy array
+        """
+
+        with self._lckKeyLocks:
+            self._dictDistances[strKey] = npaDistance
+            while self._iMaxDistances and (len(self._dictDistances) > self._iMaxDistances):
+                self._dictKeyLocks.pop(self._dictDistances.popitem(last=False)[0],None)
+
+    def funcGetDistanceCount(self):
+        """
+        :return	Integer:	Number of distance matrices held in memory.
+        """
+
+        return len(self._dictDistances)
+
+    def funcClear(self):
+        """
+        Removes all distance matrices held in memory (files in the cache directory are kept).
+        """
+
+        with self._lckKeyLocks:
+            self._dictDistances = OrderedDict()
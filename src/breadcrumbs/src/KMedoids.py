@@ -18,77 +18,273 @@
 ## along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-__all__= ['Kmedoids', 'Minkowski']
+__all__= ['Kmedoids', 'Clara', 'Minkowski']
 
 
+import multiprocessing
 import numpy as np
 import matplotlib
 matplotlib.use( "Agg" )
 import mlpy
+from scipy.spatial.distance import squareform
 
 
-def kmedoids_core(x, med, oth, clust, cost, dist):
+# distance matrix shared with the worker processes of the restarts,
+# set before the pool is created so it is inherited by the workers
+_shared_D = []
+
+
+def _pam_restart(args):
+    """
+    Worker process entry point running pam() on the shared distance
+    matrix from one initial configuration.
+    """
+
+    med, oth, maxloops = args
+    return pam(_shared_D[0], med, oth, maxloops)
+
+
+def distance_matrix(x, dist):
+    """
+    Computes the distances between all the data points once, so the
+    swap steps only index into the matrix. dist.compute(x[a], x[b])
+    is stored in position [a, b].
+    """
+
+    # distance classes holding a matrix give it at once
+    if hasattr(dist, 'compute_matrix'):
+        return np.asarray(dist.compute_matrix(x), dtype=float)
+
+    n = x.shape[0]
+    D = np.empty((n, n), dtype=float)
+    for a in range(n):
+        for b in range(n):
+            D[a, b] = dist.compute(x[a], x[b])
+    return D
+
+
+def configuration_cost(D, med, oth):
+    """
+    Returns the cluster membership of the non-medoids and the total cost
+    of the configuration, computed as the original swap step did
+    (same distance table, argmin and summation order).
+    """
+
+    d = D[np.ix_(med, oth)].T
+    clust = np.argmin(d, axis=1)
+    return clust, np.sum(d[np.arange(d.shape[0]), clust])
+
+
+def kmedoids_core(D, med, oth, clust, cost, block=4194304):
     """
     * for each mediod m
-       * for each non-mediod data point n
+       * for each non-mediod data point n of the cluster of m
          Swap m and n and compute the total cost of the configuration
     Select the configuration with the lowest cost
+
+    The cost of every swap is scored from the precomputed distance
+    matrix D: with the distance of each point to its nearest medoid
+    other than m (nearest or second nearest medoid), the cost of
+    swapping m and n is the sum over the new non-medoids of the
+    minimum of that distance and the distance to n. Only swaps scoring
+    (almost) as low as the best one are then recomputed exactly, so the
+    selected configuration (the last swap with the lowest cost, if not
+    higher than cost) is the one the exhaustive search selects.
     """
 
-    d = np.empty((oth.shape[0], med.shape[0]), dtype=float)
-    med_n = np.empty_like(med)
-    oth_n = np.empty_like(oth)
-    idx = np.arange(oth.shape[0])
-    
+    k = med.shape[0]
+
+    # distance of all points to the medoids, nearest and second nearest
+    dm = D[med]
+    if k > 1:
+        order = np.argsort(dm, axis=0, kind='mergesort')[:2]
+        cols = np.arange(dm.shape[1])
+        nearest, nearest_d = order[0], dm[order[0], cols]
+        second_d = dm[order[1], cols]
+    else:
+        nearest = np.zeros(dm.shape[1], dtype=int)
+        nearest_d = second_d = np.repeat(np.inf, dm.shape[1])
+
+    # approximate cost of each swap, in the order of the exhaustive search
+    cands, scores = [], []
+    for i, m in enumerate(med):
+        pos = np.where(clust == i)[0]
+        if not pos.shape[0]:
+            continue
+
+        # distance to the nearest medoid other than m
+        other_d = np.where(nearest == i, second_d, nearest_d)
+        other_oth = other_d[oth]
+
+        ns = oth[pos]
+        score = np.empty(ns.shape[0], dtype=float)
+        step = max(1, block // max(1, oth.shape[0]))
+        for s in range(0, ns.shape[0], step):
+            nb = ns[s:s+step]
+            score[s:s+step] = np.minimum(other_oth[np.newaxis, :], D[np.ix_(nb, oth)]).sum(axis=1)
+
+        # n leaves the non-medoids, m joins them
+        score -= np.minimum(other_d[ns], D[ns, ns])
+        score += np.minimum(other_d[m], D[ns, m])
+
+        cands.extend([(i, j, p) for j, p in enumerate(pos)])
+        scores.append(score)
+
     med_cur = med.copy()
     oth_cur = oth.copy()
     clust_cur = clust.copy()
     cost_cur = cost
-    
-    for i, m in enumerate(med):
-        for j, n in enumerate(oth[clust == i]):
-           
-            med_n, oth_n = med.copy(), oth.copy()
-
-            med_n[i] = n
-            tmp = oth_n[clust == i]
-            tmp[j] = m
-            oth_n[clust == i] = tmp
-            
-            for ii, nn in enumerate(oth_n):
-                for jj, mm in enumerate(med_n):
-                    d[ii, jj] = dist.compute(x[mm], x[nn])
 
-            clust_n = np.argmin(d, axis=1) # clusters
-            cost_n = np.sum(d[idx, clust_n]) # total cost of configuration
+    if not cands:
+        return med_cur, oth_cur, clust_cur, cost_cur
+
+    # recompute exactly the swaps close to the lowest score
+    scores = np.concatenate(scores)
+    best = scores.min()
+    tol = 1e-9 * max(1.0, abs(best), abs(cost))
+    for c in np.where(scores <= best + tol)[0]:
+        i, j, p = cands[c]
 
-            if cost_n <= cost_cur:
-                med_cur   = med_n.copy()
-                oth_cur   = oth_n.copy()
-                clust_cur = clust_n.copy()
-                cost_cur  = cost_n
+        med_n, oth_n = med.copy(), oth.copy()
+        med_n[i] = oth[p]
+        oth_n[p] = med[i]
+        clust_n, cost_n = configuration_cost(D, med_n, oth_n)
+
+        if cost_n <= cost_cur:
+            med_cur   = med_n.copy()
+            oth_cur   = oth_n.copy()
+            clust_cur = clust_n.copy()
+            cost_cur  = cost_n
 
     return med_cur, oth_cur, clust_cur, cost_cur
             
 
+def pam(D, med, oth, maxloops=100):
+    """
+    Associates each data point to the closest of the initial medoids
+    and repeats kmedoids_core until there is no change in the medoids
+    (or maxloops is reached).
+    Returns medoids, non-medoids, cluster membership and cost.
+    """
+
+    # associate each data point to the closest medoid
+    # and total cost of configuration
+    clust, cost = configuration_cost(D, med, oth)
+
+    # repeat kmedoids_core until there is no change in the medoid
+    for l in range(maxloops):
+
+        med_n, oth_n, clust_n, cost_n = kmedoids_core(D, med, oth, clust, cost)
+
+        if (cost_n < cost):
+            med, oth, clust, cost = med_n, oth_n, clust_n, cost_n
+        else:
+            break
+
+    return med, oth, clust, cost
+
+
+def init_random(D, k, random):
+    """
+    Randomly selects k of the n data points as the medoids.
+    Returns medoids and non-medoids indexes.
+    """
+
+    idx = np.arange(D.shape[0])
+    random.shuffle(idx)
+    return idx[0:k], idx[k::]
+
+
+def init_build(D, k, random=None):
+    """
+    PAM BUILD (Kaufman and Rousseeuw 1990): the first medoid is the
+    data point with the lowest sum of distances, each next medoid is
+    the data point decreasing the total cost the most. Ties select the
+    lowest index. Returns medoids and non-medoids indexes.
+    """
+
+    return init_extend(D, [int(np.argmin(D.sum(axis=1)))], k)
+
+
+def init_extend(D, med, k):
+    """
+    Continues PAM BUILD from the given medoids: each next medoid is
+    the data point decreasing the total cost the most, until there
+    are k medoids. Ties select the lowest index. Returns medoids
+    (the given ones first) and non-medoids indexes.
+    """
+
+    n = D.shape[0]
+    med = [int(m) for m in med]
+    nearest = D[med].min(axis=0)
+    for l in range(len(med), k):
+        gain = np.maximum(nearest[np.newaxis, :] - D, 0.0).sum(axis=1)
+        gain[med] = -np.inf
+        med.append(int(np.argmax(gain)))
+        nearest = np.minimum(nearest, D[med[-1]])
+
+    med = np.array(med, dtype=int)
+    return med, np.setdiff1d(np.arange(n), med)
+
+
+def init_kmedoidspp(D, k, random):
+    """
+    k-medoids++ (as k-means++, Arthur and Vassilvitskii 2007): the
+    first medoid is a random data point, each next medoid is drawn
+    with probability proportional to the squared distance to the
+    closest medoid selected. Returns medoids and non-medoids indexes.
+    """
+
+    n = D.shape[0]
+    med = [int(random.randint(n))]
+    nearest = D[med[0]].copy()
+    for l in range(1, k):
+        w = nearest ** 2
+        w[med] = 0.0
+        if w.sum() > 0:
+            med.append(int(random.choice(n, p=w / w.sum())))
+        else:
+            med.append(int(random.choice(np.setdiff1d(np.arange(n), med))))
+        nearest = np.minimum(nearest, D[med[-1]])
+
+    med = np.array(med, dtype=int)
+    return med, np.setdiff1d(np.arange(n), med)
+
+
 class Kmedoids:
     """k-medoids algorithm.
     """
 
-    def __init__(self, k, dist, maxloops=100, rs=0):
+    # initial medoids selection
+    INIT = {'random': init_random, 'build': init_build, 'kmedoids++': init_kmedoidspp}
+
+    def __init__(self, k, dist, maxloops=100, rs=0, init='random', n_init=1, processes=None):
         """Initialize Kmedoids.
         
         :Parameters:
    
           k : int
               Number of clusters/medoids
-          dist : class
+          dist : class or 'precomputed'
                  class with a .compute(x, y) method which
-                 returns a distance
+                 returns a distance (and optionally a
+                 .compute_matrix(x) method returning all the
+                 distances between the rows of x), or 'precomputed'
+                 to give compute() the distance matrix itself
           maxloops : int
                      maximum number of loops
           rs : int
-               random seed
+               random seed (of a random generator local to the object)
+          init : string
+                 initial medoids selection, 'random' (k random data
+                 points), 'build' (PAM BUILD) or 'kmedoids++'
+          n_init : int
+                   number of restarts from different initial medoids,
+                   the configuration with the lowest cost is kept
+                   ('build' is deterministic and runs once)
+          processes : int
+                      number of processes running the restarts
+                      (default the number of cpus)
 
         Example:
 
@@ -110,13 +306,21 @@ class Kmedoids:
          * cluster 1: samples 0 (medoid)  and 1
          * cluster 2: sample 2 (medoid)
         """
+
+        if not init in self.INIT:
+            raise ValueError("init must be one of %s" % sorted(self.INIT.keys()))
         
         self.__k = k
         self.__maxloops = maxloops
         self.__rs = rs
         self.__dist = dist
+        self.__init = init
+        self.__n_init = 1 if init == 'build' else max(1, n_init)
+        self.__processes = processes
 
-        np.random.seed(self.__rs)
+        # same sequence as seeding the global generator, without
+        # changing the global state
+        self.__random = np.random.RandomState(self.__rs)
 
 
     def compute(self, x):
@@ -124,7 +328,9 @@ class Kmedoids:
         
         :Parameters:
            x : ndarray
-               An 2-dimensional vector (sample x features).
+               An 2-dimensional vector (sample x features), or with
+               dist='precomputed' the square (sample x sample) or
+               condensed distance matrix.
    
         :Returns:
            m : ndarray (1-dimensional vector)
@@ -138,35 +344,199 @@ class Kmedoids:
                 total cost of configuration
         """
 
-        # randomly select k of the n data points as the mediods
-        idx = np.arange(x.shape[0])
-        np.random.shuffle(idx)
-        med = idx[0:self.__k]
-        oth = idx[self.__k::]
-
-        # compute distances
-        d = np.empty((oth.shape[0], med.shape[0]), dtype=float)
-        for i, n in enumerate(oth):
-            for j, m in enumerate(med):
-                d[i, j] = self.__dist.compute(x[m], x[n])
-
-        # associate each data point to the closest medoid
-        clust = np.argmin(d, axis=1)
-
-        # total cost of configuration
-        cost = np.sum(d[np.arange(d.shape[0]), clust])
-
-        # repeat kmedoids_core until there is no change in the medoid
-        for l in range(self.__maxloops):
-          
-            med_n, oth_n, clust_n, cost_n = kmedoids_core(x, med, oth, clust, cost, self.__dist)
-                      
-            if (cost_n < cost):
-                med, oth, clust, cost = med_n, oth_n, clust_n, cost_n
+        return self.__restarts(self.__distances(x), self.__k)
+
+    def compute_path(self, x, ks):
+        """Compute Kmedoids for several numbers of clusters. The
+        smallest number of clusters is computed as compute() does,
+        each larger one starts from the medoids of the previous one
+        (extended by PAM BUILD steps) and is refined by PAM, so the
+        distances are computed once and later solutions converge in
+        few swaps. The k given to the constructor is not used.
+
+        :Parameters:
+           x : ndarray
+               as in compute()
+           ks : list of int
+                numbers of clusters/medoids
+
+        :Returns:
+           path : list of tuples
+                  (k, (m, n, cl, co)) for each k in increasing order,
+                  with m, n, cl, co as returned by compute()
+        """
+
+        D = self.__distances(x)
+
+        path = []
+        for k in sorted(set(ks)):
+            if not path:
+                result = self.__restarts(D, k)
+            else:
+                med, oth = init_extend(D, path[-1][1][0], k)
+                result = pam(D, med, oth, self.__maxloops)
+            path.append((k, result))
+
+        return path
+
+    def __distances(self, x):
+        """Returns the square distance matrix of x.
+        """
+
+        if isinstance(self.__dist, str) and self.__dist == 'precomputed':
+            D = np.asarray(x, dtype=float)
+            if D.ndim == 1:
+                D = squareform(D, checks=False)
+            return D
+        return distance_matrix(x, self.__dist)
+
+    def __restarts(self, D, k):
+        """Runs pam() from n_init initial configurations of k medoids
+        and returns the lowest cost one.
+        """
+
+        # initial medoids of each restart, drawn in order from the
+        # local generator so the result does not depend on processes
+        inits = [self.INIT[self.__init](D, k, self.__random) for r in range(self.__n_init)]
+        if len(inits) == 1:
+            return pam(D, inits[0][0], inits[0][1], self.__maxloops)
+
+        processes = min(self.__processes or multiprocessing.cpu_count(), len(inits))
+        # worker processes (for instance running strata) can not start pools
+        if processes > 1 and not multiprocessing.current_process().daemon:
+            _shared_D.append(D)
+            try:
+                pool = multiprocessing.Pool(processes=processes)
+                results = pool.map(_pam_restart, [(med, oth, self.__maxloops) for med, oth in inits])
+                pool.close()
+                pool.join()
+            finally:
+                del _shared_D[:]
+        else:
+            results = [pam(D, med, oth, self.__maxloops) for med, oth in inits]
+
+        # lowest cost, first restart on ties
+        return min(results, key=lambda result: result[3])
+
+
+class Clara:
+    """CLARA (Clustering LARge Applications, Kaufman and Rousseeuw
+    1990) k-medoids algorithm.
+
+    k-medoids (PAM) is run on random subsamples of the data points
+    and each resulting set of medoids is evaluated on all the data
+    points; the set with the lowest total cost is kept. The best
+    medoids found so far are included in every later subsample.
+    Only distances within a subsample and from all data points to
+    the candidate medoids are computed, so the full distance matrix
+    is never built.
+    """
+
+    def __init__(self, k, cdist, samples=5, sample_size=None, maxloops=100, rs=0, block=1024):
+        """Initialize Clara.
+
+        :Parameters:
+
+          k : int
+              Number of clusters/medoids
+          cdist : callable
+                  cdist(x, y) returns the distance matrix between the
+                  rows of the 2-dimensional arrays x and y
+          samples : int
+                    number of subsamples
+          sample_size : int
+                        data points per subsample (default 40+2k)
+          maxloops : int
+                     maximum number of loops of each k-medoids run
+          rs : int
+               random seed
+          block : int
+                  data points measured at a time when evaluating
+                  medoids on all the data points
+        """
+
+        self.__k = k
+        self.__cdist = cdist
+        self.__samples = samples
+        self.__sample_size = sample_size or (40 + 2 * k)
+        self.__maxloops = maxloops
+        self.__rs = rs
+        self.__block = block
+
+    def assign(self, x, med):
+        """Associate every data point to the closest medoid.
+
+        :Parameters:
+           x : ndarray
+               An 2-dimensional vector (sample x features).
+           med : ndarray (1-dimensional vector)
+                 medoids indexes
+
+        :Returns:
+           n : ndarray (1-dimensional vector)
+               non-medoids indexes
+           cl : ndarray 1-dimensional vector)
+                cluster membership for non-medoids.
+           co : double
+                total cost of configuration
+        """
+
+        oth = np.setdiff1d(np.arange(x.shape[0]), med)
+        clust = np.empty(oth.shape[0], dtype=int)
+        cost = 0.0
+        xm = x[med]
+        for s in range(0, oth.shape[0], self.__block):
+            d = np.asarray(self.__cdist(x[oth[s:s+self.__block]], xm))
+            clust[s:s+self.__block] = np.argmin(d, axis=1)
+            cost += np.sum(d[np.arange(d.shape[0]), clust[s:s+self.__block]])
+
+        return oth, clust, cost
+
+    def compute(self, x):
+        """Compute Clara.
+
+        :Parameters:
+           x : ndarray
+               An 2-dimensional vector (sample x features).
+
+        :Returns:
+           m : ndarray (1-dimensional vector)
+               medoids indexes
+           n : ndarray (1-dimensional vector)
+               non-medoids indexes (ascending)
+           cl : ndarray 1-dimensional vector)
+                cluster membership for non-medoids.
+                Groups are in 0, ..., k-1
+           co : double
+                total cost of configuration
+        """
+
+        rs = np.random.RandomState(self.__rs)
+        n = x.shape[0]
+        size = min(n, max(self.__sample_size, self.__k))
+
+        best = None
+        for s in range(self.__samples if size < n else 1):
+
+            # draw a subsample, keeping the best medoids so far
+            if best is None:
+                idx = rs.permutation(n)[:size]
             else:
-                break
-            
-        return med, oth, clust, cost
+                rest = np.setdiff1d(np.arange(n), best[0])
+                idx = np.concatenate([best[0], rs.permutation(rest)[:size - self.__k]])
+
+            # k-medoids on the subsample
+            sub = rs.permutation(size)
+            med = pam(np.asarray(self.__cdist(x[idx], x[idx]), dtype=float),
+                      sub[0:self.__k], sub[self.__k::], self.__maxloops)[0]
+            med = idx[med]
+
+            # evaluate on all the data points
+            oth, clust, cost = self.assign(x, med)
+            if (best is None) or (cost < best[3]):
+                best = (med, oth, clust, cost)
+
+        return best
 
 
 class Minkowski:
@@ -33,6 +33,7 @@ __email__ = "ttickle@sph.harvard.edu"
 __status__ = "Development"
 
 #External libraries
+import numpy as np
 from scipy.spatial.distance import squareform
 
 class MLPYDistanceAdaptor:
@@ -71,6 +72,21 @@ class MLPYDistanceAdaptor:
 	:type	Boolean
         """
 
-        if(self.npaMatrix == None):
+        if(self.npaMatrix is None):
             raise Exception("".join(["MLPYDistanceAdaptor. Attempted to compute distance with out a distance matrix passed in during construction."]))
         return self.npaMatrix[x[0],y[0]]
+
+    def compute_matrix(self,x):
+        """
+        Returns the distances between all the positions at once, used by KMedoids instead of calling compute per pair.
+        Kept for compatibility, KMedoids.Kmedoids(dist='precomputed') takes the distance matrix directly.
+
+	:param	x:	Positions as an array of arrays of 1 number
+	:type	Numpy array
+	:return	Numpy array:	Square matrix of distances between the positions
+        """
+
+        if(self.npaMatrix is None):
+            raise Exception("".join(["MLPYDistanceAdaptor. Attempted to compute distance with out a distance matrix passed in during construction."]))
+        npaiPositions = np.asarray(x).reshape(len(x),-1)[:,0]
+        return self.npaMatrix[np.ix_(npaiPositions,npaiPositions)]
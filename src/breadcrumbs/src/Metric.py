@@ -36,11 +36,12 @@ __status__ = "Development"
 from ConstantsBreadCrumbs import ConstantsBreadCrumbs
 import csv
 import numpy as np
+import os
 from types import *
+from UniFrac import UniFrac
 from ValidateData import ValidateData
 
 #External libraries
-from cogent.maths.unifrac.fast_unifrac import fast_unifrac_file
 import cogent.maths.stats.alpha_diversity
 import scipy.spatial.distance
 
@@ -62,6 +63,13 @@ class Metric:
     #Additive inverses of beta metrics
     c_strInvBrayCurtisDissimilarity = "InB_Curtis"
 
+    #Precalculated matrix files
+    #Extension of binary (numpy) matrix files and of the file holding their sample names
+    c_strBinaryMatrixExtension = ".npy"
+    c_strBinaryMatrixSamplesExtension = "-samples.txt"
+    #Number of rows formatted at a time when writing a text matrix file
+    c_iMatrixFileBlockSize = 1000
+
     #Richness
     c_strShannonRichness = "ShannonR"
     c_strObservedCount = "Observed_Count"
@@ -74,7 +82,7 @@ class Metric:
 
     #Different beta diversity metrics
     setBetaDiversities = set(["braycurtis","canberra","chebyshev","cityblock",
-	"correlation","cosine","euclidean","hamming","sqeuclidean"])
+	"correlation","cosine","euclidean","hamming","jaccard","sqeuclidean"])
 
     #Tested 4
     @staticmethod
@@ -282,47 +290,87 @@ class Metric:
             return 1.0-bcValue
         return False
 
+    @staticmethod
+    def funcGetCrossDistance(npadAbundanciesA, npadAbundanciesB, sMetric):
+        """
+        Measures the beta metric between each sample of one set and each sample of another set,
+        which allows measuring distances on demand instead of between all samples.
+
+        :param	npadAbundanciesA:	Samples (rows) x measurements (columns).
+        :type:	Numpy Array
+        :param	npadAbundanciesB:	Samples (rows) x measurements (columns).
+        :type:	Numpy Array
+        :param	sMetric:	Name of beta metric (Bray-Curtis, its inverse or one of Metric.setBetaDiversities).
+        :type:	String
+        :return	Numpy Array or Boolean:	Distance matrix (samples of A x samples of B) or False on error.
+        """
+
+        sScipyMetric = "braycurtis" if sMetric in [Metric.c_strBrayCurtisDissimilarity,Metric.c_strInvBrayCurtisDissimilarity] else sMetric
+        if not sScipyMetric in Metric.setBetaDiversities:
+            print "Metric.funcGetCrossDistance. Error= Metric can not be measured on demand: "+str(sMetric)
+            return False
+        try:
+            npaDistance = scipy.spatial.distance.cdist(npadAbundanciesA, npadAbundanciesB, sScipyMetric)
+        except ValueError as error:
+            print "".join(["Metric.funcGetCrossDistance. Error=",str(error)])
+            return False
+        return 1.0-npaDistance if sMetric == Metric.c_strInvBrayCurtisDissimilarity else npaDistance
+
     #Test cases 8
     @staticmethod
-    def funcGetUnifracDistance(istrmTree,istrmEnvr,lsSampleOrder=None,fWeighted=True):
+    def funcGetUnifracDistance(istrmTree,istrmEnvr,lsSampleOrder=None,fWeighted=True,npaAbundance=None,lsFeatureNames=None,iProcesses=1):
 	"""
 	Gets a unifrac distance from files/filestreams.
+	If no environment file is given, the abundance matrix is used with features matched to the tips of the tree by name.
 
         :param	istrmTree:	File path or stream which is a Newick format file
         :type:	String of file stream
-        :param	istrmEnvr:	File path or stream which is a Newick format file
+        :param	istrmEnvr:	File path or stream which is an environment file (sequence, sample, count)
         :type:	String of file stream
+        :param	lsSampleOrder:	Samples to return and their order (also the sample name of each abundance row).
+        :type:	List of strings
+        :param	fWeighted:	True gives weighted unifrac, False unweighted.
+        :type:	Boolean
+        :param	npaAbundance:	Abundance used when no environment file is given (row=samples, columns=features).
+        :type:	Numpy array
+        :param	lsFeatureNames:	Feature name of each column of npaAbundance.
+        :type:	List of strings
+        :param	iProcesses:	Number of processes measuring the distances.
+        :type:	Integer
+        :return	Tuple or Boolean:	(Condensed distance matrix, sample names) or False on error.
 	"""
-	npaDist, lsSampleNames = fast_unifrac_file(open(istrmTree,"r") if isinstance(istrmTree, str) else istrmTree,
-			open(istrmEnvr,"r") if isinstance(istrmEnvr, str) else istrmEnvr, weighted=fWeighted).get("distance_matrix",False)
+        if istrmEnvr:
+            xDistances = UniFrac.funcGetUnifracDistanceFromFiles(istrmTree=istrmTree, istrmEnvr=istrmEnvr, fWeighted=fWeighted, iProcesses=iProcesses)
+        elif (not npaAbundance is None) and lsFeatureNames and lsSampleOrder:
+            xDistances = UniFrac.funcGetUnifracDistanceFromAbundance(istrmTree=istrmTree, npaAbundance=npaAbundance, lsSampleNames=lsSampleOrder,
+                                                                   lsFeatureNames=lsFeatureNames, fWeighted=fWeighted, iProcesses=iProcesses)
+        else:
+            print "Metric.funcGetUnifracDistance. Error= Requires an environment file or an abundance matrix with feature and sample names."
+            return False
+        if type(xDistances) is BooleanType:
+            return False
+        npaDist, lsSampleNames = xDistances
 
-        #Was trying to avoid preallocating a matrix but if you only need a subset of the samples then it
-        #is simpler to preallocate so this is what I am doing but making a condensed matrix and not a full matrix
-        
-        #Dictionary to translate the current order of the samples to what is expected if given an input order
+        #Reorder the matrix to the requested sample order with one permutation index
         if lsSampleOrder:
-            #{NewOrder:OriginalOrder} way to convert from old to new sample location
-            dictTranslate = dict([[lsSampleOrder.index(sSampleName),lsSampleNames.index(sSampleName)] for sSampleName in lsSampleNames if sSampleName in lsSampleOrder])
+            #{SampleName:OriginalOrder}
+            dictSampleIndex = dict([[sSampleName,iIndex] for iIndex, sSampleName in enumerate(lsSampleNames)])
 
             #Check to make sure all samples requested were found
-            if not len(dictTranslate.keys()) == len(lsSampleOrder):
-                print "Metric.funcGetUnifracDistance. Error= The some or all sample names given (lsSampleOrder) were not contained in the matrix."
+            lsMissingSamples = [sSampleName for sSampleName in lsSampleOrder if not sSampleName in dictSampleIndex]
+            if lsMissingSamples:
+                print "".join(["Metric.funcGetUnifracDistance. Error= ",str(len(lsMissingSamples))," of ",str(len(lsSampleOrder)),
+                               " sample names given (lsSampleOrder) were not contained in the matrix. Missing samples: ",", ".join(lsMissingSamples)])
                 return False
 
-            #Length of data
-            iLengthOfData = len(lsSampleOrder)
-
-            #Preallocate matrix and shuffle
-            mtrxData = np.zeros(shape=(iLengthOfData,iLengthOfData))
-            for x in xrange(iLengthOfData):
-                for y in xrange(iLengthOfData):
-                    mtrxData[x,y] = npaDist[dictTranslate[x],dictTranslate[y]]
-            npaDist = mtrxData
+            #Permutation from the new sample location to the original sample location
+            npaiPermutation = np.array([dictSampleIndex[sSampleName] for sSampleName in lsSampleOrder], dtype=np.intp)
+            npaDist = np.asarray(npaDist)[np.ix_(npaiPermutation,npaiPermutation)]
 
             lsSampleNames = lsSampleOrder
 
         #If no sample order is given, condense the matrix and return
-        return (scipy.spatial.distance.squareform(npaDist),lsSampleNames)
+        return (scipy.spatial.distance.squareform(npaDist,checks=False),lsSampleNames)
 
 
     #Test 7
@@ -392,7 +440,7 @@ class Metric:
 
     #Testing 6 cases
     @staticmethod
-    def funcGetBetaMetric(npadAbundancies=None, sMetric=None, istrmTree=None, istrmEnvr=None, lsSampleOrder=None, fAdditiveInverse = False):
+    def funcGetBetaMetric(npadAbundancies=None, sMetric=None, istrmTree=None, istrmEnvr=None, lsSampleOrder=None, fAdditiveInverse = False, lsFeatureNames=None):
         """
         Takes a matrix of values and returns a beta metric matrix. The metric returned is indicated by name (sMetric).
 		
@@ -400,6 +448,8 @@ class Metric:
         :type:	Numpy Array	Numpy array where row=samples and columns = features.
         :param	sMetric:	String name of beta metric. Possibilities are listed in microPITA.
         :type:	String	String name of beta metric. Possibilities are listed in microPITA.
+        :param	lsFeatureNames:	Feature names of the npadAbundancies columns (used by unifrac when no environment file is given).
+        :type:	List of strings
         :return	Double:	Measurement indicated by metric for given abundance list
         """
 
@@ -410,10 +460,12 @@ class Metric:
         elif sMetric in Metric.setBetaDiversities:
             mtrxDistance = Metric.funcGetDissimilarityByName(ldSampleTaxaAbundancies=npadAbundancies, strMetric=sMetric)
         elif sMetric == Metric.c_strUnifracUnweighted:
-            mtrxDistance = Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,lsSampleOrder=lsSampleOrder,fWeighted=False)
+            mtrxDistance = Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,lsSampleOrder=lsSampleOrder,fWeighted=False,
+                                                          npaAbundance=npadAbundancies,lsFeatureNames=lsFeatureNames)
 #            mtrxDistance = xReturn[0] if not type(xReturn) is BooleanType else xReturn
         elif sMetric == Metric.c_strUnifracWeighted:
-            mtrxDistance = Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,lsSampleOrder=lsSampleOrder,fWeighted=True)
+            mtrxDistance = Metric.funcGetUnifracDistance(istrmTree=istrmTree,istrmEnvr=istrmEnvr,lsSampleOrder=lsSampleOrder,fWeighted=True,
+                                                          npaAbundance=npadAbundancies,lsFeatureNames=lsFeatureNames)
 #            mtrxDistance = xReturn[0] if not type(xReturn) is BooleanType else xReturn
         else:
             mtrxDistance = False
@@ -426,45 +478,250 @@ class Metric:
 
     #Test Cases 11
     @staticmethod
-    def funcReadMatrixFile(istmMatrixFile, lsSampleOrder=None):
-	"""
-	Reads in a file with a precalculated beta-diversty matrix.
+    def funcReadMatrixFile(istmMatrixFile, lsSampleOrder=None, fCondensed=False):
+        """
+        Reads in a file with a precalculated beta-diversty matrix.
+        Files ending in Metric.c_strBinaryMatrixExtension are read as binary numpy matrices with the sample names
+        in the companion sample file (see Metric.funcGetBinaryMatrixSampleFile).
+        Text files are parsed a row at a time into a preallocated matrix using sample to index maps built once.
+
+        :param istmMatrixFile:	File with beta-diversity matrix
+        :type:	FileStream of String file path
+        :param lsSampleOrder:	Samples to read and the order they should be in (None reads all samples in the file order).
+        :type:	List of strings
+        :param fCondensed:	Return the condensed matrix instead of the square matrix.
+        :type:	Boolean
+        :return	Tuple:	(Matrix, list of sample names) or False if the requested samples are not all in the file.
+        """
 
-	:param istmMatrixFile:	File with beta-diversity matrix
-	:type:	FileStream of String file path
-	"""
+        if isinstance(istmMatrixFile, str) and istmMatrixFile.endswith(Metric.c_strBinaryMatrixExtension):
+            return Metric._funcReadBinaryMatrixFile(strMatrixFile=istmMatrixFile, lsSampleOrder=lsSampleOrder, fCondensed=fCondensed)
 
-        #Read in data
-        f = csv.reader(open(istmMatrixFile,"r") if isinstance(istmMatrixFile, str) else istmMatrixFile, delimiter=ConstantsBreadCrumbs.c_matrixFileDelim )
+        istmMatrix = open(istmMatrixFile,"r") if isinstance(istmMatrixFile, str) else istmMatrixFile
 
         #Get header
-        try:
-            lsHeader = f.next()
-        except StopIteration:
+        sHeader = istmMatrix.readline()
+        if not sHeader:
             return (False,False)
-        lsHeaderReducedToSamples = [sHeader for sHeader in lsHeader if sHeader in lsSampleOrder] if lsSampleOrder else lsHeader[1:]
+        lsHeader = csv.reader([sHeader], delimiter=ConstantsBreadCrumbs.c_matrixFileDelim).next()
+        setSampleOrder = set(lsSampleOrder) if lsSampleOrder else set()
+        lsHeaderReducedToSamples = [sHeader for sHeader in lsHeader if sHeader in setSampleOrder] if lsSampleOrder else lsHeader[1:]
 
         #If no sample ordering is given, set the ordering to what is in the file
         if not lsSampleOrder:
-	    lsSampleOrder = lsHeaderReducedToSamples
-
-        #Preallocate matrix
-        mtrxData = np.zeros(shape=(len(lsSampleOrder),len(lsSampleOrder)))
+            lsSampleOrder = lsHeaderReducedToSamples
+        lsSampleOrder = list(lsSampleOrder)
 
         #Make sure all samples requested are in the file
         if(not len(lsSampleOrder) == len(lsHeaderReducedToSamples)): return False
 
-	for lsLine in f:
-            if lsLine[0] in lsSampleOrder:
-                iRowIndex = lsSampleOrder.index(lsLine[0])
-
-                for i in xrange(1,len(lsSampleOrder)):
-                    iColumnIndexComing = lsHeader.index(lsSampleOrder[i])
-                    iColumnIndexGoing = lsSampleOrder.index(lsSampleOrder[i])
-                    mtrxData[iRowIndex,iColumnIndexGoing] = lsLine[iColumnIndexComing]
-                    mtrxData[iColumnIndexGoing,iRowIndex] = lsLine[iColumnIndexComing]
-        tpleMData = mtrxData.shape
-        mtrxData = mtrxData if any(sum(ld)>0 for ld in mtrxData) or ((tpleMData[0]==1) and (tpleMData[1]==1)) else []
+        #Index maps built once {"sample":index}
+        #Values are read without the row id so header positions are shifted by 1
+        iSampleCount = len(lsSampleOrder)
+        dictHeaderIndex = dict([(sSample,iIndex-1) for iIndex, sSample in enumerate(lsHeader)])
+        dictSampleIndex = dict([(sSample,iIndex) for iIndex, sSample in enumerate(lsSampleOrder)])
+        npaiColumns = np.array([dictHeaderIndex[sSample] for sSample in lsSampleOrder], dtype=int)
+
+        #Preallocate matrix
+        #For a condensed matrix the positions of a sample's pairs are given by the start of each row of the condensed matrix
+        npaiRowStarts = np.cumsum([0]+range(iSampleCount-1,0,-1))
+        npaiSampleIndices = np.arange(iSampleCount)
+        mtrxData = np.zeros(iSampleCount*(iSampleCount-1)/2) if fCondensed else np.zeros(shape=(iSampleCount,iSampleCount))
+
+        #Rows hold a value for each sample of the header
+        iRowWidth = len(lsHeader)-1
+        for iLine, sLine in enumerate(istmMatrix, 2):
+            sLine = sLine.rstrip("\r\n")
+            if not sLine:
+                continue
+            #Split off the row id and parse the numeric row in bulk
+            #fromstring stops at the first value which is not a number so short rows are rejected below
+            if sLine[0] == ConstantsBreadCrumbs.c_cQuote:
+                lsLine = csv.reader([sLine], delimiter=ConstantsBreadCrumbs.c_matrixFileDelim).next()
+                sRowID = lsLine[0]
+                try:
+                    npaRow = np.array(lsLine[1:], dtype=float)
+                except ValueError:
+                    npaRow = np.array([])
+            else:
+                sRowID, _, sValues = sLine.partition(ConstantsBreadCrumbs.c_matrixFileDelim)
+                npaRow = np.fromstring(sValues, dtype=float, sep=ConstantsBreadCrumbs.c_matrixFileDelim)
+
+            iRowIndex = dictSampleIndex.get(sRowID,None)
+            if iRowIndex is None:
+                continue
+            if not len(npaRow) == iRowWidth:
+                print "".join(["Metric.funcReadMatrixFile. Error= Row ",str(iLine)," (",sRowID,") has ",str(len(npaRow)),
+                    " numeric values, expected ",str(iRowWidth)," (a value is missing or not a number)."])
+                return False
+            npaRow = npaRow[npaiColumns]
+
+            #A row sets all pairs of its sample, later rows overwrite earlier ones
+            if fCondensed:
+                npaiOthers = np.delete(npaiSampleIndices,iRowIndex)
+                npaiLow, npaiHigh = np.minimum(npaiOthers,iRowIndex), np.maximum(npaiOthers,iRowIndex)
+                mtrxData[npaiRowStarts[npaiLow]+npaiHigh-npaiLow-1] = npaRow[npaiOthers]
+            else:
+                mtrxData[iRowIndex,:] = npaRow
+                mtrxData[:,iRowIndex] = npaRow
+
+        if (not iSampleCount == 1) and not np.any((mtrxData if fCondensed else mtrxData.sum(axis=1)) > 0):
+            mtrxData = []
+        return (mtrxData,lsSampleOrder)
+
+    @staticmethod
+    def funcGetCondensedSubMatrix(npaCondensedMatrix, npaiIndices):
+        """
+        Extracts the condensed matrix of a subset of samples from a condensed matrix without expanding it to a square matrix.
+
+        :param	npaCondensedMatrix:	Condensed distance matrix of all samples.
+        :type:	Numpy array
+        :param	npaiIndices:	Indices of the samples to extract, in the order they should be in.
+        :type:	Numpy array or list of integers
+        :return	Numpy array:	Condensed distance matrix of the samples.
+        """
+
+        npaiIndices = np.asarray(npaiIndices, dtype=np.intp)
+        iSampleCount = int(round((1+np.sqrt(1+8*len(npaCondensedMatrix)))/2))
+
+        #Pairs of the subset and their position in the full condensed matrix
+        npaiRows, npaiColumns = np.triu_indices(len(npaiIndices), k=1)
+        npaiLow = np.minimum(npaiIndices[npaiRows],npaiIndices[npaiColumns])
+        npaiHigh = np.maximum(npaiIndices[npaiRows],npaiIndices[npaiColumns])
+        return np.asarray(npaCondensedMatrix)[iSampleCount*npaiLow-(npaiLow*(npaiLow+1))//2+(npaiHigh-npaiLow-1)]
+
+    @staticmethod
+    def _funcGetLowestPositions(npadValues, iCount):
+        """
+        Gets the positions of the lowest values with a partial sort.
+        Values tied with the last value are all returned, so the result does not depend on the order of ties.
+
+        :param	npadValues:	Values to search.
+        :type:	Numpy array
+        :param	iCount:	Number of lowest values to return.
+        :type:	Integer
+        :return	Numpy array:	Positions of at least iCount (or all) of the lowest values, in increasing position.
+        """
+
+        if iCount >= len(npadValues):
+            return np.arange(len(npadValues))
+        dLast = npadValues[np.argpartition(npadValues, iCount-1)[iCount-1]]
+        return np.flatnonzero(npadValues <= dLast)
+
+    @staticmethod
+    def funcGetLowestPairs(iPairCount, npaCondensedMatrix=None, npadAbundancies=None, sMetric=None, fAdditiveInverse=False, iBlockSize=1024):
+        """
+        Gets the sample pairs with the lowest measurements using a partial sort instead of sorting (or clustering) all pairs.
+        Pairs are read from a condensed matrix or, given an abundance matrix, measured for blocks of samples at a time so all pairs are never held.
+        Pairs tied with the last pair are also returned.
+
+        :param	iPairCount:	Number of pairs to return.
+        :type:	Integer
+        :param	npaCondensedMatrix:	Condensed distance matrix.
+        :type:	Numpy array
+        :param	npadAbundancies:	Samples (rows) x measurements (columns), used if no condensed matrix is given.
+        :type:	Numpy Array
+        :param	sMetric:	Name of beta metric measured on the abundance (see Metric.funcGetCrossDistance).
+        :type:	String
+        :param	fAdditiveInverse:	Use 1 - the measurement of the abundance (so the most distant pairs are returned).
+        :type:	Boolean
+        :param	iBlockSize:	Number of samples measured against all others at a time.
+        :type:	Integer
+        :return	Tuple:	(first sample indices, second sample indices, measurements) of the pairs, the first sample of a pair
+                                has the lower index and pairs are ordered by measurement then sample indices. False on error.
+        """
+
+        if npaCondensedMatrix is not None:
+            npaCondensedMatrix = np.asarray(npaCondensedMatrix)
+            iSampleCount = int(round((1+np.sqrt(1+8*len(npaCondensedMatrix)))/2))
+            npaiPositions = Metric._funcGetLowestPositions(npaCondensedMatrix, iPairCount)
+
+            #Samples of each position of the condensed matrix
+            npaiFirst = (iSampleCount-2-np.floor(np.sqrt(-8*npaiPositions+4*iSampleCount*(iSampleCount-1)-7)/2.0-0.5)).astype(np.intp)
+            npaiSecond = npaiPositions+npaiFirst+1-(iSampleCount*(iSampleCount-1))//2+((iSampleCount-npaiFirst)*(iSampleCount-npaiFirst-1))//2
+            npadValues = npaCondensedMatrix[npaiPositions]
+        else:
+            npadAbundancies = np.asarray(npadAbundancies, dtype=float)
+            iSampleCount = npadAbundancies.shape[0]
+            npaiFirst = np.zeros(0, dtype=np.intp)
+            npaiSecond = np.zeros(0, dtype=np.intp)
+            npadValues = np.zeros(0)
+            dLast = np.inf
+            for iStart in xrange(0, iSampleCount-1, iBlockSize):
+                npaBlock = Metric.funcGetCrossDistance(npadAbundancies[iStart:iStart+iBlockSize], npadAbundancies[iStart:], sMetric)
+                if type(npaBlock) is BooleanType:
+                    return False
+                if fAdditiveInverse:
+                    npaBlock = 1.0-npaBlock
+
+                #Pairs of the block above the diagonal which can be among the lowest
+                npaiRows, npaiColumns = np.nonzero(np.triu(npaBlock <= dLast, k=1))
+                npaiFirst = np.concatenate([npaiFirst, npaiRows+iStart])
+                npaiSecond = np.concatenate([npaiSecond, npaiColumns+iStart])
+                npadValues = np.concatenate([npadValues, npaBlock[npaiRows,npaiColumns]])
+
+                npaiPositions = Metric._funcGetLowestPositions(npadValues, iPairCount)
+                npaiFirst, npaiSecond, npadValues = npaiFirst[npaiPositions], npaiSecond[npaiPositions], npadValues[npaiPositions]
+                if len(npadValues) >= iPairCount:
+                    dLast = npadValues.max()
+
+        npaiOrder = np.lexsort((npaiSecond, npaiFirst, npadValues))
+        return (npaiFirst[npaiOrder], npaiSecond[npaiOrder], npadValues[npaiOrder])
+
+    @staticmethod
+    def funcGetBinaryMatrixSampleFile(strMatrixFile):
+        """
+        Gets the path of the file holding the sample names of a binary matrix file.
+        The sample file holds one sample name per line in the order of the matrix.
+
+        :param strMatrixFile:	Path of the binary matrix file.
+        :type:	String
+        :return	String:	Path of the sample name file.
+        """
+
+        return os.path.splitext(strMatrixFile)[0]+Metric.c_strBinaryMatrixSamplesExtension
+
+    @staticmethod
+    def _funcReadBinaryMatrixFile(strMatrixFile, lsSampleOrder=None, fCondensed=False):
+        """
+        Reads a square matrix saved as a binary numpy file with its companion sample name file.
+        The file is memory mapped so only the requested samples are read.
+
+        :param strMatrixFile:	Path of the binary matrix file.
+        :type:	String
+        :param lsSampleOrder:	Samples to read and the order they should be in (None reads all samples).
+        :type:	List of strings
+        :param fCondensed:	Return the condensed matrix instead of the square matrix.
+        :type:	Boolean
+        :return	Tuple:	(Matrix, list of sample names) or False if the requested samples are not all in the file.
+        """
+
+        lsFileSamples = [sLine.rstrip("\r\n") for sLine in open(Metric.funcGetBinaryMatrixSampleFile(strMatrixFile),"r")]
+        lsFileSamples = [sSample for sSample in lsFileSamples if sSample]
+        npaMatrix = np.load(strMatrixFile, mmap_mode="r")
+        if not npaMatrix.shape == (len(lsFileSamples),len(lsFileSamples)):
+            print "".join(["Metric._funcReadBinaryMatrixFile. Error= Length of sample names ("+str(len(lsFileSamples))+") and matrix ("+str(npaMatrix.shape)+") not equal."])
+            return False
+
+        dictSampleIndex = dict([(sSample,iIndex) for iIndex, sSample in enumerate(lsFileSamples)])
+        lsSampleOrder = list(lsSampleOrder) if lsSampleOrder else lsFileSamples
+        lsMissing = [sSample for sSample in lsSampleOrder if not sSample in dictSampleIndex]
+        if lsMissing:
+            print "".join(["Metric._funcReadBinaryMatrixFile. Error= Samples not in the matrix file: ",str(lsMissing)])
+            return False
+        npaiIndices = np.array([dictSampleIndex[sSample] for sSample in lsSampleOrder], dtype=int)
+
+        if fCondensed:
+            #Read a row at a time straight into the condensed matrix
+            iSampleCount = len(npaiIndices)
+            mtrxData = np.empty(iSampleCount*(iSampleCount-1)/2)
+            iStart = 0
+            for iIndex in xrange(iSampleCount-1):
+                iStop = iStart+iSampleCount-iIndex-1
+                mtrxData[iStart:iStop] = npaMatrix[npaiIndices[iIndex]][npaiIndices[iIndex+1:]]
+                iStart = iStop
+        else:
+            mtrxData = np.array(npaMatrix[np.ix_(npaiIndices,npaiIndices)], dtype=float)
         return (mtrxData,lsSampleOrder)
 
     #Test cases 2
@@ -472,6 +729,8 @@ class Metric:
     def funcWriteMatrixFile(mtrxMatrix, ostmMatrixFile, lsSampleNames=None):
         """
         Writes a square matrix to file.
+        If the file path ends in Metric.c_strBinaryMatrixExtension the matrix is saved as a binary numpy file
+        and the sample names are written to the companion sample file (see Metric.funcGetBinaryMatrixSampleFile).
         
         :param mtrxMatrix:	Matrix to write to file
         :type:	Numpy array
@@ -492,13 +751,42 @@ class Metric:
             print "".join(["Metric.funcWriteMatrixFile. Error= Length of sample names ("+str(len(lsSampleNames))+") and matrix ("+str(mtrxMatrix.shape)+") not equal."])
             return False
 
-        #Write to file
-        ostmOut = csv.writer(open(ostmMatrixFile,"w") if isinstance(ostmMatrixFile,str) else ostmMatrixFile, delimiter=ConstantsBreadCrumbs.c_matrixFileDelim )
+        #Write binary matrix and sample names
+        if isinstance(ostmMatrixFile,str) and ostmMatrixFile.endswith(Metric.c_strBinaryMatrixExtension):
+            np.save(ostmMatrixFile, np.asarray(mtrxMatrix, dtype=float))
+            with open(Metric.funcGetBinaryMatrixSampleFile(ostmMatrixFile),"w") as ostmSamples:
+                ostmSamples.write("".join([str(sSample)+ConstantsBreadCrumbs.c_strEndline for sSample in lsSampleNames]))
+            return True
 
-        #Add the additional space at the beginning of the sample names to represent the id row/column
-        lsSampleNames = [""]+list(lsSampleNames)
+        #Write to file (with the line endings of the csv module)
+        ostmOut = open(ostmMatrixFile,"w") if isinstance(ostmMatrixFile,str) else ostmMatrixFile
+        strLineEnd = csv.excel.lineterminator
 
-        #Write header and each row to file
-        ostmOut.writerow(lsSampleNames)
-        [ostmOut.writerow([lsSampleNames[iIndex+1]]+mtrxMatrix[iIndex,].tolist()) for iIndex in xrange(tpleiShape[0])]
+        #Add the additional space at the beginning of the sample names to represent the id row/column
+        #Quote sample names as the csv writer would
+        lsSampleNames = [Metric._funcQuoteMatrixFileEntry(str(sSample)) for sSample in [""]+list(lsSampleNames)]
+
+        #Write header and blocks of rows to file
+        ostmOut.write(ConstantsBreadCrumbs.c_matrixFileDelim.join(lsSampleNames)+strLineEnd)
+        for iBlockStart in xrange(0,tpleiShape[0],Metric.c_iMatrixFileBlockSize):
+            ostmOut.write("".join([ConstantsBreadCrumbs.c_matrixFileDelim.join([lsSampleNames[iIndex+1]]+map(repr,mtrxMatrix[iIndex,].tolist()))+strLineEnd
+                for iIndex in xrange(iBlockStart,min(iBlockStart+Metric.c_iMatrixFileBlockSize,tpleiShape[0]))]))
+        if isinstance(ostmMatrixFile,str):
+            ostmOut.close()
+        else:
+            ostmOut.flush()
         return True
+
+    @staticmethod
+    def _funcQuoteMatrixFileEntry(sEntry):
+        """
+        Quotes an entry of a matrix file if needed (as the minimal quoting of the csv module does).
+
+        :param sEntry:	Entry to write.
+        :type:	String
+        :return	String:	Entry ready to write.
+        """
+
+        if (ConstantsBreadCrumbs.c_matrixFileDelim in sEntry) or (ConstantsBreadCrumbs.c_cQuote in sEntry) or (ConstantsBreadCrumbs.c_strEndline in sEntry):
+            return ConstantsBreadCrumbs.c_cQuote+sEntry.replace(ConstantsBreadCrumbs.c_cQuote,ConstantsBreadCrumbs.c_cQuote*2)+ConstantsBreadCrumbs.c_cQuote
+        return sEntry
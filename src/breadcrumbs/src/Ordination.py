@@ -70,17 +70,11 @@ class Ordination:
 
         if fIsRawData:
             #Read in the file data to a numpy array.
-            #Samples (column) by Taxa (rows)(lists) without the column
-            data = xData.funcToArray()
-            if data==None:
+            #Taxa (columns) by samples (rows)
+            data = xData.funcGetSampleAbundanceMatrix(dtype=float)
+            if data is None:
                 print("Ordination:loadData::Error when converting AbundanceTable to Array, did not perform ordination.")
                 return False
-
-            #Transpose data to be Taxa (columns) by samples (rows)(lists)
-            data = UtilityMath.funcTransposeDataMatrix(data,fRemoveAdornments=False)
-            if(ValidateData.funcIsFalse(data)):
-                print("Ordination:loadData::Error when transposing data file, did not perform ordination.")
-                return False
             else:
                 self.dataMatrix=data
                 self.isRawData=fIsRawData
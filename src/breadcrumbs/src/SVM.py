@@ -36,6 +36,7 @@ __status__ = "Development"
 from AbundanceTable import AbundanceTable
 from ConstantsBreadCrumbs import ConstantsBreadCrumbs
 import csv
+import numpy as np
 import os
 from random import shuffle
 from ValidateData import ValidateData
@@ -45,9 +46,71 @@ class SVM:
     Class which holds generic methods for SVM use.
     """
 
+    #Number of lines written to the SVM file at a time
+    c_iWriteBlockSize = 1000
+
+    @staticmethod
+    def funcGetSVMFeatureLines(abndAbundanceTable, fSparse = True):
+        """
+        Makes the feature part of the LibSVM line of each sample ("1:value 2:value ...").
+        In sparse mode features with a zero measurement are left out, as LibSVM reads missing features as 0.
+
+        :param abndAbundanceTable:    AbudanceTable object to make the lines from.
+        :type:	AbundanceTable
+        :param	fSparse:	True indicates zero features are not written.
+        :type:	Boolean
+        :return	dictLines:	{"sample":"1:value 2:value ..."}
+        """
+
+        lsSamples = abndAbundanceTable.funcGetSampleNames()
+        if not len(lsSamples):
+            return dict()
+
+        #Row=sample, column=feature
+        npaData = abndAbundanceTable.funcGetSampleAbundanceMatrix()
+        #Index strings "1:","2:",... shared by all samples
+        npaIndices = np.array([str(iIndex)+ConstantsBreadCrumbs.c_strColon for iIndex in xrange(1,npaData.shape[1]+1)], dtype=object)
+
+        dictLines = dict()
+        for iSample, sSample in enumerate(lsSamples):
+            npaRow = npaData[iSample]
+            if fSparse:
+                npaKeep = np.flatnonzero(npaRow)
+                dictLines[sSample] = ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join(npaIndices[npaKeep]+npaRow[npaKeep].astype(str).astype(object))
+            else:
+                dictLines[sSample] = ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join(npaIndices+npaRow.astype(str).astype(object))
+        return dictLines
+
+    @staticmethod
+    def funcWriteSVMLines(ostm, lsLines):
+        """
+        Writes lines to a LibSVM file, a block of lines at a time.
+
+        :param	ostm:	Open file stream to write to.
+        :type:	FileStream
+        :param	lsLines:	Lines to write (without line endings).
+        :type:	List of strings
+        """
+
+        for iStart in xrange(0,len(lsLines),SVM.c_iWriteBlockSize):
+            ostm.write("".join([sLine+ConstantsBreadCrumbs.c_strSVMLineEnd for sLine in lsLines[iStart:iStart+SVM.c_iWriteBlockSize]]))
+
+    @staticmethod
+    def funcGetSVMBlankLine(iSize):
+        """
+        Makes the line standing in for a sample which is not in the abundance table ("- 1:- 2:- ...").
+
+        :param	iSize:	Number of features.
+        :type:	Integer
+        :return	String:	Blank line (without line ending).
+        """
+
+        return ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join([ConstantsBreadCrumbs.c_strSVMNoSample]+
+                [str(iIndex)+ConstantsBreadCrumbs.c_strColon+ConstantsBreadCrumbs.c_strSVMNoSample for iIndex in xrange(1,iSize+1)])
+
     #1 Happy Path tested
     @staticmethod
-    def funcConvertAbundanceTableToSVMFile(abndAbundanceTable, xOutputSVMFile, sMetadataLabel, lsOriginalLabels = None, lsSampleOrdering = None):
+    def funcConvertAbundanceTableToSVMFile(abndAbundanceTable, xOutputSVMFile, sMetadataLabel, lsOriginalLabels = None, lsSampleOrdering = None, fSparse = True):
         """
         Converts abundance files to input SVM files.
 
@@ -61,45 +124,45 @@ class SVM:
 	:type:	List of strings
         :param	lsSampleOrdering: Order of samples to output to output file. If none, the order in the abundance table is used.
         :type:	List of strings
+        :param	fSparse:	True indicates features with a zero measurement are not written.
+        :type:	Boolean
         :return	lsUniqueLabels:	List of unique labels.
         """
 
-        #Create data matrix
-        dataMatrix = zip(*abndAbundanceTable.funcGetAbundanceCopy())
+        #Feature part of each sample's line
+        dictLines = SVM.funcGetSVMFeatureLines(abndAbundanceTable, fSparse=fSparse)
 
         #Add labels
-        llData = []
         lsLabels = lsOriginalLabels if lsOriginalLabels else SVM.funcMakeLabels(abndAbundanceTable.funcGetMetadata(sMetadataLabel))
         if not isinstance(xOutputSVMFile,str):
             if xOutputSVMFile.closed:
                 xOutputSVMFile = open(xOutputSVMFile.name,"w")
 	ostm = open(xOutputSVMFile,"w") if isinstance(xOutputSVMFile, str) else xOutputSVMFile
-        f = csv.writer(ostm, csv.excel_tab, delimiter = ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace)
 
 	#This allows the creation of partially known files for stratification purposes
 	lsCurrentSamples = abndAbundanceTable.funcGetSampleNames()
         lsOrderingSamples = lsSampleOrdering if lsSampleOrdering else lsCurrentSamples[:]
+	iSize = abndAbundanceTable.funcGetFeatureCount()
+	sBlankLine = SVM.funcGetSVMBlankLine(iSize)
 
+	lsOutput = []
 	iLabelIndex = 0
-	iSize = len(dataMatrix[0])
-	iIndexSample = 1
 	for sSample in lsOrderingSamples:
-		if sSample in lsCurrentSamples:
-        		f.writerow([lsLabels[iLabelIndex]]+
-				[ConstantsBreadCrumbs.c_strColon.join([str(tpleFeature[0]+1),str(tpleFeature[1])]) for tpleFeature in enumerate(dataMatrix[iIndexSample])])
+		sLine = dictLines.get(sSample,None)
+		if not sLine is None:
+			lsOutput.append(ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join([lsLabels[iLabelIndex],sLine]) if sLine else lsLabels[iLabelIndex])
 			iLabelIndex += 1
-			iIndexSample += 1
 		#Make blank entry
 		else:
-			f.writerow([ConstantsBreadCrumbs.c_strSVMNoSample]+[ConstantsBreadCrumbs.c_strColon.join([str(tpleNas[0]+1),str(tpleNas[1])])
-						for tpleNas in enumerate([ConstantsBreadCrumbs.c_strSVMNoSample]*iSize)])
+			lsOutput.append(sBlankLine)
 			if lsOriginalLabels:
 				iLabelIndex += 1
+	SVM.funcWriteSVMLines(ostm, lsOutput)
 	ostm.close()
         return set(lsLabels)
 
     @staticmethod
-    def funcUpdateSVMFileWithAbundanceTable(abndAbundanceTable, xOutputSVMFile, lsOriginalLabels, lsSampleOrdering):
+    def funcUpdateSVMFileWithAbundanceTable(abndAbundanceTable, xOutputSVMFile, lsOriginalLabels, lsSampleOrdering, fSparse = True):
         """
         Takes a SVM input file and updates it with an abundance table.
         lsOriginalLabels and lsSampleOrdering should be consistent to the input file.
@@ -114,6 +177,8 @@ class SVM:
         :type:	List of strings
         :param	lsSampleOrdering: Order of samples in the output file.
         :type:	List of strings
+        :param	fSparse:	True indicates features with a zero measurement are not written.
+        :type:	Boolean
         :return	lsUniqueLabels:	List of unique labels.
         """
 
@@ -122,47 +187,90 @@ class SVM:
             if xOutputSVMFile.closed:
                 xOutputSVMFile = open(xOutputSVMFile.name,"r")
 	ostm = open(xOutputSVMFile,"r") if isinstance(xOutputSVMFile, str) else xOutputSVMFile
-        fin = csv.reader(ostm, csv.excel_tab, delimiter = ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace)
-	#Read in contents of file
-	llsOldContents = [lsRow for lsRow in fin]
+	#Read in contents of file, lines are kept as they are if their sample is not updated
+	lsOldContents = ostm.read().splitlines()
 	ostm.close()
 
 	#Check to make sure this ordering covers all positions in the old file
-	if not len(llsOldContents) == len(lsSampleOrdering):
-		print "The length of the original file ("+str(len(llsOldContents))+") does not match the length of the ordering given ("+str(len(lsSampleOrdering))+")."
+	if not len(lsOldContents) == len(lsSampleOrdering):
+		print "The length of the original file ("+str(len(lsOldContents))+") does not match the length of the ordering given ("+str(len(lsSampleOrdering))+")."
 		return False
 
-        #Create data matrix from new data
-        dataMatrix = zip(*abndAbundanceTable.funcGetAbundanceCopy())
-
-        #Add labels
-        llData = []
+        #Feature part of the new samples' lines
+        dictLines = SVM.funcGetSVMFeatureLines(abndAbundanceTable, fSparse=fSparse)
 
 	#Write to file
         if not isinstance(xOutputSVMFile,str):
             if xOutputSVMFile.closed:
                 xOutputSVMFile = open(xOutputSVMFile.name,"w")
 	ostm = open(xOutputSVMFile,"w") if isinstance(xOutputSVMFile, str) else xOutputSVMFile
-        f = csv.writer(ostm, csv.excel_tab, delimiter = ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace)
 
-	#This allows to know what position to place the new lines
-	lsCurrentSamples = abndAbundanceTable.funcGetSampleNames()
-
-	iSize = len(dataMatrix[0])
-	iIndexSample = 1
-	iIndexOriginalOrder = 0
-	for sSample in lsSampleOrdering:
-		if sSample in lsCurrentSamples:
-        		f.writerow([lsOriginalLabels[iIndexOriginalOrder]]+
-				[ConstantsBreadCrumbs.c_strColon.join([str(tpleFeature[0]+1),str(tpleFeature[1])]) for tpleFeature in enumerate(dataMatrix[iIndexSample])])
-			iIndexSample += 1
-		#Make blank entry
+	lsOutput = []
+	for iIndexOriginalOrder, sSample in enumerate(lsSampleOrdering):
+		sLine = dictLines.get(sSample,None)
+		if not sLine is None:
+			lsOutput.append(ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join([lsOriginalLabels[iIndexOriginalOrder],sLine]) if sLine else lsOriginalLabels[iIndexOriginalOrder])
+		#Keep the old entry
 		else:
-			f.writerow(llsOldContents[iIndexOriginalOrder])
-		iIndexOriginalOrder += 1
+			lsOutput.append(lsOldContents[iIndexOriginalOrder])
+	SVM.funcWriteSVMLines(ostm, lsOutput)
 	ostm.close()
         return True
 
+    @staticmethod
+    def funcWriteSVMFileFromLines(dictLines, xOutputSVMFile, lsOriginalLabels, lsSampleOrdering, iFeatureCount):
+        """
+        Writes a SVM input file once from feature lines gathered over several abundance tables (for instance strata),
+        instead of updating the file with each table in turn.
+        Samples in lsSampleOrdering without a line are written as blank entries.
+
+        :param	dictLines:	Feature part of the line of each sample {"sample":"1:value 2:value ..."} (see SVM.funcGetSVMFeatureLines).
+        :type:	Dictionary
+        :param xOutputSVMFile: File to save SVM data to.
+        :type:	FileStream or string file path
+        :param	lsOriginalLabels: The list of the original labels (as numerics 0,1,2,3,4...as should be in the file).
+        :type:	List of strings
+        :param	lsSampleOrdering: Order of samples in the output file, in the same order as lsOriginalLabels.
+        :type:	List of strings
+        :param	iFeatureCount:	Number of features, used to make blank entries.
+        :type:	Integer
+        :return	lsUniqueLabels:	List of unique labels.
+        """
+
+        if not isinstance(xOutputSVMFile,str):
+            if xOutputSVMFile.closed:
+                xOutputSVMFile = open(xOutputSVMFile.name,"w")
+        ostm = open(xOutputSVMFile,"w") if isinstance(xOutputSVMFile, str) else xOutputSVMFile
+
+        sBlankLine = SVM.funcGetSVMBlankLine(iFeatureCount)
+        lsOutput = []
+        for iIndexOriginalOrder, sSample in enumerate(lsSampleOrdering):
+            sLine = dictLines.get(sSample,None)
+            if sLine is None:
+                lsOutput.append(sBlankLine)
+            else:
+                lsOutput.append(ConstantsBreadCrumbs.c_strBreadCrumbsSVMSpace.join([lsOriginalLabels[iIndexOriginalOrder],sLine]) if sLine else lsOriginalLabels[iIndexOriginalOrder])
+        SVM.funcWriteSVMLines(ostm, lsOutput)
+        ostm.close()
+        return set(lsOriginalLabels)
+
+    @staticmethod
+    def funcFactorizeLabels(lLabels):
+        """
+        Encodes labels as integer codes in one pass. Codes are given in the order labels first occur, so the first label is 0.
+
+        :param	lLabels:	List of labels to encode.
+        :type:	List
+        :return	List:	[lUniqueLabels (unique labels in order of first occurrence), npaCodes (numpy int array, code of each label)]
+        """
+
+        dictCodes = dict()
+        npaCodes = np.array([dictCodes.setdefault(xLabel,len(dictCodes)) for xLabel in lLabels], dtype=int)
+        lUniqueLabels = [None]*len(dictCodes)
+        for xLabel, iCode in dictCodes.items():
+            lUniqueLabels[iCode] = xLabel
+        return [lUniqueLabels, npaCodes]
+
     #Tested 5
     @staticmethod
     def funcMakeLabels(lsMetadata):
@@ -174,11 +282,9 @@ class SVM:
         """
         #Do not use a set to make elements unique. Need to preserve order.
         #First label should be 0
-        lsUniqueLabels = []
-        [lsUniqueLabels.append(sElement) for sElement in lsMetadata if not (sElement in lsUniqueLabels)]
-
-        dictLabels = dict([[str(lenuLabels[1]),str(lenuLabels[0])] for lenuLabels in enumerate(lsUniqueLabels)])
-        return [dictLabels[sLabel] for sLabel in lsMetadata]
+        lsUniqueLabels, npaCodes = SVM.funcFactorizeLabels(lsMetadata)
+        lsCodes = [str(iCode) for iCode in xrange(len(lsUniqueLabels))]
+        return [lsCodes[iCode] for iCode in npaCodes]
 
     #Tested
     @staticmethod
@@ -226,8 +332,8 @@ class SVM:
 
       #Change to {label:["sampleName1", "sampleName2"...],...}
       dictSampleLabelsRet = dict()
-      for sValue in set(lsOriginalLabels):  
-        dictSampleLabelsRet[sValue] = set([lsAllSampleNames[iindex] for iindex, sLabel in enumerate(lsOriginalLabels) if sLabel == sValue])
+      for sSample, sLabel in zip(lsAllSampleNames, lsOriginalLabels):
+        dictSampleLabelsRet.setdefault(sLabel,set()).add(sSample)
       return dictSampleLabelsRet
 
     #Tested
@@ -255,26 +361,18 @@ class SVM:
         :type	List
         :return	List:		[dictWeights ({"label":weight}),lUniqueLabels (unique occurences of original labels)]
         """
-        #Convert to dict
+        #Convert to codes
         #Do not use set to make elements unique. Need to preserve order.
         #First label should be 0
-        lUniqueLabels = []
-        for sElement in lLabels:
-            if sElement not in lUniqueLabels:
-                lUniqueLabels.append(sElement)
-        dictLabels = dict(zip(lUniqueLabels, range(len(lUniqueLabels))))
+        lUniqueLabels, npaCodes = SVM.funcFactorizeLabels(lLabels)
 
         #Build a dict of weights per label {label:weight, label:weight}
         #Get the occurrence of each label
-        dictWeights = dict()
-        for sLabelKey in dictLabels:
-            sCurLabel = dictLabels[sLabelKey]
-            dictWeights[sCurLabel] = lLabels.count(sLabelKey)
+        npaOccurences = np.bincount(npaCodes, minlength=len(lUniqueLabels))
 
         #Divide the highest occurrence each occurrence
-        iMaxOccurence = max(dictWeights.values())
-        for sWeightKey in dictWeights:
-            dictWeights[sWeightKey]=iMaxOccurence/float(dictWeights[sWeightKey])
+        iMaxOccurence = int(npaOccurences.max())
+        dictWeights = dict([(iCode, iMaxOccurence/float(iOccurence)) for iCode, iOccurence in enumerate(npaOccurences.tolist())])
 
         return [dictWeights,lUniqueLabels]
 
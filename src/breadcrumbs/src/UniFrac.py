@@ -0,0 +1,473 @@
+"""
+Author: Timothy Tickle
+Description: Weighted and unweighted UniFrac distances measured on flat tree arrays.
+"""
+
+#####################################################################################
+#Copyright (C) <2012>
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of
+#this software and associated documentation files (the "Software"), to deal in the
+#Software without restriction, including without limitation the rights to use, copy,
+#modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+#and to permit persons to whom the Software is furnished to do so, subject to
+#the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies
+#or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#####################################################################################
+
+__author__ = "Timothy Tickle"
+__copyright__ = "Copyright 2012"
+__credits__ = ["Timothy Tickle"]
+__license__ = "MIT"
+__maintainer__ = "Timothy Tickle"
+__email__ = "ttickle@sph.harvard.edu"
+__status__ = "Development"
+
+#Import libaries
+import hashlib
+import multiprocessing
+import numpy as np
+import os
+import re
+import scipy.sparse
+import scipy.spatial.distance
+
+#Data shared with the worker processes measuring blocks of the distance matrix
+#Set before the worker pool is created so it is inherited by the workers
+_dictSharedBlockData = dict()
+
+def _funcGetSharedDistanceBlock(tpleBlock):
+    """
+    Worker process entry point measuring one block of rows of the distance matrix (see UniFrac.funcGetDistanceBlock).
+
+    :param	tpleBlock:	(Start row, end row) of the block.
+    :type:	Tuple of integers
+    :return	Tuple:	(Start row, Numpy array block of distances)
+    """
+
+    return (tpleBlock[0],UniFrac.funcGetDistanceBlock(iStart=tpleBlock[0], iEnd=tpleBlock[1], **_dictSharedBlockData))
+
+class UniFrac:
+    """
+    Measures UniFrac distances (Lozupone and Knight 2005) without building tree objects.
+
+    The Newick tree is parsed once into flat arrays with children ordered before their parents (root last):
+    the parent index and branch length of each node and the name of each tip. Sample counts of tips are held
+    in a sparse sample x tip matrix which is carried to the internal nodes with a sparse tip x ancestor matrix.
+    Distances are then measured in blocks of rows (optionally on several processes) with matrix products
+    (unweighted) or city block distances of branch length weighted proportions (weighted).
+    Results match PyCogent fast_unifrac (including the root branch and sorting of samples from environment files).
+    """
+
+    #Rows of the distance matrix measured at a time
+    c_iDefaultBlockSize = 500
+
+    #Tokens of the Newick format
+    c_strNewickDelimiters = "(),:;"
+    c_reNewickToken = re.compile(r"'[^']*'?|[(),:;]|[^(),:;']+")
+
+    #Parsed trees {"key":(lsNodeNames, npaiParents, npadBranchLengths)}
+    _dictTreeCache = dict()
+
+    @staticmethod
+    def funcParseNewick(strNewick):
+        """
+        Parses a Newick tree into flat arrays without recursion.
+        Node order has children before their parents and the root last.
+        Names are kept as written (quotes are not removed and underscores are not changed, as in PyCogent's DndParser).
+
+        :param	strNewick:	Newick formatted tree.
+        :type:	String
+        :return	Tuple or Boolean:	(List of node names (None for unnamed nodes), Numpy array of parent indices (-1 for the root),
+                                	Numpy array of branch lengths (0 when not given)) or False on error.
+        """
+
+        #Skip comments before the tree
+        iTreeStart = strNewick.find("(")
+        if iTreeStart < 0:
+            print "UniFrac.funcParseNewick. Error= The tree did not contain any nodes."
+            return False
+        strNewick = strNewick[iTreeStart:]
+        if not strNewick.count("(") == strNewick.count(")"):
+            print "".join(["UniFrac.funcParseNewick. Error= Found ",str(strNewick.count("("))," left parens but ",str(strNewick.count(")"))," right parens."])
+            return False
+
+        #Nodes in the order they are read (parents before children)
+        lsNames = []
+        liParents = []
+        ldLengths = []
+
+        iCurrent = -1
+        fPostColon = False
+        fPostClosed = False
+        strLastToken = None
+        lsLabel = []
+        for strPiece in UniFrac.c_reNewickToken.findall(strNewick)+[";"]:
+            #Labels may be broken over several pieces (quoted and unquoted parts)
+            if not strPiece in UniFrac.c_strNewickDelimiters:
+                lsLabel.append(strPiece)
+                continue
+            strLabel = "".join(lsLabel).strip()
+            lsLabel = []
+            for strToken in ([strLabel, strPiece] if strLabel else [strPiece]):
+                if strToken == ":":
+                    fPostColon = True
+                    strLastToken = strToken
+                    continue
+                if strToken == ")":
+                    #Node without a name
+                    if strLastToken in ["(",","]:
+                        lsNames.append(None)
+                        liParents.append(iCurrent)
+                        ldLengths.append(0.0)
+                    else:
+                        iCurrent = liParents[iCurrent]
+                    fPostClosed = True
+                    strLastToken = strToken
+                    continue
+                if strToken == "(":
+                    lsNames.append(None)
+                    liParents.append(iCurrent)
+                    ldLengths.append(0.0)
+                    iCurrent = len(lsNames)-1
+                elif strToken == ";":
+                    break
+                elif strToken == ",":
+                    #Node without a name
+                    if strLastToken in ["(",","]:
+                        lsNames.append(None)
+                        liParents.append(iCurrent)
+                        ldLengths.append(0.0)
+                    else:
+                        iCurrent = liParents[iCurrent]
+                elif fPostColon:
+                    try:
+                        ldLengths[iCurrent] = float(strToken)
+                    except ValueError:
+                        print "UniFrac.funcParseNewick. Error= Could not read the branch length "+strToken
+                        return False
+                elif fPostClosed:
+                    lsNames[iCurrent] = strToken
+                else:
+                    lsNames.append(strToken)
+                    liParents.append(iCurrent)
+                    ldLengths.append(0.0)
+                    iCurrent = len(lsNames)-1
+                fPostColon = False
+                fPostClosed = False
+                strLastToken = strToken
+            if strPiece == ";":
+                break
+
+        if not lsNames or not iCurrent == 0:
+            print "UniFrac.funcParseNewick. Error= Did not get back to the root of the tree."
+            return False
+
+        #Reverse the read order so children come before their parents
+        iNodeCount = len(lsNames)
+        npaiParents = np.array(liParents[::-1], dtype=np.intp)
+        npaiParents[:-1] = (iNodeCount-1)-npaiParents[:-1]
+        return (lsNames[::-1], npaiParents, np.array(ldLengths[::-1], dtype=np.float64))
+
+    @staticmethod
+    def funcGetTree(istrmTree):
+        """
+        Returns the parsed tree (see UniFrac.funcParseNewick), parsing each tree only once.
+        Tree files are cached by path and modification, streams are cached by their content.
+
+        :param	istrmTree:	File path or stream of a Newick format file.
+        :type:	String or file stream
+        :return	Tuple or Boolean:	Parsed tree or False on error.
+        """
+
+        if isinstance(istrmTree, str):
+            strKey = "|".join([os.path.abspath(istrmTree),str(os.path.getmtime(istrmTree)),str(os.path.getsize(istrmTree))])
+            tplTree = UniFrac._dictTreeCache.get(strKey,None)
+            if tplTree is None:
+                with open(istrmTree,"r") as hndlTree:
+                    tplTree = UniFrac.funcParseNewick(hndlTree.read())
+        else:
+            strNewick = istrmTree.read()
+            strKey = hashlib.sha1(strNewick).hexdigest()
+            tplTree = UniFrac._dictTreeCache.get(strKey,None)
+            if tplTree is None:
+                tplTree = UniFrac.funcParseNewick(strNewick)
+
+        if tplTree:
+            UniFrac._dictTreeCache[strKey] = tplTree
+        return tplTree
+
+    @staticmethod
+    def funcGetTipIndices(tplTree):
+        """
+        Returns the node index of each named tip of the tree.
+
+        :param	tplTree:	Parsed tree (see UniFrac.funcParseNewick).
+        :type:	Tuple
+        :return	Dictionary:	{"Tip name":node index}
+        """
+
+        lsNames, npaiParents, npadLengths = tplTree
+        npaiChildCounts = np.bincount(npaiParents[:-1], minlength=len(lsNames))
+        return dict([[lsNames[iNode],iNode] for iNode in np.flatnonzero(npaiChildCounts == 0) if not lsNames[iNode] is None])
+
+    @staticmethod
+    def funcReadEnvironmentFile(istrmEnvr, dictTipIndices):
+        """
+        Reads an environment file (sequence, sample and optional count per line) into a sample x tip count matrix.
+        As in PyCogent, later counts of the same sequence and sample replace earlier ones and sequences not
+        in the tree are ignored. Samples are sorted by name.
+
+        :param	istrmEnvr:	File path or stream of the environment file.
+        :type:	String or file stream
+        :param	dictTipIndices:	{"Tip name":node index} (see UniFrac.funcGetTipIndices).
+        :type:	Dictionary
+        :return	Tuple:	(List of sample names, Numpy array of tip node indices, scipy sparse matrix of counts (samples x tips))
+        """
+
+        #{(sequence,sample):count}
+        dictCounts = dict()
+        hndlEnvr = open(istrmEnvr,"r") if isinstance(istrmEnvr, str) else istrmEnvr
+        for strLine in hndlEnvr:
+            lsFields = strLine.split()
+            if len(lsFields) < 2:
+                continue
+            if lsFields[0] in dictTipIndices:
+                dictCounts[(lsFields[0],lsFields[1])] = int(lsFields[2]) if len(lsFields) > 2 else 1
+        if isinstance(istrmEnvr, str):
+            hndlEnvr.close()
+
+        lsSampleNames = sorted(set([tplKey[1] for tplKey in dictCounts]))
+        lsTipNames = sorted(set([tplKey[0] for tplKey in dictCounts]))
+        dictSampleIndex = dict([[sName,iIndex] for iIndex, sName in enumerate(lsSampleNames)])
+        dictTipColumn = dict([[sName,iIndex] for iIndex, sName in enumerate(lsTipNames)])
+
+        lsKeys = dictCounts.keys()
+        spmCounts = scipy.sparse.csr_matrix(([dictCounts[tplKey] for tplKey in lsKeys],
+                       ([dictSampleIndex[tplKey[1]] for tplKey in lsKeys],[dictTipColumn[tplKey[0]] for tplKey in lsKeys])),
+                       shape=(len(lsSampleNames),len(lsTipNames)), dtype=np.float64)
+        return (lsSampleNames, np.array([dictTipIndices[sName] for sName in lsTipNames], dtype=np.intp), spmCounts)
+
+    @staticmethod
+    def funcGetAncestorMatrix(npaiParents, npaiTips):
+        """
+        Builds the sparse tip x node matrix indicating which nodes are on the path from each tip to the root
+        (including the tip and the root). Only nodes on at least one of these paths are kept.
+
+        :param	npaiParents:	Parent index of each node (-1 for the root).
+        :type:	Numpy array
+        :param	npaiTips:	Node index of each tip of interest.
+        :type:	Numpy array
+        :return	Tuple:	(scipy sparse matrix (tips x kept nodes), Numpy array of the node index of each kept node)
+        """
+
+        liRows = []
+        liNodes = []
+        npaiRows = np.arange(len(npaiTips))
+        npaiCurrent = np.asarray(npaiTips, dtype=np.intp)
+        #Walk all tips up a level at a time
+        while len(npaiCurrent):
+            liRows.append(npaiRows)
+            liNodes.append(npaiCurrent)
+            npaiCurrent = npaiParents[npaiCurrent]
+            npafKeep = npaiCurrent >= 0
+            npaiRows = npaiRows[npafKeep]
+            npaiCurrent = npaiCurrent[npafKeep]
+
+        npaiRows = np.concatenate(liRows) if liRows else np.zeros(0, dtype=np.intp)
+        npaiKeptNodes, npaiColumns = np.unique(np.concatenate(liNodes) if liNodes else np.zeros(0, dtype=np.intp), return_inverse=True)
+        return (scipy.sparse.csr_matrix((np.ones(len(npaiRows)),(npaiRows,npaiColumns)), shape=(len(npaiTips),len(npaiKeptNodes))), npaiKeptNodes)
+
+    @staticmethod
+    def funcGetDistanceBlock(npaBranchPresence, npaPresence, npadTotals, npadProportions, fWeighted, iStart, iEnd):
+        """
+        Measures the distances from a block of samples to the samples after them (upper triangle rows).
+
+        :param	npaBranchPresence:	Sparse sample x node presence weighted by branch length (unweighted).
+        :param	npaPresence:	Sparse sample x node presence (unweighted).
+        :param	npadTotals:	Branch length covered by each sample (unweighted).
+        :param	npadProportions:	Dense sample x node proportions weighted by branch length (weighted).
+        :param	fWeighted:	True measures weighted UniFrac.
+        :type:	Boolean
+        :param	iStart:	First row of the block.
+        :type:	Integer
+        :param	iEnd:	Row after the last row of the block.
+        :type:	Integer
+        :return	Numpy array:	Distances of the block rows to samples iStart and above.
+        """
+
+        if fWeighted:
+            return scipy.spatial.distance.cdist(npadProportions[iStart:iEnd], npadProportions[iStart:], "cityblock")
+
+        #Shared branch length over the union of branch length
+        #Two samples without branches (no abundance on the tree) have no union and are not distant
+        npadShared = np.asarray((npaBranchPresence[iStart:iEnd]*npaPresence[iStart:].T).todense())
+        npadUnion = npadTotals[iStart:iEnd,np.newaxis]+npadTotals[np.newaxis,iStart:]-npadShared
+        npafEmpty = npadUnion <= 0
+        npadUnion[npafEmpty] = 1.0
+        npadShared[npafEmpty] = 1.0
+        return 1.0-(npadShared/npadUnion)
+
+    @staticmethod
+    def funcGetDistanceMatrix(tplTree, npaiTips, spmCounts, fWeighted=True, iBlockSize=None, iProcesses=1):
+        """
+        Measures UniFrac between all samples.
+
+        :param	tplTree:	Parsed tree (see UniFrac.funcParseNewick).
+        :type:	Tuple
+        :param	npaiTips:	Node index of each column of spmCounts.
+        :type:	Numpy array
+        :param	spmCounts:	Counts of tips (sample x tip), dense or scipy sparse.
+        :type:	Numpy array or scipy sparse matrix
+        :param	fWeighted:	True measures weighted UniFrac, False unweighted.
+        :type:	Boolean
+        :param	iBlockSize:	Rows measured at a time (None uses UniFrac.c_iDefaultBlockSize).
+        :type:	Integer
+        :param	iProcesses:	Number of processes measuring blocks.
+        :type:	Integer
+        :return	Numpy array:	Square distance matrix in the sample order of spmCounts.
+        """
+
+        lsNames, npaiParents, npadLengths = tplTree
+        spmCounts = scipy.sparse.csr_matrix(spmCounts, dtype=np.float64)
+        iSampleCount = spmCounts.shape[0]
+        iBlockSize = iBlockSize or UniFrac.c_iDefaultBlockSize
+
+        #Carry tip counts to every ancestor
+        spmAncestors, npaiNodes = UniFrac.funcGetAncestorMatrix(npaiParents=npaiParents, npaiTips=npaiTips)
+        npadBranchLengths = npadLengths[npaiNodes]
+
+        dictBlockData = {"npaBranchPresence":None, "npaPresence":None, "npadTotals":None, "npadProportions":None, "fWeighted":fWeighted}
+        if fWeighted:
+            #Proportion of each sample under each node weighted by branch length
+            #Samples without counts keep proportions of 0, their distance to a sample is the weighted branch length of that sample
+            npadSampleTotals = np.asarray(spmCounts.sum(axis=1)).ravel()
+            npadSampleTotals[npadSampleTotals == 0] = 1.0
+            npadProportions = np.asarray((spmCounts*spmAncestors).todense())
+            npadProportions /= npadSampleTotals[:,np.newaxis]
+            npadProportions *= npadBranchLengths[np.newaxis,:]
+            dictBlockData["npadProportions"] = npadProportions
+        else:
+            spmPresence = (scipy.sparse.csr_matrix(spmCounts != 0, dtype=np.float64)*spmAncestors)
+            spmPresence = scipy.sparse.csr_matrix(spmPresence > 0, dtype=np.float64)
+            spmBranchPresence = scipy.sparse.csr_matrix(spmPresence.multiply(npadBranchLengths[np.newaxis,:]))
+            dictBlockData["npaPresence"] = spmPresence
+            dictBlockData["npaBranchPresence"] = spmBranchPresence
+            dictBlockData["npadTotals"] = np.asarray(spmBranchPresence.sum(axis=1)).ravel()
+
+        #Measure the upper triangle in blocks of rows
+        ltpleBlocks = [(iStart,min(iStart+iBlockSize,iSampleCount)) for iStart in xrange(0,iSampleCount,iBlockSize)]
+        npadDistances = np.zeros((iSampleCount,iSampleCount))
+        #Worker processes (for instance running strata) can not start pools
+        if iProcesses > 1 and len(ltpleBlocks) > 1 and not multiprocessing.current_process().daemon:
+            _dictSharedBlockData.update(dictBlockData)
+            try:
+                mpPool = multiprocessing.Pool(processes=min(iProcesses,len(ltpleBlocks)))
+                lBlocks = mpPool.map(_funcGetSharedDistanceBlock, ltpleBlocks)
+                mpPool.close()
+                mpPool.join()
+            finally:
+                _dictSharedBlockData.clear()
+        else:
+            lBlocks = [(tpleBlock[0],UniFrac.funcGetDistanceBlock(iStart=tpleBlock[0], iEnd=tpleBlock[1], **dictBlockData)) for tpleBlock in ltpleBlocks]
+        for iStart, npadBlock in lBlocks:
+            npadDistances[iStart:iStart+npadBlock.shape[0],iStart:] = npadBlock
+
+        #Mirror the upper triangle
+        npadDistances = np.triu(npadDistances, k=1)
+        return npadDistances+npadDistances.T
+
+    @staticmethod
+    def funcGetUnifracDistanceFromFiles(istrmTree, istrmEnvr, fWeighted=True, iBlockSize=None, iProcesses=1):
+        """
+        Measures UniFrac from a tree and environment file.
+
+        :param	istrmTree:	File path or stream of a Newick format file.
+        :type:	String or file stream
+        :param	istrmEnvr:	File path or stream of an environment file (sequence, sample and optional count per line).
+        :type:	String or file stream
+        :param	fWeighted:	True measures weighted UniFrac, False unweighted.
+        :type:	Boolean
+        :return	Tuple or Boolean:	(Square distance matrix, list of sample names (sorted)) or False on error.
+        """
+
+        tplTree = UniFrac.funcGetTree(istrmTree)
+        if not tplTree:
+            return False
+        lsSampleNames, npaiTips, spmCounts = UniFrac.funcReadEnvironmentFile(istrmEnvr, UniFrac.funcGetTipIndices(tplTree))
+        if not lsSampleNames:
+            print "UniFrac.funcGetUnifracDistanceFromFiles. Error= No valid samples/environments found. Check whether tree tips match otus/taxa present in samples/environments."
+            return False
+        return (UniFrac.funcGetDistanceMatrix(tplTree=tplTree, npaiTips=npaiTips, spmCounts=spmCounts, fWeighted=fWeighted,
+                                             iBlockSize=iBlockSize, iProcesses=iProcesses), lsSampleNames)
+
+    @staticmethod
+    def funcGetUnifracDistanceFromAbundance(istrmTree, npaAbundance, lsSampleNames, lsFeatureNames, fWeighted=True, iBlockSize=None, iProcesses=1):
+        """
+        Measures UniFrac from a tree and an abundance matrix (instead of an environment file).
+        Features are matched to tips of the tree by name, features not in the tree are ignored.
+        Samples without any abundance in the tree are kept, they are at distance 0 from each other and (unweighted) 1 from other samples
+        or (weighted) the weighted branch length of the other sample.
+
+        :param	istrmTree:	File path or stream of a Newick format file.
+        :type:	String or file stream
+        :param	npaAbundance:	Abundance where row=samples and columns=features.
+        :type:	Numpy array
+        :param	lsSampleNames:	Sample name of each row.
+        :type:	List of strings
+        :param	lsFeatureNames:	Feature name of each column.
+        :type:	List of strings
+        :param	fWeighted:	True measures weighted UniFrac, False unweighted.
+        :type:	Boolean
+        :return	Tuple or Boolean:	(Square distance matrix, list of sample names) or False on error.
+        """
+
+        tplTree = UniFrac.funcGetTree(istrmTree)
+        if not tplTree:
+            return False
+        dictTipIndices = UniFrac.funcGetTipIndices(tplTree)
+
+        #Features on the tree
+        liColumns = [iIndex for iIndex, sFeature in enumerate(lsFeatureNames) if sFeature in dictTipIndices]
+        npaiTips = np.array([dictTipIndices[lsFeatureNames[iIndex]] for iIndex in liColumns], dtype=np.intp)
+        npadCounts = np.asarray(npaAbundance, dtype=np.float64)[:,liColumns]
+
+        #Samples with abundance on the tree
+        npafEmpty = ~np.any(npadCounts != 0, axis=1)
+        if np.all(npafEmpty):
+            print "UniFrac.funcGetUnifracDistanceFromAbundance. Error= No valid samples found. Check whether tree tips match the feature names."
+            return False
+        if np.any(npafEmpty):
+            print "".join(["UniFrac.funcGetUnifracDistanceFromAbundance. Warning= Samples without abundance on the tree: ",
+                           ", ".join([lsSampleNames[iIndex] for iIndex in np.flatnonzero(npafEmpty)])])
+        return (UniFrac.funcGetDistanceMatrix(tplTree=tplTree, npaiTips=npaiTips, spmCounts=npadCounts, fWeighted=fWeighted,
+                                             iBlockSize=iBlockSize, iProcesses=iProcesses), list(lsSampleNames))
+
+    @staticmethod
+    def funcGetUnifracDistanceFromAbundanceTable(abndTable, istrmTree, fWeighted=True, iBlockSize=None, iProcesses=1):
+        """
+        Measures UniFrac from a tree and an abundance table (see UniFrac.funcGetUnifracDistanceFromAbundance).
+
+        :param	abndTable:	Abundance table with features named as the tips of the tree.
+        :type:	AbundanceTable
+        :param	istrmTree:	File path or stream of a Newick format file.
+        :type:	String or file stream
+        :param	fWeighted:	True measures weighted UniFrac, False unweighted.
+        :type:	Boolean
+        :return	Tuple or Boolean:	(Square distance matrix, list of sample names) or False on error.
+        """
+
+        lsSampleNames = list(abndTable.funcGetSampleNames())
+        return UniFrac.funcGetUnifracDistanceFromAbundance(istrmTree=istrmTree,
+                   npaAbundance=abndTable.funcGetSampleAbundanceMatrix(dtype=np.float64),
+                   lsSampleNames=lsSampleNames, lsFeatureNames=list(abndTable.funcGetFeatureNames()), fWeighted=fWeighted,
+                   iBlockSize=iBlockSize, iProcesses=iProcesses)
@@ -107,6 +107,36 @@ class UtilityMath():
             return lsSampling
         return []
 
+    @staticmethod
+    def funcGetTopIndices(npadMatrix, iTopAmount=None):
+        """
+        Gets the indices of the highest values of each row, highest first. Ties are ordered by index.
+        Uses a partial sort (argpartition) so only the selected values are sorted.
+
+        :param	npadMatrix:	Measurements (rows) x samples (columns), or one row of measurements.
+        :type	Numpy Array	or List of lists
+        :param	iTopAmount:	Number of indices to return from each row (None returns all).
+        :type	Integer
+        :return	List	List of lists of indices, one list per row.
+        """
+
+        npadMatrix = np.atleast_2d(np.asarray(npadMatrix, dtype=float))
+        iColumns = npadMatrix.shape[1]
+        iTopAmount = iColumns if iTopAmount is None else max(0, min(iTopAmount, iColumns))
+        if not iTopAmount:
+            return [[] for npadRow in npadMatrix]
+
+        #Lowest value still selected in each row, values tied with it are all candidates
+        npadLast = -np.partition(-npadMatrix, iTopAmount-1, axis=1)[:,iTopAmount-1]
+
+        lliTopRet = []
+        for npadRow, dLast in zip(npadMatrix, npadLast):
+            npaiCandidates = np.flatnonzero(npadRow >= dLast)
+            #Stable sort of the candidates (in index order) by decreasing value
+            npaiCandidates = npaiCandidates[np.argsort(-npadRow[npaiCandidates], kind="mergesort")]
+            lliTopRet.append(npaiCandidates[:iTopAmount].tolist())
+        return lliTopRet
+
     #Happy Path Tested 2
     @staticmethod
     def funcSumRowsOfColumns(npaAbundance, lsSampleNames):
@@ -127,6 +157,36 @@ class UtilityMath():
             npPooledSample = npPooledSample + npaAbundance[strSampleName]
         return list(npPooledSample)
 
+    @staticmethod
+    def funcGetFieldMatrix(npaStructured, lsFields):
+        """
+        Returns fields of a structured array as a 2D array (rows x fields).
+        If the fields share one type and lie next to each other in each record (as the samples of an abundance table do)
+        the records are reinterpreted in place and no data is copied, otherwise the fields are stacked into a new array.
+
+        :param	npaStructured:	One dimensional structured array.
+        :type	Numpy Array
+        :param	lsFields:	Names of the fields, in order.
+        :type	List	List of strings.
+        :return	Numpy Array:	Array of rows x fields.
+        """
+
+        lsFields = list(lsFields)
+        if not len(lsFields):
+            return np.zeros((npaStructured.shape[0],0))
+
+        dictFields = npaStructured.dtype.fields
+        dtypeField = dictFields[lsFields[0]][0]
+        iFirstOffset = dictFields[lsFields[0]][1]
+        fBlock = (not dtypeField.fields) and (not dtypeField.shape) and all([(dictFields[sField][0] == dtypeField) and
+                 (dictFields[sField][1] == iFirstOffset+iIndex*dtypeField.itemsize) for iIndex, sField in enumerate(lsFields)])
+        if fBlock:
+            #A single field holding all the given fields as a subarray
+            dtypeBlock = np.dtype({"names":["block"], "formats":[(dtypeField,(len(lsFields),))], "offsets":[iFirstOffset],
+                                   "itemsize":npaStructured.dtype.itemsize})
+            return npaStructured.view(dtypeBlock)["block"]
+        return np.column_stack([npaStructured[sField] for sField in lsFields])
+
     #Testing Status: Light happy path testing 2
     @staticmethod
     def funcTransposeDataMatrix(npaMatrix, fRemoveAdornments=False):
@@ -151,6 +211,14 @@ class UtilityMath():
 
         #Change to samples x taxa as is needed for the compute method below
         #Also remove the first row which is taxa identification
+        #Arrays of one type are transposed in one contiguous copy, without boxing values in lists
+        iStart = int(fRemoveAdornments)
+        if npaMatrix.dtype.names:
+            lsFields = npaMatrix.dtype.names[iStart:]
+            if len(set([npaMatrix.dtype.fields[sField][0] for sField in lsFields])) == 1:
+                return np.ascontiguousarray(UtilityMath.funcGetFieldMatrix(npaMatrix, lsFields).T)
+        elif npaMatrix.ndim == 2:
+            return np.ascontiguousarray(npaMatrix[:,iStart:].T)
         conversionMatrix = [list(row)[fRemoveAdornments:] for row in npaMatrix]
         return np.array(conversionMatrix).transpose()
 